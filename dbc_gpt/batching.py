@@ -0,0 +1,100 @@
+import os
+import re
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+# The implementation contract of a merge, e.g. "contract ERC20 is IERC20 {" (the last one of the file)
+CONTRACT_PATTERN = re.compile(r'^contract\s+(\w+)\b', re.MULTILINE)
+# e.g. "ERC20_candidate1::transfer: OK"
+BATCH_RESULT_PATTERN = re.compile(r'^(\w+)_candidate(\d+)::([\w\[\]]+): ([A-Z]+)\s*$')
+# e.g. " - ./ERC20_merge_batch.sol:71:5: Postcondition '...' might not hold at end of function."
+LOCATION_PATTERN = re.compile(r'^ - (.*?):(\d+):(\d+): ')
+SUMMARY_LINES = ("Errors were found by the verifier.", "No errors found.")
+
+
+@dataclass
+class Candidate:
+    # First line of the contract in the merge of the candidate and in the batch (1-based)
+    start: int
+    batch_start: int
+    lines: int
+
+    def batch_line(self, line: int) -> bool:
+        return self.batch_start <= line < self.batch_start + self.lines
+
+    def merge_line(self, batch_line: int) -> int:
+        return batch_line - self.batch_start + self.start
+
+
+class Batch:
+    """
+    Several merged contracts (one per candidate specification of the same
+    template) in a single file, verified by a single solc-verify run: the
+    imports of the first merge, then a copy of the implementation contract
+    of every candidate, renamed ERC20_candidate0, ERC20_candidate1, ... The
+    functions keep their names, so the overrides of the interfaces still
+    hold. split maps the output back to the output of each candidate.
+    """
+
+    def __init__(self, merges: Sequence[str]) -> None:
+        self.candidates: List[Candidate] = []
+        parts = []
+        line = 1
+        for index, merge in enumerate(merges):
+            contract = list(CONTRACT_PATTERN.finditer(merge))[-1]
+            start = merge.count("\n", 0, contract.start()) + 1
+            if not parts:
+                parts.append(merge[:contract.start()])
+                line = start
+            body = merge[contract.end():]
+            if not body.endswith("\n"):
+                body += "\n"
+            parts.append(f"contract {contract.group(1)}_candidate{index}{body}")
+            lines = body.count("\n")
+            self.candidates.append(Candidate(start, line, lines))
+            line += lines
+        self.text = "".join(parts)
+
+    def candidate_at(self, batch_line: int) -> Optional[int]:
+        return next((index for index, candidate in enumerate(self.candidates) if candidate.batch_line(batch_line)),
+                    None)
+
+    def split(self, output: str, batch_path: str, merge_path: str) -> List[Tuple[int, Optional[str]]]:
+        """
+        Returns the (status, output) solc-verify would have printed for each
+        candidate verified on its own in merge_path, None for the candidates
+        without any verdict (e.g. when the batch did not compile)
+        """
+        def rename(text: str) -> str:
+            # solc-verify prints the path it was given, or only the file name
+            return text.replace(batch_path, merge_path).replace(os.path.basename(batch_path),
+                                                                 os.path.basename(merge_path))
+
+        verdicts = [[] for _ in self.candidates]
+        outputs = [[] for _ in self.candidates]
+        for output_line in output.splitlines():
+            result = BATCH_RESULT_PATTERN.match(output_line)
+            location = LOCATION_PATTERN.match(output_line)
+            if result and int(result.group(2)) < len(self.candidates):
+                index = int(result.group(2))
+                verdicts[index].append(result.group(4))
+                outputs[index].append(f"{result.group(1)}::{result.group(3)}: {result.group(4)}")
+            elif location and os.path.basename(location.group(1)) == os.path.basename(batch_path) and \
+                    self.candidate_at(int(location.group(2))) is not None:
+                index = self.candidate_at(int(location.group(2)))
+                line = self.candidates[index].merge_line(int(location.group(2)))
+                outputs[index].append(f" - {rename(location.group(1))}:{line}:"
+                                      f"{location.group(3)}: {output_line[location.end():]}")
+            elif output_line.strip() not in SUMMARY_LINES:
+                # Errors in the imported files (e.g. SafeMath.sol) and lines without a location concern every candidate
+                for candidate_output in outputs:
+                    candidate_output.append(rename(output_line))
+        results = []
+        for candidate_verdicts, candidate_output in zip(verdicts, outputs):
+            if not candidate_verdicts:
+                results.append((1, None))
+                continue
+            failed = any(verdict != "OK" for verdict in candidate_verdicts)
+            candidate_output.append(SUMMARY_LINES[0] if failed else SUMMARY_LINES[1])
+            results.append((int(failed), "\n".join(candidate_output) + "\n"))
+        return results
@@ -0,0 +1,623 @@
+import glob
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from dbc_gpt import metrics, processes
+from dbc_gpt.timeouts import AdaptiveTimeouts
+from solc_verify_generator.main import SOLC
+
+BOOGIE_CMD = "boogie"
+# Options solc-verify runs Boogie with, /trace reports the verdict of every procedure
+BOOGIE_OPTIONS = ("/nologo", "/doModSetAnalysis", "/errorTrace:0", "/useArrayTheory", "/infer:j")
+# Arithmetic encoding of the translation, the solc-verify default
+ARITHMETIC = "int"
+# Per-procedure solver time limit in seconds, the solc-verify default
+SOLVER_TIMEOUT = 10
+TRANSLATION_CACHE_DIR = "./temp/bpl_cache"
+VERDICT_CACHE_DIR = "./temp/verdict_cache"
+# Verdicts that do not depend on the load of the machine, the only ones cached
+DEFINITIVE_VERDICTS = ("OK", "ERROR")
+# Verdict of a procedure Boogie did not check, e.g. because it crashed or the program does not type-check
+UNKNOWN = "UNKNOWN"
+NO_VERDICT = " - Boogie reported no verdict for this function"
+
+SOURCELOC_PATTERN = re.compile(r'\{:sourceloc "([^"]*)", (\d+), (\d+)\}')
+MESSAGE_PATTERN = re.compile(r'\{:message "(.*?)"\}')
+# e.g. 'procedure {:sourceloc "ERC20_merge.sol", 66, 5} {:message "ERC20::transfer"} transfer#123(...'
+PROCEDURE_PATTERN = re.compile(r'^procedure\s+((?:\{:[^}]*\}\s*)*)([^\s(]+)\s*\(', re.MULTILINE)
+VERIFYING_PATTERN = re.compile(r'^Verifying (\S+) \.\.\.\s*$', re.MULTILINE)
+TRACE_VERDICT_PATTERN = re.compile(r'^\s*\[[^\]]*\]\s+(verified|error|timed out|out of resource|out of memory)\s*$',
+                                   re.MULTILINE)
+BOOGIE_ERROR_PATTERN = re.compile(r'^.*?\((\d+),\d+\): Error\b.*$', re.MULTILINE)
+BOOGIE_RELATED_PATTERN = re.compile(r'^.*?\((\d+),\d+\): Related location\b.*$', re.MULTILINE)
+# Top-level declarations of the programs solc-verify generates start at the beginning of a line
+DECLARATION_PATTERN = re.compile(r'^(procedure|implementation|function|axiom|var|const|type)\b', re.MULTILINE)
+NAMED_DECLARATION_PATTERN = re.compile(r'^(?:procedure|implementation|function|type)\s+(?:\{:[^}]*\}\s*)*([^\s(<;=]+)')
+VARIABLE_DECLARATION_PATTERN = re.compile(r'^(?:var|const)\s+(?:unique\s+)?(?:\{:[^}]*\}\s*)*([^:]*):')
+# e.g. "_balances#25", "__verifier_sum_int" or "address_t"
+IDENTIFIER_PATTERN = re.compile(r"[A-Za-z_$][\w$.#'@]*")
+STRING_PATTERN = re.compile(r'"[^"]*"')
+# Ids of the Solidity AST nodes, in the names of the Boogie declarations, e.g. "#25"
+NODE_ID_PATTERN = re.compile(r'#\d+')
+
+# Boogie verdict -> solc-verify verdict, see VerificationResult.function_results. Running out of memory
+# refutes nothing, the limit of the data segment (see dbc_gpt.processes) or the load of the machine is at fault
+VERDICTS = {"verified": "OK", "error": "ERROR", "timed out": "TIMEOUT", "out of resource": "TIMEOUT",
+            "out of memory": UNKNOWN}
+
+
+@dataclass
+class ProcedureResult:
+    # Boogie procedure, e.g. "transfer#123"
+    procedure: str
+    verdict: str
+    # solc-verify style error lines, e.g. " - ERC20_merge.sol:66:5: Postcondition '...' might not hold ..."
+    errors: List[str] = field(default_factory=list)
+    seconds: float = 0.0
+    # Lines of the program the errors are reported at
+    locations: List[int] = field(default_factory=list)
+
+
+def merged_digest(merge_path: str, arithmetic: str = ARITHMETIC) -> str:
+    """
+    Hash of the merged contract and the translation options, the key of the
+    cached translations. The implementation files it imports never change.
+    """
+    digest = hashlib.sha256(f"arithmetic={arithmetic}\n".encode())
+    with open(merge_path, "rb") as merge_file:
+        digest.update(merge_file.read())
+    return digest.hexdigest()
+
+
+class TranslationCache:
+    """
+    Boogie programs translated from merged contracts, one .bpl file per
+    merged-source hash, kept across runs
+    """
+
+    def __init__(self, directory: str = TRANSLATION_CACHE_DIR) -> None:
+        self.directory = directory
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.directory, f"{digest}.bpl")
+
+    def get(self, digest: str) -> Optional[str]:
+        path = self.path(digest)
+        hit = os.path.isfile(path)
+        metrics.record_cache("translation", hit)
+        return path if hit else None
+
+    def put(self, digest: str, bpl_path: str) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        # Written under a temporary name first, concurrent jobs may translate the same contract
+        temporary_path = f"{self.path(digest)}.{os.getpid()}.{threading.get_ident()}"
+        shutil.copyfile(bpl_path, temporary_path)
+        os.replace(temporary_path, self.path(digest))
+        return self.path(digest)
+
+
+def translate(merge_path: str, output_dir: str, arithmetic: str = ARITHMETIC, timeout: Optional[float] = None,
+              memory_mb: Optional[int] = None) -> Tuple[Optional[str], str]:
+    """
+    Translates a merged contract to Boogie with the solc of solc-verify.
+    Returns the path of the .bpl (None if the translation failed) and the
+    compiler output.
+    """
+    command = [SOLC, "--boogie", merge_path, "-o", output_dir, "--overwrite", "--boogie-arith", arithmetic]
+    result = processes.run(command, timeout, memory_mb)
+    bpl_paths = glob.glob(os.path.join(output_dir, "*.bpl"))
+    if result.returncode or not bpl_paths:
+        return None, result.stdout + result.stderr
+    return bpl_paths[0], result.stdout + result.stderr
+
+
+def boogie_command(bpl_path: str, solver: str = "z3", solver_timeout: Optional[float] = SOLVER_TIMEOUT,
+                   extra_options: Tuple[str, ...] = (), procedures: Sequence[str] = ()) -> List[str]:
+    command = [BOOGIE_CMD, bpl_path, *BOOGIE_OPTIONS, "/trace", *(f"/proc:{procedure}" for procedure in procedures)]
+    if solver_timeout:
+        command.append(f"/timeLimit:{int(solver_timeout)}")
+    if solver == "cvc4":
+        command += ["/proverOpt:SOLVER=CVC4", f"/cvc4exe:{shutil.which('cvc4') or 'cvc4'}",
+                    "/proverOpt:LOGIC=ALL_SUPPORTED"]
+    elif shutil.which("z3"):
+        command.append(f"/z3exe:{shutil.which('z3')}")
+    return command + list(extra_options)
+
+
+def procedure_messages(bpl_text: str) -> Dict[str, str]:
+    """
+    Returns [$procedure] -> "Contract::function" of the procedures
+    solc-verify reports on, those with a {:message} attribute
+    """
+    messages = {}
+    for match in PROCEDURE_PATTERN.finditer(bpl_text):
+        message = MESSAGE_PATTERN.search(match.group(1))
+        if message:
+            messages[match.group(2)] = message.group(1)
+    return messages
+
+
+def error_line(bpl_lines: List[str], location: int) -> Optional[str]:
+    """
+    Returns the solc-verify error line of the assertion at this (1-based)
+    line of the program, from its {:sourceloc} and {:message} attributes
+    """
+    line = bpl_lines[location - 1] if 0 < location <= len(bpl_lines) else ""
+    sourceloc, message = SOURCELOC_PATTERN.search(line), MESSAGE_PATTERN.search(line)
+    if not sourceloc or not message:
+        return None
+    return f" - {sourceloc.group(1)}:{sourceloc.group(2)}:{sourceloc.group(3)}: {message.group(1)}"
+
+
+def error_locations(bpl_lines: List[str], boogie_output: str, start: int, end: int) -> List[int]:
+    """
+    Maps the Boogie errors between start and end back to the lines of the
+    program they are reported at: the failing assertion or its related
+    location (e.g. the postcondition), whichever has source attributes
+    """
+    locations = []
+    errors = list(BOOGIE_ERROR_PATTERN.finditer(boogie_output, start, end))
+    for position, error in enumerate(errors):
+        error_end = errors[position + 1].start() if position + 1 < len(errors) else end
+        candidates = [int(related.group(1)) for related in
+                      BOOGIE_RELATED_PATTERN.finditer(boogie_output, error.end(), error_end)] + [int(error.group(1))]
+        for location in candidates:
+            if error_line(bpl_lines, location):
+                locations.append(location)
+                break
+    return locations
+
+
+def parse_trace(bpl_text: str, boogie_output: str, procedures: Sequence[str] = ()) -> List[ProcedureResult]:
+    """
+    Returns the verdicts of the given procedures (all the reported ones by
+    default) from the /trace output of Boogie, UNKNOWN for those it has no
+    verdict for
+    """
+    bpl_lines = bpl_text.split("\n")
+    reported = procedure_messages(bpl_text)
+    results = {}
+    blocks = list(VERIFYING_PATTERN.finditer(boogie_output))
+    for position, block in enumerate(blocks):
+        end = blocks[position + 1].start() if position + 1 < len(blocks) else len(boogie_output)
+        procedure = block.group(1)
+        if procedure not in reported:
+            continue
+        verdict = TRACE_VERDICT_PATTERN.search(boogie_output, block.end(), end)
+        seconds = re.search(r'\[([\d.]+) s', verdict.group(0)) if verdict else None
+        locations = error_locations(bpl_lines, boogie_output, block.end(), end)
+        # A procedure without a verdict line was stopped while it was solved, e.g. Boogie crashed
+        results[procedure] = ProcedureResult(procedure, VERDICTS[verdict.group(1)] if verdict else UNKNOWN,
+                                             [error_line(bpl_lines, location) for location in locations],
+                                             float(seconds.group(1)) if seconds else 0.0, locations)
+    return [results.get(procedure) or ProcedureResult(procedure, UNKNOWN, [NO_VERDICT])
+            for procedure in procedures or reported]
+
+
+@dataclass
+class Declaration:
+    kind: str
+    names: List[str]
+    # Lines of the program the declaration spans, [start, end) and 0-based
+    start: int
+    end: int
+    text: str
+
+    @property
+    def identifiers(self) -> Set[str]:
+        # Identifiers the declaration refers to, those in messages excluded
+        return set(IDENTIFIER_PATTERN.findall(STRING_PATTERN.sub("", self.text)))
+
+
+def parse_declarations(bpl_text: str) -> List[Declaration]:
+    lines = bpl_text.split("\n")
+    starts = [index for index, line in enumerate(lines) if DECLARATION_PATTERN.match(line)]
+    declarations = []
+    for position, start in enumerate(starts):
+        end = starts[position + 1] if position + 1 < len(starts) else len(lines)
+        text = "\n".join(lines[start:end])
+        named = NAMED_DECLARATION_PATTERN.match(text)
+        variables = VARIABLE_DECLARATION_PATTERN.match(text)
+        if named:
+            names = [named.group(1)]
+        elif variables:
+            names = [name.strip() for name in variables.group(1).split(",")]
+        else:
+            names = []
+        declarations.append(Declaration(DECLARATION_PATTERN.match(text).group(1), names, start, end, text))
+    return declarations
+
+
+class ProgramIndex:
+    """
+    Declarations of a Boogie program and their dependencies, to key the
+    verdict of a procedure by its text and the text of every declaration it
+    depends on (variables, functions, types, called procedures and the
+    axioms about them)
+    """
+
+    def __init__(self, bpl_text: str) -> None:
+        self.declarations = parse_declarations(bpl_text)
+        # [$name] -> indexes of the declarations of that name, e.g. a procedure and its implementation
+        self.by_name: Dict[str, List[int]] = {}
+        for index, declaration in enumerate(self.declarations):
+            for name in declaration.names:
+                self.by_name.setdefault(name, []).append(index)
+
+    def dependencies(self, procedure: str) -> List[Declaration]:
+        """
+        Returns the declarations of the procedure, then those it depends on
+        (transitively) in the order of the program
+        """
+        names: Set[str] = set()
+        # Indexes of the declarations included
+        included: Set[int] = set()
+        pending = [procedure]
+        while pending:
+            name = pending.pop()
+            if name in names:
+                continue
+            names.add(name)
+            for index in self.by_name.get(name, []):
+                if index not in included:
+                    included.add(index)
+                    pending.extend(self.declarations[index].identifiers - names)
+            if not pending:
+                # Axioms constrain what they mention, they are added once all their names are known
+                for index, axiom in enumerate(self.declarations):
+                    if axiom.kind == "axiom" and index not in included and axiom.identifiers & names:
+                        included.add(index)
+                        pending.extend(axiom.identifiers - names)
+        included_declarations = [self.declarations[index] for index in sorted(included)]
+        return [declaration for declaration in included_declarations if procedure in declaration.names] + \
+            [declaration for declaration in included_declarations if procedure not in declaration.names]
+
+    @staticmethod
+    def canonical_text(declarations: List[Declaration]) -> str:
+        """
+        Returns the text of the declarations without their source locations
+        and with the AST node ids numbered in order of appearance, as both
+        change when an annotation is added to a function above
+        """
+        text = SOURCELOC_PATTERN.sub("", "\n".join(declaration.text for declaration in declarations))
+        ids: Dict[str, str] = {}
+        return NODE_ID_PATTERN.sub(lambda match: ids.setdefault(match.group(0), f"#{len(ids)}"), text)
+
+    def key(self, procedure: str, salt: str = "") -> str:
+        """
+        Parameters
+            salt: the solver configuration, verdicts of different solvers are cached separately
+        """
+        text = self.canonical_text(self.dependencies(procedure))
+        return hashlib.sha256(f"{salt}\n{text}".encode()).hexdigest()
+
+    def entry(self, result: ProcedureResult) -> dict:
+        """
+        Returns the cache entry of a verdict, its errors are located relative
+        to the dependencies of the procedure, see result
+        """
+        dependencies = self.dependencies(result.procedure)
+        errors = []
+        for location, text in zip(result.locations, result.errors):
+            position = next((position for position, declaration in enumerate(dependencies)
+                             if declaration.start <= location - 1 < declaration.end), None)
+            errors.append([position, location - 1 - dependencies[position].start] if position is not None else text)
+        return {"verdict": result.verdict, "errors": errors}
+
+    def result(self, procedure: str, entry: dict, bpl_lines: List[str]) -> ProcedureResult:
+        """
+        Returns the cached verdict of the procedure, with its errors mapped
+        to the current source locations
+        """
+        dependencies = self.dependencies(procedure)
+        errors, locations = [], []
+        for error in entry["errors"]:
+            if isinstance(error, str):
+                errors.append(error)
+                continue
+            location = dependencies[error[0]].start + error[1] + 1
+            locations.append(location)
+            errors.append(error_line(bpl_lines, location))
+        return ProcedureResult(procedure, entry["verdict"], errors, locations=locations)
+
+
+class VerdictCache:
+    """
+    Verdicts of Boogie procedures, one JSON file per key (see
+    ProgramIndex.key), kept across runs
+    """
+
+    def __init__(self, directory: str = VERDICT_CACHE_DIR) -> None:
+        self.directory = directory
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str) -> Optional[dict]:
+        try:
+            with open(self.path(key)) as entry_file:
+                entry = json.load(entry_file)
+        except (OSError, ValueError):
+            entry = None
+        metrics.record_cache("verdict", entry is not None)
+        return entry
+
+    def put(self, key: str, entry: dict) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        temporary_path = f"{self.path(key)}.{os.getpid()}.{threading.get_ident()}"
+        with open(temporary_path, "w") as entry_file:
+            json.dump(entry, entry_file)
+        os.replace(temporary_path, self.path(key))
+
+
+def report(bpl_text: str, results: List[ProcedureResult]) -> Tuple[int, str]:
+    """
+    Returns the status and output solc-verify would print for these verdicts.
+    A reported procedure without any verdict was not verified, it fails.
+    """
+    messages = procedure_messages(bpl_text)
+    verdicts = {result.procedure: result for result in results}
+    results = [verdicts.get(procedure) or ProcedureResult(procedure, UNKNOWN, [NO_VERDICT]) for procedure in messages] \
+        + [result for result in results if result.procedure not in messages]
+    lines = []
+    for result in results:
+        lines.append(f"{messages.get(result.procedure, result.procedure)}: {result.verdict}")
+        lines += result.errors
+    failed = any(result.verdict != "OK" for result in results)
+    lines.append("Errors were found by the verifier." if failed else "No errors found.")
+    return int(failed), "\n".join(lines) + "\n"
+
+
+def solve(bpl_path: str, timeout: Optional[float] = None, solver: str = "z3",
+          solver_timeout: Optional[float] = SOLVER_TIMEOUT, procedures: Sequence[str] = (),
+          memory_mb: Optional[int] = None) -> List[ProcedureResult]:
+    """
+    Solves the given procedures of the program, all of them by default.
+    Raises subprocess.TimeoutExpired if Boogie runs for longer than timeout
+    seconds, after killing it and the solver. If Boogie fails (e.g. runs
+    out of memory or does not type-check the program) without refuting any
+    procedure, none of its verdicts is trusted, they are all UNKNOWN.
+    """
+    command = boogie_command(bpl_path, solver, solver_timeout, procedures=procedures)
+    result = processes.run(command, timeout, memory_mb)
+    with open(bpl_path) as bpl_file:
+        results = parse_trace(bpl_file.read(), result.stdout, procedures)
+    if result.returncode and all(procedure_result.verdict in ("OK", UNKNOWN) for procedure_result in results):
+        output = (result.stdout + result.stderr).strip().split("\n")
+        failure = f" - Boogie exited with status {result.returncode}: {output[-1].strip()}"
+        return [ProcedureResult(procedure_result.procedure, UNKNOWN, [failure], procedure_result.seconds)
+                for procedure_result in results]
+    return results
+
+
+class BoogieSolver:
+    """
+    Verifies merged contracts in two stages instead of running solc-verify
+    end to end: the translation to Boogie, cached by merged source (so a
+    specification verified again, e.g. by a retried job, is not translated
+    again), then the solving of the Boogie program. The output is the one
+    solc-verify would print.
+
+    With workers > 1, the procedures of the program (one per function) are
+    solved by separate Boogie processes (/proc), concurrently. The workers
+    are shared by all the verifications using the solver, so they bound the
+    number of Boogie processes of the experiment.
+
+    With a verdict cache, the procedures whose text and dependencies have
+    been solved before (by an earlier iteration or run) are not solved
+    again, see ProgramIndex.
+    """
+
+    def __init__(self, translation_cache: Optional[TranslationCache] = None, solver: str = "z3",
+                 solver_timeout: Optional[float] = SOLVER_TIMEOUT, workers: int = 1,
+                 procedure_timeout: Optional[float] = None, verdict_cache: Optional[VerdictCache] = None,
+                 timeouts: Optional[AdaptiveTimeouts] = None) -> None:
+        """
+        Parameters
+            translation_cache: where the .bpl files are kept, ./temp/bpl_cache by default
+            solver: SMT solver Boogie runs, "z3" or "cvc4"
+            solver_timeout: seconds each procedure may be solved for
+            workers: procedures solved at once, 1 to solve the whole program in one Boogie process
+            procedure_timeout: wall-clock seconds of the Boogie process of a
+            procedure, its verdict is TIMEOUT when they are exceeded
+            verdict_cache: where the verdicts of the procedures are cached, None to always solve them
+            timeouts: learns the solver time limit of each function instead
+            of using solver_timeout, see solve_grouped and adapt
+        """
+        self.translation_cache = translation_cache or TranslationCache()
+        self.solver = solver
+        self.solver_timeout = solver_timeout
+        self.workers = workers
+        self.procedure_timeout = procedure_timeout
+        self.verdict_cache = verdict_cache
+        self.timeouts = timeouts
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix="boogie") if workers > 1 else None
+
+    def translate(self, merge_path: str, timings: Dict[str, float], timeout: Optional[float] = None,
+                  memory_mb: Optional[int] = None) -> Tuple[Optional[str], str]:
+        """
+        Returns the cached translation of the merged contract, translating it
+        first if needed, and the compiler output (empty on cache hits)
+        """
+        start_time = time.perf_counter()
+        digest = merged_digest(merge_path)
+        bpl_path = self.translation_cache.get(digest)
+        output = ""
+        if bpl_path is None:
+            output_dir = tempfile.mkdtemp(prefix="translate_")
+            try:
+                translated_path, output = translate(merge_path, output_dir, timeout=timeout, memory_mb=memory_mb)
+                if translated_path:
+                    bpl_path = self.translation_cache.put(digest, translated_path)
+            finally:
+                shutil.rmtree(output_dir, ignore_errors=True)
+        timings["translate"] = time.perf_counter() - start_time
+        return bpl_path, output
+
+    @property
+    def configuration(self) -> str:
+        # What the verdicts depend on besides the program
+        return f"{self.solver} {self.solver_timeout} {' '.join(BOOGIE_OPTIONS)}"
+
+    def solve(self, bpl_path: str, timeout: Optional[float] = None,
+              memory_mb: Optional[int] = None) -> List[ProcedureResult]:
+        """
+        Returns the verdicts of the reported procedures, in the order of the program
+        """
+        if self.verdict_cache is None:
+            return self.solve_procedures(bpl_path, None, timeout, memory_mb)
+        with open(bpl_path) as bpl_file:
+            bpl_text = bpl_file.read()
+        index = ProgramIndex(bpl_text)
+        keys = {procedure: index.key(procedure, self.configuration) for procedure in procedure_messages(bpl_text)}
+        results: Dict[str, ProcedureResult] = {}
+        for procedure, key in keys.items():
+            entry = self.verdict_cache.get(key)
+            if entry is not None:
+                results[procedure] = index.result(procedure, entry, bpl_text.split("\n"))
+        missing = [procedure for procedure in keys if procedure not in results]
+        if missing:
+            for result in self.solve_procedures(bpl_path, missing if results else None, timeout, memory_mb):
+                results[result.procedure] = result
+                if result.verdict in DEFINITIVE_VERDICTS:
+                    self.verdict_cache.put(keys[result.procedure], index.entry(result))
+        return [results[procedure] for procedure in keys if procedure in results]
+
+    def solve_procedures(self, bpl_path: str, procedures: Optional[List[str]], timeout: Optional[float] = None,
+                         memory_mb: Optional[int] = None) -> List[ProcedureResult]:
+        """
+        Solves the given procedures, all the reported ones when None
+        """
+        if self._pool is None and self.timeouts is None:
+            return solve(bpl_path, timeout, self.solver, self.solver_timeout, procedures or (), memory_mb)
+        with open(bpl_path) as bpl_file:
+            messages = procedure_messages(bpl_file.read())
+        if procedures is None:
+            procedures = list(messages)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            if self._pool is None:
+                return self.solve_grouped(bpl_path, procedures, deadline, memory_mb, messages)
+            futures = [self._pool.submit(self.solve_procedure, bpl_path, procedure, deadline, memory_mb,
+                                         messages.get(procedure))
+                       for procedure in procedures]
+            try:
+                # In the order of the program, as solc-verify reports them
+                return [result for future in futures for result in future.result()]
+            finally:
+                for future in futures:
+                    future.cancel()
+        finally:
+            if self.timeouts:
+                self.timeouts.save()
+
+    def solve_grouped(self, bpl_path: str, procedures: List[str], deadline: Optional[float],
+                      memory_mb: Optional[int], messages: Dict[str, str]) -> List[ProcedureResult]:
+        """
+        Solves the procedures with adaptive timeouts and a single worker: the
+        procedures whose functions learned the same limit are solved by one
+        Boogie process, so a program whose functions all have the default
+        limit is still solved by a single process
+        """
+        groups: Dict[float, List[str]] = {}
+        for procedure in procedures:
+            groups.setdefault(self.timeouts.timeout(messages.get(procedure) or procedure), []).append(procedure)
+        results: Dict[str, ProcedureResult] = {}
+        for solver_timeout, group in groups.items():
+            # The wall-clock limit of a procedure applies to each procedure of the group
+            procedure_timeout = self.procedure_timeout * len(group) if self.procedure_timeout else None
+            for result in self._solve_procedures(bpl_path, group, deadline, memory_mb, solver_timeout,
+                                                 procedure_timeout):
+                results[result.procedure] = self.adapt(bpl_path, result, messages.get(result.procedure),
+                                                       solver_timeout, deadline, memory_mb)
+        return [results[procedure] for procedure in procedures if procedure in results]
+
+    def solve_procedure(self, bpl_path: str, procedure: str, deadline: Optional[float] = None,
+                        memory_mb: Optional[int] = None, function: Optional[str] = None) -> List[ProcedureResult]:
+        """
+        With adaptive timeouts, the solver time limit of the procedure is
+        learned from the proofs of its function (e.g. "ERC20::transfer"), see adapt
+        """
+        if self.timeouts is None:
+            return self._solve_procedures(bpl_path, (procedure,), deadline, memory_mb, self.solver_timeout,
+                                          self.procedure_timeout)
+        solver_timeout = self.timeouts.timeout(function or procedure)
+        results = self._solve_procedures(bpl_path, (procedure,), deadline, memory_mb, solver_timeout,
+                                         self.procedure_timeout)
+        return [self.adapt(bpl_path, result, function, solver_timeout, deadline, memory_mb) for result in results]
+
+    def adapt(self, bpl_path: str, result: ProcedureResult, function: Optional[str], solver_timeout: float,
+              deadline: Optional[float], memory_mb: Optional[int]) -> ProcedureResult:
+        """
+        Retries a procedure that timed out once, on its own and with a higher
+        limit, if the deadline leaves enough time for it, and learns from the
+        proof of a verified one
+        """
+        function = function or result.procedure
+        retry_timeout = self.timeouts.retry_timeout(solver_timeout)
+        if result.verdict == "TIMEOUT" and retry_timeout and \
+                (deadline is None or deadline - time.monotonic() >= retry_timeout):
+            # The wall-clock limit of the retry is the deadline only, procedure_timeout is the one of the first try
+            result = self._solve_procedures(bpl_path, (result.procedure,), deadline, memory_mb, retry_timeout,
+                                            None)[0]
+            metrics.SOLVER_RETRIES.inc(verdict=result.verdict)
+        if result.verdict == "OK":
+            self.timeouts.observe(function, result.seconds)
+        return result
+
+    def _solve_procedures(self, bpl_path: str, procedures: Sequence[str], deadline: Optional[float],
+                          memory_mb: Optional[int], solver_timeout: Optional[float],
+                          procedure_timeout: Optional[float]) -> List[ProcedureResult]:
+        """
+        Solves the procedures with one Boogie process. Raises
+        subprocess.TimeoutExpired when the deadline (of the whole
+        verification) is exceeded, the procedure timeout is only their verdict.
+        """
+        limit = procedure_timeout
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise subprocess.TimeoutExpired(BOOGIE_CMD, 0)
+            limit = remaining if limit is None else min(limit, remaining)
+        start_time = time.perf_counter()
+        try:
+            return solve(bpl_path, limit, self.solver, solver_timeout, procedures, memory_mb)
+        except subprocess.TimeoutExpired:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise
+            return [ProcedureResult(procedure, "TIMEOUT", seconds=time.perf_counter() - start_time)
+                    for procedure in procedures]
+
+    def verify(self, merge_path: str, timings: Dict[str, float], timeout: Optional[float] = None,
+               output_dir: Optional[str] = None, memory_mb: Optional[int] = None) -> Tuple[int, str]:
+        """
+        Returns the status and output of the verification of the merged
+        contract. Raises subprocess.TimeoutExpired if both stages run for
+        longer than timeout seconds.
+
+        Parameters
+            output_dir: directory the Boogie program is copied to, as with
+            solc-verify --output
+            memory_mb: data segment of the solc and Boogie processes (and of the solver), in megabytes
+        """
+        bpl_path, output = self.translate(merge_path, timings, timeout, memory_mb)
+        if bpl_path is None:
+            return 1, output
+        if output_dir:
+            shutil.copy(bpl_path, output_dir)
+        start_time = time.perf_counter()
+        results = self.solve(bpl_path, None if timeout is None else max(timeout - timings["translate"], 0.0),
+                             memory_mb)
+        timings["solve"] = time.perf_counter() - start_time
+        with open(bpl_path) as bpl_file:
+            return report(bpl_file.read(), results)
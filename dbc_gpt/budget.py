@@ -0,0 +1,84 @@
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+
+class DeadlineExceeded(Exception):
+
+    def __init__(self, reason: str) -> None:
+        super().__init__(reason)
+        self.reason = reason
+
+
+@dataclass
+class Limits:
+    # Wall-clock seconds
+    seconds: Optional[float] = None
+    # Prompt + completion tokens
+    tokens: Optional[int] = None
+    # Seconds spent verifying specifications
+    solver_seconds: Optional[float] = None
+
+
+class Budget:
+    """
+    Tracks the time, tokens and solver time consumed against some Limits.
+    A run budget has the experiment (matrix) budget as parent: everything
+    charged to the run is also charged to the experiment, and the run is
+    over when either of them is exhausted.
+    """
+
+    def __init__(self, limits: Limits = None, parent: 'Budget' = None, name: str = "run") -> None:
+        self.limits = limits or Limits()
+        self.parent = parent
+        self.name = name
+        self.start_time = time.time()
+        self.tokens = 0
+        self.solver_time = 0.0
+        # Experiment budgets are charged by concurrent runs
+        self._lock = threading.Lock()
+
+    def charge_tokens(self, tokens: int) -> None:
+        with self._lock:
+            self.tokens += tokens
+        if self.parent:
+            self.parent.charge_tokens(tokens)
+
+    def charge_solver_time(self, seconds: float) -> None:
+        with self._lock:
+            self.solver_time += seconds
+        if self.parent:
+            self.parent.charge_solver_time(seconds)
+
+    def exceeded(self) -> Optional[str]:
+        """
+        Returns the reason why the budget is exhausted, None if it is not
+        """
+        limits = self.limits
+        if limits.seconds is not None and time.time() - self.start_time >= limits.seconds:
+            return f"{self.name} time limit ({limits.seconds}s)"
+        if limits.tokens is not None and self.tokens >= limits.tokens:
+            return f"{self.name} token limit ({limits.tokens})"
+        if limits.solver_seconds is not None and self.solver_time >= limits.solver_seconds:
+            return f"{self.name} solver time limit ({limits.solver_seconds}s)"
+        return self.parent.exceeded() if self.parent else None
+
+    def check(self) -> None:
+        reason = self.exceeded()
+        if reason:
+            raise DeadlineExceeded(reason)
+
+    def remaining_seconds(self) -> Optional[float]:
+        """
+        Time left for a verification, None if unbounded
+        """
+        limits = self.limits
+        remaining = []
+        if limits.seconds is not None:
+            remaining.append(limits.seconds - (time.time() - self.start_time))
+        if limits.solver_seconds is not None:
+            remaining.append(limits.solver_seconds - self.solver_time)
+        if self.parent and self.parent.remaining_seconds() is not None:
+            remaining.append(self.parent.remaining_seconds())
+        return max(0.0, min(remaining)) if remaining else None
@@ -0,0 +1,97 @@
+import logging
+from dataclasses import dataclass
+from typing import Dict, List
+
+from dbc_gpt.llm import Assistant
+from dbc_gpt.usage import TokenUsage
+from dbc_gpt.verifier import VerificationResult
+
+# Assistants used in the experiments, from the cheapest to the strongest one
+GPT_35_FINE_TUNED_ASSISTANT_ID = "asst_l6McDS1eeFqRSRucPUerwD3x"
+GPT_4O_ASSISTANT_ID = "asst_8AOYbeZmLBx8Uic6tFUGBjhF"
+
+
+@dataclass
+class ModelTier:
+    name: str
+    assistant_id: str
+    # Failed verifications tolerated on this tier before escalating to the next one
+    max_attempts: int = 3
+    # USD per million tokens, cached prompt tokens are charged as input tokens when not set
+    input_price: float = 0.0
+    output_price: float = 0.0
+    cached_input_price: float = None
+
+    def cost(self, usage: TokenUsage) -> float:
+        cached_input_price = self.input_price if self.cached_input_price is None else self.cached_input_price
+        uncached_tokens = usage.prompt_tokens - usage.cached_tokens
+        return (uncached_tokens * self.input_price + usage.cached_tokens * cached_input_price
+                + usage.completion_tokens * self.output_price) / 1e6
+
+
+DEFAULT_TIERS = [
+    ModelTier("gpt-3.5-ft", GPT_35_FINE_TUNED_ASSISTANT_ID, input_price=3.0, output_price=6.0),
+    ModelTier("gpt-4o", GPT_4O_ASSISTANT_ID, input_price=2.5, output_price=10.0, cached_input_price=1.25),
+]
+
+
+def default_tier(assistant_id: str) -> ModelTier:
+    """
+    The single tier of a run without a cascade: the tier of the assistant
+    if it is one of DEFAULT_TIERS, with its prices, otherwise a tier
+    charged at the gpt-4o prices
+    """
+    for tier in DEFAULT_TIERS:
+        if tier.assistant_id == assistant_id:
+            return tier
+    return ModelTier("default", assistant_id, input_price=2.5, output_price=10.0, cached_input_price=1.25)
+
+
+class CascadeRouter:
+    """
+    Routes the interactions of a run through model tiers ordered from the
+    cheapest to the strongest. A run starts on the first tier and escalates
+    after `max_attempts` failed verifications on the current tier. The thread
+    is kept on escalation, so the stronger model only has to fix the functions
+    reported as failing by solc-verify.
+    """
+
+    def __init__(self, tiers: List[ModelTier]) -> None:
+        self.tiers = tiers
+        self.assistants = [Assistant(tier.assistant_id) for tier in tiers]
+        self.tier_index = 0
+        self.attempts = 0
+        # Interactions served by each tier
+        self.tier_iterations = {tier.name: 0 for tier in tiers}
+        # [$functionName] -> name of the tier that produced its verified postconditions
+        self.function_tiers: Dict[str, str] = {}
+
+    @property
+    def tier(self) -> ModelTier:
+        return self.tiers[self.tier_index]
+
+    @property
+    def assistant(self) -> Assistant:
+        return self.assistants[self.tier_index]
+
+    def escalate(self) -> bool:
+        if self.tier_index == len(self.tiers) - 1:
+            return False
+        self.tier_index += 1
+        self.attempts = 0
+        logging.info("escalating to model tier: " + self.tier.name)
+        return True
+
+    def record(self, verification_result: VerificationResult) -> None:
+        tier = self.tier
+        self.tier_iterations[tier.name] += 1
+        for function, verdict in verification_result.function_results.items():
+            if verdict == "OK":
+                self.function_tiers.setdefault(function, tier.name)
+            else:
+                self.function_tiers.pop(function, None)
+
+        if verification_result.status:
+            self.attempts += 1
+            if self.attempts >= tier.max_attempts:
+                self.escalate()
@@ -0,0 +1,369 @@
+import glob
+import os
+import re
+import shutil
+import subprocess
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from dbc_gpt import processes
+from dbc_gpt.boogie import (BOOGIE_CMD, BOOGIE_ERROR_PATTERN, BOOGIE_RELATED_PATTERN, MESSAGE_PATTERN,
+                            SOURCELOC_PATTERN, boogie_command)
+from dbc_gpt.falsifier import OLD_FUNCTIONS, ExpressionParser, Unsupported, render
+from dbc_gpt.verifier import FUNCTION_RESULT_PATTERN, VerificationLimits, VerificationResult
+
+# e.g. " - ./solc_verify_generator/ERC20/imp/ERC20_merge.sol:80:5: Postcondition 'balance >= 0' might not hold ..."
+FAILURE_PATTERN = re.compile(r"^ - (.+?):(\d+):(\d+): (.*)$", re.MULTILINE)
+POSTCONDITION_MESSAGE_PATTERN = re.compile(r"^Postcondition '(.*)' might not hold")
+# "name -> value" entries of a model, values are single tokens or negative numbers such as "(- 1)"
+MODEL_TOKEN_PATTERN = re.compile(r'\(- \d+\)|\S+')
+INCARNATION_PATTERN = re.compile(r'^(.*)@(\d+)$')
+
+
+@dataclass
+class Failure:
+    contract: str
+    function: str
+    # Line of the merged contract the error is reported at
+    line: int
+    message: str
+
+    @property
+    def postcondition(self) -> Optional[str]:
+        match = POSTCONDITION_MESSAGE_PATTERN.match(self.message)
+        return match.group(1) if match else None
+
+
+def parse_failures(output: str) -> List[Failure]:
+    """
+    Returns the errors solc-verify reports under the verdict of each function
+    """
+    failures = []
+    verdicts = list(FUNCTION_RESULT_PATTERN.finditer(output))
+    for position, verdict in enumerate(verdicts):
+        if verdict.group(3) != "ERROR":
+            continue
+        end = verdicts[position + 1].start() if position + 1 < len(verdicts) else len(output)
+        for match in FAILURE_PATTERN.finditer(output, verdict.end(), end):
+            failures.append(Failure(verdict.group(1), verdict.group(2), int(match.group(2)), match.group(4)))
+    return failures
+
+
+def is_array(value: str) -> bool:
+    # Values of map types, e.g. "T@[Int]Int!val!0" or "as-array[k!0]"
+    return value.startswith(("T@", "|T@", "as-array"))
+
+
+@dataclass
+class BoogieModel:
+    # [$name] -> value of the constants and variable incarnations
+    constants: Dict[str, str] = field(default_factory=dict)
+    # [$function] -> [(arguments, value)], e.g. the Select tables of arrays
+    functions: Dict[str, List[Tuple[Tuple[str, ...], str]]] = field(default_factory=dict)
+
+    def variable(self, name: str, old: bool = False) -> Optional[str]:
+        """
+        Returns the value of a Boogie variable (e.g. "_balances#24") at the
+        start (old) or at the end of the procedure: its last incarnation
+        """
+        incarnations = []
+        for constant, value in self.constants.items():
+            match = INCARNATION_PATTERN.match(constant)
+            if match and match.group(1) == name:
+                incarnations.append((int(match.group(2)), value))
+        if old or not incarnations:
+            return self.constants.get(name)
+        return max(incarnations)[1]
+
+    def select(self, array: str, key: str) -> Optional[str]:
+        # Arrays are either "as-array[k!0]" with a table k!0, or opaque values read through Select tables
+        as_array = re.match(r'^as-array\[(.*)\]$', array)
+        tables = [self.functions.get(as_array.group(1), [])] if as_array else \
+            [table for name, table in self.functions.items() if name.startswith("Select")]
+        for table in tables:
+            default = None
+            for arguments, value in table:
+                if arguments == ("else",):
+                    default = value
+                elif (as_array and arguments == (key,)) or (not as_array and arguments == (array, key)):
+                    return value
+            if as_array and default is not None:
+                return default
+        return None
+
+
+def parse_models(text: str) -> List[BoogieModel]:
+    """
+    Parses the models Boogie writes with /mv, one per failing assertion
+    """
+    models = []
+    model = None
+    function = None
+    in_state = False
+    for line in text.split("\n"):
+        stripped = line.strip()
+        if stripped == "*** MODEL":
+            model = BoogieModel()
+            models.append(model)
+        elif stripped == "*** END_MODEL":
+            model = None
+        elif stripped.startswith("*** STATE"):
+            in_state = True
+        elif stripped == "*** END_STATE":
+            in_state = False
+        elif model is None or in_state or not stripped:
+            continue
+        elif stripped == "}":
+            function = None
+        elif function is not None:
+            if " -> " in stripped:
+                arguments, value = stripped.rsplit(" -> ", 1)
+                model.functions[function].append((tuple(MODEL_TOKEN_PATTERN.findall(arguments)), value.strip()))
+        elif stripped.endswith("-> {"):
+            function = stripped[:-len("-> {")].strip()
+            model.functions[function] = []
+        elif " -> " in stripped:
+            name, value = stripped.split(" -> ", 1)
+            model.constants[name.strip()] = value.strip()
+    return models
+
+
+@dataclass
+class Counterexample:
+    failure: Failure
+    # (expression, value) at the end of the function and at its start (old)
+    values: List[Tuple[str, str]] = field(default_factory=list)
+    old_values: List[Tuple[str, str]] = field(default_factory=list)
+
+
+class ModelReader:
+    """
+    Reads the values of the expressions of a postcondition in a Boogie model:
+    solc-verify names variables "<name>#<id>" and indexes state variables by
+    the contract address first
+    """
+
+    def __init__(self, model: BoogieModel) -> None:
+        self.model = model
+        # [$solidityName] -> Boogie name, e.g. "_balances" -> "_balances#24"
+        self.names: Dict[str, str] = {}
+        for constant in model.constants:
+            base = INCARNATION_PATTERN.sub(r'\1', constant)
+            if "#" in base:
+                self.names.setdefault(base.split("#")[0], base)
+        self.this = model.constants.get("__this")
+
+    def read(self, node: tuple, old: bool = False) -> Optional[str]:
+        kind = node[0]
+        if kind == "literal":
+            return str(node[1]).lower() if isinstance(node[1], bool) else str(node[1])
+        if node == ("member", ("name", "msg"), "sender"):
+            return self.model.constants.get("__msg_sender")
+        if kind == "name":
+            name = self.names.get(node[1])
+            value = self.model.variable(name, old) if name else None
+            # State variables are arrays indexed by the contract address
+            if value is not None and is_array(value) and self.this is not None:
+                indexed = self.model.select(value, self.this)
+                if indexed is not None:
+                    return indexed
+            return value
+        if kind == "index":
+            base = self.read(node[1], old)
+            key = self.read(node[2], old)
+            return self.model.select(base, key) if base is not None and key is not None else None
+        if kind == "call" and node[1][0] == "name" and node[1][1] in OLD_FUNCTIONS and len(node[2]) == 1:
+            return self.read(node[2][0], True)
+        return None
+
+    def values(self, postcondition: str) -> Tuple[List[Tuple[str, str]], List[Tuple[str, str]]]:
+        """
+        Returns the (expression, value) of the variables, parameters and
+        indexed state variables the postcondition refers to, after and before
+        the call
+        """
+        values, old_values = [], []
+        try:
+            tree = ExpressionParser(postcondition).parse()
+        except Unsupported:
+            return values, old_values
+        for node, old in self._terms(tree, False):
+            value = self.read(node, old)
+            if value is None or is_array(value):
+                continue
+            target = old_values if old else values
+            if (render(node), value) not in target:
+                target.append((render(node), value))
+        sender = self.model.constants.get("__msg_sender")
+        if sender is not None and not any(expression == "msg.sender" for expression, _value in values):
+            values.append(("msg.sender", sender))
+        # Parameters do not change during the call
+        old_values = [(expression, value) for expression, value in old_values
+                      if "[" in expression or (expression, value) not in values]
+        return values, old_values
+
+    def _terms(self, node: tuple, old: bool):
+        kind = node[0]
+        if kind in ("name", "index") or node == ("member", ("name", "msg"), "sender"):
+            yield node, old
+        if kind == "call" and node[1][0] == "name" and node[1][1] in OLD_FUNCTIONS:
+            old = True
+        elif kind == "call":
+            # Function names are not terms
+            node = node[:1] + node[2:]
+        for child in node[1:]:
+            if isinstance(child, tuple):
+                yield from self._terms(child, old)
+            elif isinstance(child, list):
+                for item in child:
+                    yield from self._terms(item, old)
+
+
+def solver_options(arguments: Sequence[str]) -> Tuple[str, Optional[float]]:
+    """
+    Returns the solver and per-function time limit of these solc-verify
+    arguments (the last ones win, as in solc-verify), e.g.
+    ("--timeout", "10", "--solver", "cvc4") -> ("cvc4", 10.0)
+    """
+    solver, solver_timeout = "z3", None
+    for option, value in zip(arguments, arguments[1:]):
+        if option == "--solver":
+            solver = value
+        elif option == "--timeout":
+            solver_timeout = float(value)
+    return solver, solver_timeout
+
+
+class CounterexampleExplainer:
+    """
+    Solves the Boogie program solc-verify generated again, asking Boogie for
+    the models of the failing assertions, and extracts the values of the
+    variables each failing postcondition refers to
+    """
+
+    def __init__(self, boogie_cmd: str = BOOGIE_CMD, timeout: Optional[float] = 60, max_failures: int = 5) -> None:
+        self.boogie_cmd = boogie_cmd
+        self.timeout = timeout
+        self.max_failures = max_failures
+
+    def explain(self, verification_result: VerificationResult, output_dir: str, timeout: Optional[float] = None,
+                limits: Optional[VerificationLimits] = None, solver: str = "z3",
+                solver_timeout: Optional[float] = None) -> List[Counterexample]:
+        """
+        Parameters
+            verification_result: a failed verification
+            output_dir: the directory solc-verify wrote the .bpl to, see
+            SolcVerifyWrapper.verify
+            timeout: seconds left to the run, the program is not solved again without any
+            limits: the limits of the verification, Boogie is solved again within them
+            solver, solver_timeout: the solver the verification ran, and its
+            per-function time limit (the one of the explainer by default)
+        """
+        limits = limits or VerificationLimits()
+        failures = parse_failures(verification_result.output)[:self.max_failures]
+        counterexamples = [Counterexample(failure) for failure in failures]
+        bpl_paths = glob.glob(os.path.join(output_dir, "*.bpl"))
+        # Wall-clock seconds of the second Boogie run, within those of the verification and of the run
+        wall_clock = [seconds for seconds in (self.timeout and self.timeout * 2, limits.seconds, timeout)
+                      if seconds is not None]
+        wall_clock = min(wall_clock) if wall_clock else None
+        if not failures or not bpl_paths or shutil.which(self.boogie_cmd) is None or \
+                (wall_clock is not None and wall_clock <= 0):
+            return counterexamples
+        bpl_path = bpl_paths[0]
+        model_path = os.path.join(output_dir, "model.txt")
+        command = [self.boogie_cmd] + boogie_command(bpl_path, solver, solver_timeout or self.timeout,
+                                                     (f"/mv:{model_path}", f"/errorLimit:{self.max_failures}"))[1:]
+        try:
+            result = processes.run(command, wall_clock, limits.memory_mb)
+        except subprocess.TimeoutExpired:
+            return counterexamples
+        if not os.path.isfile(model_path):
+            return counterexamples
+        with open(model_path) as model_file:
+            models = parse_models(model_file.read())
+        with open(bpl_path) as bpl_file:
+            bpl_lines = bpl_file.read().split("\n")
+
+        # Boogie reports the errors in the order of the models, with the location of the failing assertion
+        errors = list(BOOGIE_ERROR_PATTERN.finditer(result.stdout))
+        for position, error in enumerate(errors[:len(models)]):
+            end = errors[position + 1].start() if position + 1 < len(errors) else len(result.stdout)
+            locations = [int(error.group(1))] + [int(related.group(1)) for related in
+                                                 BOOGIE_RELATED_PATTERN.finditer(result.stdout, error.end(), end)]
+            for location in locations:
+                counterexample = self._counterexample(counterexamples, bpl_lines[location - 1]
+                                                      if location <= len(bpl_lines) else "")
+                if counterexample is None:
+                    continue
+                if counterexample.failure.postcondition:
+                    reader = ModelReader(models[position])
+                    counterexample.values, counterexample.old_values = \
+                        reader.values(counterexample.failure.postcondition)
+                break
+        return counterexamples
+
+    @staticmethod
+    def _counterexample(counterexamples: List[Counterexample], bpl_line: str) -> Optional[Counterexample]:
+        """
+        Returns the counterexample (without values yet) of the failure the
+        assertion on bpl_line was translated from, matched by source line and
+        message
+        """
+        sourceloc = SOURCELOC_PATTERN.search(bpl_line)
+        if not sourceloc:
+            return None
+        message = MESSAGE_PATTERN.search(bpl_line)
+        candidates = [counterexample for counterexample in counterexamples
+                      if counterexample.failure.line == int(sourceloc.group(2))
+                      and not counterexample.values and not counterexample.old_values]
+        if message:
+            candidates = [counterexample for counterexample in candidates
+                          if counterexample.failure.message == message.group(1)] or candidates
+        return candidates[0] if candidates else None
+
+
+def _note(counterexample: Counterexample) -> Optional[str]:
+    # Aliasing is the most common reason for a wrong postcondition, e.g. a transfer to oneself
+    values = [(expression, value) for expression, value in counterexample.values
+              if "[" not in expression and "(" not in expression]
+    equal = [f"{first} == {second}" for index, (first, value) in enumerate(values)
+             for second, other in values[index + 1:] if value == other]
+    return ", ".join(equal) if equal else None
+
+
+def compact_feedback(verification_result: VerificationResult, counterexamples: List[Counterexample]) -> Optional[str]:
+    """
+    Returns a short feedback message listing, for every failing function, its
+    failing postconditions with the counterexample values, and the functions
+    already verified. None if the verification failed for other reasons
+    (e.g. compilation errors), the full output is more useful then.
+    """
+    if not counterexamples:
+        return None
+    function_results = verification_result.function_results
+    failing = sorted({counterexample.failure.function for counterexample in counterexamples})
+    lines = [f"Verification failed for {len(failing)} function(s):"]
+    for function in failing:
+        lines.append(f"- {function}:")
+        for counterexample in counterexamples:
+            if counterexample.failure.function != function:
+                continue
+            failure = counterexample.failure
+            if failure.postcondition:
+                lines.append(f"  - postcondition `{failure.postcondition}` might not hold")
+            else:
+                lines.append(f"  - {failure.message}")
+            if counterexample.values:
+                lines.append("    counterexample after the call: " +
+                             ", ".join(f"{expression} = {value}" for expression, value in counterexample.values))
+            if counterexample.old_values:
+                lines.append("    before the call: " +
+                             ", ".join(f"{expression} = {value}" for expression, value in counterexample.old_values))
+            note = _note(counterexample)
+            if note:
+                lines.append(f"    note: {note} in this counterexample")
+    verified = sorted(function for function, verdict in function_results.items() if verdict == "OK")
+    if verified:
+        lines.append("Verified, keep their annotations: " + ", ".join(verified))
+    return "\n".join(lines) + "\n"
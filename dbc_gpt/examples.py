@@ -0,0 +1,213 @@
+import glob
+import json
+import math
+import os
+import re
+from collections import Counter
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from dbc_gpt.retrieval import ASSETS_DIR, FILE_SEARCH_DIR, estimate_tokens, tokenize
+
+FINE_TUNING_DIR = os.path.join(ASSETS_DIR, "fine-tuning")
+
+SIGNATURE_PATTERN = re.compile(r'^\s*function\s+\w+\s*\(.*?\)[^;{]*;', re.MULTILINE)
+# e.g. erc20_ref_spec.md or erc20.jsonl -> erc20
+STANDARD_PATTERN = re.compile(r'(erc\d+)')
+# Fine-tuning files of generic solc-verify snippets (e.g. add_to_x), the same whatever the standard in their name
+GENERIC_SOURCE_PATTERN = re.compile(r'^annotations_')
+CONTRACT_PATTERN = re.compile(r'^\s*contract\s+(\w+)', re.MULTILINE)
+STATE_VARIABLE_PATTERN = re.compile(r'^\s*(mapping|uint|int|address|bool|string|bytes)\b[^;]*;\s*$', re.MULTILINE)
+
+
+@dataclass(frozen=True)
+class Example:
+    """
+    A function signature annotated with solc-verify postconditions, of a
+    standard or, without one, a generic example
+    """
+    standard: Optional[str]
+    source: str
+    signature: str
+    postconditions: Tuple[str, ...]
+    # Text describing the function, e.g. its EIP comment, used for similarity only
+    description: str = ""
+
+    @property
+    def text(self) -> str:
+        return "\n".join(self.postconditions + (self.signature,))
+
+
+def parse_ref_spec(text: str, standard: str, source: str) -> List[Example]:
+    examples, annotations = [], []
+    for line in text.split("\n"):
+        stripped = line.strip()
+        if stripped.startswith("///"):
+            annotations.append(stripped)
+        elif SIGNATURE_PATTERN.match(line):
+            postconditions = tuple(annotation for annotation in annotations if "postcondition" in annotation)
+            if postconditions:
+                examples.append(Example(standard, source, stripped, postconditions))
+            annotations = []
+        elif stripped:
+            annotations = []
+    return examples
+
+
+def source_standard(source: str) -> Optional[str]:
+    # The standard the examples of a source file belong to, None for the generic ones
+    if GENERIC_SOURCE_PATTERN.match(source):
+        return None
+    return STANDARD_PATTERN.search(source).group(1)
+
+
+def parse_fine_tuning(lines: Sequence[str], standard: Optional[str], source: str) -> List[Example]:
+    examples = []
+    for line in lines:
+        if not line.strip():
+            continue
+        messages = json.loads(line)["messages"]
+        prompt = next(message["content"] for message in messages if message["role"] == "user")
+        answer = next(message["content"] for message in messages if message["role"] == "assistant")
+        signature = SIGNATURE_PATTERN.search(prompt)
+        # Only postconditions are asked for, annotations such as "modifies" or "emits" are dropped
+        postconditions = tuple(annotation.strip() for annotation in answer.split("\n") if "postcondition" in annotation)
+        if signature and postconditions:
+            description = prompt[:signature.start()].strip()
+            examples.append(Example(standard, source, signature.group(0).strip(), postconditions, description))
+    return examples
+
+
+@lru_cache(maxsize=None)
+def load_examples(file_search_dir: str = FILE_SEARCH_DIR, fine_tuning_dir: str = FINE_TUNING_DIR) -> List[Example]:
+    """
+    Reads the function-level examples of the reference specifications and
+    of the fine-tuning data, without duplicates. An example found in several
+    sources is kept from the first standard-specific one.
+    """
+    examples = []
+    for path in sorted(glob.glob(os.path.join(file_search_dir, "*_ref_spec.md"))):
+        source = os.path.basename(path)
+        with open(path) as file:
+            examples += parse_ref_spec(file.read(), source_standard(source), source)
+    # Standard-specific files first
+    paths = sorted(glob.glob(os.path.join(fine_tuning_dir, "*.jsonl")),
+                   key=lambda path: (source_standard(os.path.basename(path)) is None, path))
+    for path in paths:
+        source = os.path.basename(path)
+        with open(path) as file:
+            examples += parse_fine_tuning(file.readlines(), source_standard(source), source)
+    unique = {}
+    for example in examples:
+        unique.setdefault((example.signature, example.postconditions), example)
+    return list(unique.values())
+
+
+@lru_cache(maxsize=None)
+def contract_context(standard: str, file_search_dir: str = FILE_SEARCH_DIR) -> Tuple[str, List[str]]:
+    """
+    Returns the contract name and state variables of the reference
+    specification of a standard, which the postconditions of its examples refer to
+    """
+    path = os.path.join(file_search_dir, f"{standard}_ref_spec.md")
+    if not os.path.isfile(path):
+        return "Examples", []
+    with open(path) as file:
+        text = file.read()
+    contract = CONTRACT_PATTERN.search(text)
+    return (contract.group(1) if contract else standard.upper(),
+            [match.group(0).strip() for match in STATE_VARIABLE_PATTERN.finditer(text)])
+
+
+class ExampleIndex:
+    """
+    TF-IDF vectors of the examples (function name, parameters and
+    description), computed once, compared by cosine similarity
+    """
+
+    def __init__(self, examples: Sequence[Example]) -> None:
+        self.examples = list(examples)
+        counts = [Counter(tokenize(example.signature + " " + example.description)) for example in self.examples]
+        frequencies = Counter(term for count in counts for term in count)
+        self.idf = {term: math.log(1 + len(counts) / frequency) for term, frequency in frequencies.items()}
+        self.vectors = [self._normalize(self._weights(count)) for count in counts]
+
+    def _weights(self, count: Counter) -> Dict[str, float]:
+        return {term: (1 + math.log(frequency)) * self.idf.get(term, 0.0) for term, frequency in count.items()}
+
+    @staticmethod
+    def _normalize(vector: Dict[str, float]) -> Dict[str, float]:
+        norm = math.sqrt(sum(weight * weight for weight in vector.values())) or 1.0
+        return {term: weight / norm for term, weight in vector.items()}
+
+    def similar(self, signature: str, standards: Optional[Sequence[str]] = None) -> List[Tuple[float, Example]]:
+        """
+        Returns the examples of the given standards and the generic ones
+        ranked by similarity to the signature
+        """
+        query = self._normalize(self._weights(Counter(tokenize(signature))))
+        ranked = []
+        for example, vector in zip(self.examples, self.vectors):
+            if standards is not None and example.standard is not None and example.standard not in standards:
+                continue
+            score = sum(weight * vector.get(term, 0.0) for term, weight in query.items())
+            if score > 0:
+                ranked.append((score, example))
+        ranked.sort(key=lambda item: -item[0])
+        return ranked
+
+
+@lru_cache(maxsize=None)
+def load_example_index() -> ExampleIndex:
+    return ExampleIndex(load_examples())
+
+
+class ExampleSelector:
+    """
+    Picks function-level examples for the functions of the contract to
+    annotate: the most similar example of every function first, then the
+    second most similar ones and so on, while the examples fit token_budget.
+    """
+
+    def __init__(self, token_budget: int, per_function: int = 2) -> None:
+        self.token_budget = token_budget
+        self.per_function = per_function
+
+    def select(self, signatures: Sequence[str], standards: Sequence[str]) -> List[Example]:
+        index = load_example_index()
+        rankings = [index.similar(signature, standards) for signature in signatures]
+        selected: List[Example] = []
+        tokens = 0
+        for _round in range(self.per_function):
+            for ranking in rankings:
+                candidates = [example for _score, example in ranking if example not in selected]
+                if not candidates:
+                    continue
+                example = candidates[0]
+                example_tokens = estimate_tokens(example.text)
+                if tokens + example_tokens > self.token_budget:
+                    continue
+                selected.append(example)
+                tokens += example_tokens
+        return selected
+
+    @staticmethod
+    def render(examples: Sequence[Example]) -> str:
+        """
+        Groups the examples by standard, as functions of one contract per
+        standard that declares the state variables of its reference
+        specification, which the postconditions refer to. The generic
+        examples come last, in a contract without state variables.
+        """
+        blocks = []
+        standards = sorted({example.standard for example in examples},
+                           key=lambda standard: (standard is None, standard or ""))
+        for standard in standards:
+            group = [example for example in examples if example.standard == standard]
+            contract, state_variables = contract_context(standard) if standard else ("Examples", [])
+            lines = [f"contract {contract} {{"] + [f"    {variable}" for variable in state_variables]
+            for example in group:
+                lines += [""] + [f"    {line}" for line in example.text.split("\n")]
+            blocks.append("\n".join(lines + ["}"]))
+        return "```solidity\n" + "\n\n".join(blocks) + "\n```"
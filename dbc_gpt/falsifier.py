@@ -0,0 +1,739 @@
+import argparse
+import atexit
+import json
+import logging
+import os
+import random
+import re
+import string
+import subprocess
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set, Tuple, Type
+
+try:
+    from web3 import Web3
+except ImportError:
+    # Only the falsifier needs web3, see requirements.txt
+    Web3 = None
+
+from dbc_gpt.repair import annotated_functions, function_signature
+from dbc_gpt.verifier import VERIFIERS, SolcVerifyWrapper, VerificationResult
+from solc_verify_generator.main import SOLC
+
+HARNESS_CONTRACT = "FalsifierHarness"
+HARNESS_MINT = "__falsifierMint"
+# Appended to the implementation, exposes its internal _mint to set up balances
+HARNESS_TEMPLATE = """
+
+contract FalsifierHarness is $contract {
+    constructor() $base_constructor public {}
+
+    function __falsifierMint(address account, uint256 id, uint256 amount) public {
+        $mint
+    }
+}
+"""
+
+GAS = 6000000
+# Call arguments are drawn from small values, so transfers of existing balances and tokens succeed often
+UINT_VALUES = (0, 1, 2, 3, 4, 5, 10, 50, 100, 1000)
+TOKEN_IDS = (0, 1, 2, 3, 4)
+MINTED_AMOUNT = 100
+# Accounts calls are sent from and addresses are drawn from, besides the zero address
+ACCOUNTS = 4
+
+POSTCONDITION_PATTERN = re.compile(r'postcondition\s+(.*?)\s*$')
+TOKEN_PATTERN = re.compile(r'\s*(0x[0-9a-fA-F]+|\d+|[A-Za-z_$][\w$]*|==>|==|!=|<=|>=|&&|\|\||[-+*/%!<>()\[\].,?:])')
+IDENTIFIER_PATTERN = re.compile(r'^[A-Za-z_$][\w$]*$')
+# e.g. "a ==> b", right associative, binds looser than ||
+BINARY_PRECEDENCE = {"==>": 1, "||": 2, "&&": 3, "==": 4, "!=": 4, "<": 5, "<=": 5, ">": 5, ">=": 5,
+                     "+": 6, "-": 6, "*": 7, "/": 7, "%": 7}
+OLD_FUNCTIONS = ("__verifier_old_uint", "__verifier_old_int", "__verifier_old_bool", "__verifier_old_address")
+CASTS = ("address", "uint", "uint256", "int", "int256", "bool")
+
+
+@dataclass
+class FalsifierTarget:
+    # Contract of the merge template
+    contract: str
+    # Body of the harness function minting `amount` of token `id` to `account`
+    mint: str
+    # Call of the base constructor, e.g. 'ERC1155("uri")'
+    base_constructor: str = ""
+
+
+# [$verifierName] -> target, verifiers without one (e.g. the refinement verifiers) are not falsified
+TARGETS = {
+    "ERC20Verifier": FalsifierTarget("ERC20", "_mint(account, amount);"),
+    "ERC721Verifier": FalsifierTarget("ERC721", "_mint(account, id);"),
+    "ERC1155Verifier": FalsifierTarget("ERC1155", '_mint(account, id, amount, "");',
+                                       'ERC1155("https://token-cdn-domain/{id}.json")'),
+}
+
+
+class Unsupported(Exception):
+    """
+    The postcondition uses a construct that cannot be evaluated concretely,
+    e.g. a quantifier or a sum over a mapping, it is left to the prover
+    """
+
+
+# Postcondition expressions
+
+def tokenize_expression(text: str) -> List[str]:
+    tokens, position = [], 0
+    text = text.rstrip()
+    while position < len(text):
+        match = TOKEN_PATTERN.match(text, position)
+        if not match:
+            raise Unsupported(f"unexpected character {text[position]!r}")
+        tokens.append(match.group(1))
+        position = match.end()
+    return tokens
+
+
+class ExpressionParser:
+    """
+    Parses the subset of the solc-verify annotation language that can be
+    evaluated on a concrete state, into tuples such as ("binary", "==", a, b)
+    """
+
+    def __init__(self, text: str) -> None:
+        self.tokens = tokenize_expression(text)
+        self.position = 0
+
+    def parse(self) -> tuple:
+        node = self.expression()
+        if self.position != len(self.tokens):
+            raise Unsupported(f"unexpected {self.tokens[self.position]!r}")
+        return node
+
+    def peek(self) -> Optional[str]:
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def take(self, expected: str = None) -> str:
+        token = self.peek()
+        if token is None or (expected is not None and token != expected):
+            raise Unsupported(f"expected {expected or 'a token'}, found {token!r}")
+        self.position += 1
+        return token
+
+    def expression(self) -> tuple:
+        condition = self.binary(1)
+        if self.peek() == "?":
+            self.take()
+            if_true = self.expression()
+            self.take(":")
+            return "conditional", condition, if_true, self.expression()
+        return condition
+
+    def binary(self, precedence: int) -> tuple:
+        left = self.unary()
+        while True:
+            operator = self.peek()
+            operator_precedence = BINARY_PRECEDENCE.get(operator)
+            if operator_precedence is None or operator_precedence < precedence:
+                return left
+            self.take()
+            right = self.binary(operator_precedence if operator == "==>" else operator_precedence + 1)
+            left = ("binary", operator, left, right)
+
+    def unary(self) -> tuple:
+        if self.peek() in ("!", "-"):
+            operator = self.take()
+            return "unary", operator, self.unary()
+        return self.postfix(self.primary())
+
+    def primary(self) -> tuple:
+        token = self.take()
+        if token == "(":
+            node = self.expression()
+            self.take(")")
+            return node
+        if token[0].isdigit():
+            return "literal", int(token, 16) if token.startswith("0x") else int(token)
+        if token in ("true", "false"):
+            return "literal", token == "true"
+        if token == "forall" or not IDENTIFIER_PATTERN.match(token):
+            raise Unsupported(f"unsupported {token!r}")
+        return "name", token
+
+    def postfix(self, node: tuple) -> tuple:
+        while True:
+            token = self.peek()
+            if token == "[":
+                self.take()
+                index = self.expression()
+                self.take("]")
+                node = ("index", node, index)
+            elif token == ".":
+                self.take()
+                node = ("member", node, self.take())
+            elif token == "(":
+                self.take()
+                arguments = []
+                if self.peek() != ")":
+                    arguments.append(self.expression())
+                    while self.peek() == ",":
+                        self.take()
+                        arguments.append(self.expression())
+                self.take(")")
+                node = ("call", node, arguments)
+            else:
+                return node
+
+
+def render(node: tuple) -> str:
+    kind = node[0]
+    if kind == "literal":
+        return str(node[1]).lower() if isinstance(node[1], bool) else str(node[1])
+    if kind == "name":
+        return node[1]
+    if kind == "index":
+        return f"{render(node[1])}[{render(node[2])}]"
+    if kind == "member":
+        return f"{render(node[1])}.{node[2]}"
+    if kind == "call":
+        return f"{render(node[1])}({', '.join(render(argument) for argument in node[2])})"
+    if kind == "unary":
+        return f"{node[1]}{render(node[2])}"
+    if kind == "binary":
+        return f"({render(node[2])} {node[1]} {render(node[3])})"
+    return f"({render(node[1])} ? {render(node[2])} : {render(node[3])})"
+
+
+class Address(int):
+    # Addresses are compared as integers, e.g. to address(0), and shown in hex
+
+    def __str__(self) -> str:
+        return "0x%040x" % self
+
+    __repr__ = __str__
+
+
+def from_abi(value: Any) -> Any:
+    if isinstance(value, str) and value.startswith("0x") and len(value) == 42:
+        return Address(int(value, 16))
+    if isinstance(value, (list, tuple)):
+        return [from_abi(item) for item in value]
+    return value
+
+
+def format_value(value: Any) -> str:
+    if isinstance(value, bool):
+        return str(value).lower()
+    if isinstance(value, list):
+        return "[" + ", ".join(format_value(item) for item in value) + "]"
+    return str(value)
+
+
+@dataclass(frozen=True)
+class StorageReference:
+    slot: int
+    type_id: str
+    offset: int = 0
+
+
+class Evaluator:
+    """
+    Evaluates a postcondition after a successful call: state variables are
+    read from the contract storage after the call, __verifier_old_* from
+    the storage before it
+    """
+
+    def __init__(self, deployment: 'Deployment', block: int, old_block: int, names: Dict[str, Any]) -> None:
+        self.deployment = deployment
+        self.block = block
+        self.old_block = old_block
+        self.names = names
+        # (expression, value) of the state variables, parameters and return values read
+        self.values: List[Tuple[str, str]] = []
+
+    def evaluate(self, node: tuple, block: int = None) -> Any:
+        block = self.block if block is None else block
+        value = self.load(self._evaluate(node, block), block)
+        local = (node[0] == "name" and node[1] in self.names) or node == ("member", ("name", "msg"), "sender")
+        # Parameters and return values do not change with the state
+        if node[0] in ("name", "index", "member") and not (local and block != self.block):
+            text = render(node) if block == self.block else f"{render(node)} before the call"
+            if not any(expression == text for expression, _value in self.values):
+                self.values.append((text, format_value(value)))
+        return value
+
+    def _evaluate(self, node: tuple, block: int) -> Any:
+        kind = node[0]
+        if kind == "literal":
+            return node[1]
+        if kind == "name":
+            name = node[1]
+            if name in self.names:
+                return self.names[name]
+            if name in self.deployment.state_variables:
+                return self.deployment.state_variables[name]
+            raise Unsupported(f"unknown name {name}")
+        if kind == "member":
+            if node[1] == ("name", "msg") and node[2] == "sender":
+                return self.names["msg.sender"]
+            base = self.evaluate(node[1], block)
+            if node[2] == "length" and isinstance(base, list):
+                return len(base)
+            raise Unsupported(f"unsupported member {node[2]}")
+        if kind == "index":
+            base = self._evaluate(node[1], block)
+            index = self.evaluate(node[2], block)
+            if isinstance(base, StorageReference):
+                return self.deployment.mapping_entry(base, index)
+            if isinstance(base, list):
+                if not 0 <= index < len(base):
+                    raise Unsupported("index out of bounds")
+                return base[index]
+            raise Unsupported("unsupported index")
+        if kind == "call":
+            function = node[1][1] if node[1][0] == "name" else None
+            if function in OLD_FUNCTIONS and len(node[2]) == 1:
+                return self.evaluate(node[2][0], self.old_block)
+            if function in CASTS and len(node[2]) == 1:
+                value = self.evaluate(node[2][0], block)
+                return Address(value) if function == "address" else value
+            raise Unsupported(f"unsupported function {render(node[1])}")
+        if kind == "unary":
+            operand = self.evaluate(node[2], block)
+            return (not operand) if node[1] == "!" else -operand
+        if kind == "conditional":
+            return self.evaluate(node[2] if self.evaluate(node[1], block) else node[3], block)
+        operator = node[1]
+        left = self.evaluate(node[2], block)
+        # Short-circuit like Solidity, the right operand may not be defined
+        if operator == "&&":
+            return bool(left) and bool(self.evaluate(node[3], block))
+        if operator == "||":
+            return bool(left) or bool(self.evaluate(node[3], block))
+        if operator == "==>":
+            return (not left) or bool(self.evaluate(node[3], block))
+        right = self.evaluate(node[3], block)
+        if operator in ("/", "%") and right == 0:
+            raise Unsupported("division by zero")
+        return {
+            "==": lambda: left == right, "!=": lambda: left != right,
+            "<": lambda: left < right, "<=": lambda: left <= right,
+            ">": lambda: left > right, ">=": lambda: left >= right,
+            "+": lambda: left + right, "-": lambda: left - right, "*": lambda: left * right,
+            "/": lambda: left // right, "%": lambda: left % right,
+        }[operator]()
+
+    def load(self, value: Any, block: int) -> Any:
+        if isinstance(value, StorageReference):
+            return self.deployment.load(value, block)
+        return value
+
+
+# Specifications
+
+def spec_postconditions(code: str) -> Dict[Tuple[str, int], List[str]]:
+    """
+    Returns [($functionName, $numberOfParameters)] -> postconditions, like
+    the keys of the annotations merged by solc_verify_generator.main
+    """
+    lines = code.split("\n")
+    postconditions = {}
+    for annotations, signature in annotated_functions(lines):
+        function = function_signature("\n".join(lines[signature:]))
+        if function is None:
+            continue
+        texts = [POSTCONDITION_PATTERN.search(lines[index]).group(1) for index in annotations
+                 if POSTCONDITION_PATTERN.search(lines[index])]
+        if texts:
+            postconditions[function] = texts
+    return postconditions
+
+
+@dataclass
+class Counterexample:
+    function: str
+    postcondition: str
+    # Calls since the deployment, the last one falsifies the postcondition
+    calls: List[str]
+    # (expression, value) read while evaluating the postcondition
+    values: List[Tuple[str, str]]
+
+    def describe(self) -> str:
+        lines = [f" - Postcondition '{self.postcondition}' does not hold after {self.calls[-1]}"]
+        lines += [f"   {expression} = {value}" for expression, value in self.values]
+        if len(self.calls) > 1:
+            lines.append("   Previous calls: " + "; ".join(self.calls[:-1]))
+        return "\n".join(lines)
+
+
+@dataclass
+class Falsification:
+    # At most one counterexample per function
+    counterexamples: List[Counterexample] = field(default_factory=list)
+    calls: int = 0
+    # Postconditions evaluated after a call
+    checks: int = 0
+    # Postconditions that cannot be evaluated concretely
+    unsupported: List[str] = field(default_factory=list)
+    seconds: float = 0.0
+
+    def verification_result(self, contract: str) -> VerificationResult:
+        """
+        Returns a failed result with the counterexamples in place of the
+        solc-verify output, in its format, so the feedback and the function
+        verdicts work unchanged
+        """
+        lines = ["Falsified by concrete execution on a local EVM, the prover was not run:"]
+        for counterexample in self.counterexamples:
+            lines.append(f"{contract}::{counterexample.function}: ERROR")
+            lines.append(counterexample.describe())
+        return VerificationResult(1, "\n".join(lines) + "\n", {"falsify": self.seconds})
+
+
+# Local chain
+
+class LocalChain:
+    """
+    A ganache node, started on first use unless a url is given, shared by
+    the falsifications of the process
+    """
+
+    GANACHE_CMD = "ganache"
+    _shared: Optional['LocalChain'] = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, url: str = None, port: int = 8545, startup_timeout: float = 30) -> None:
+        self.url = url or f"http://127.0.0.1:{port}"
+        self.port = port
+        self.startup_timeout = startup_timeout
+        self.process: Optional[subprocess.Popen] = None
+        self.w3 = None
+        self.spawn = url is None
+        # Snapshots and reverts are global to the node, so falsifications run one at a time
+        self.lock = threading.Lock()
+        # [$verifierName] -> deployment
+        self.deployments: Dict[str, 'Deployment'] = {}
+
+    @classmethod
+    def shared(cls) -> 'LocalChain':
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    def start(self) -> None:
+        if self.w3 is not None:
+            return
+        if Web3 is None:
+            raise RuntimeError("the falsifier needs web3, see requirements.txt")
+        if self.spawn:
+            command = [self.GANACHE_CMD, "--server.port", str(self.port), "--wallet.deterministic",
+                       "--wallet.totalAccounts", str(ACCOUNTS + 1), "--chain.allowUnlimitedContractSize",
+                       "--logging.quiet"]
+            self.process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            atexit.register(self.stop)
+        w3 = Web3(Web3.HTTPProvider(self.url))
+        deadline = time.time() + self.startup_timeout
+        while not w3.is_connected():
+            if time.time() > deadline or (self.process and self.process.poll() is not None):
+                self.stop()
+                raise RuntimeError(f"no Ethereum node on {self.url}")
+            time.sleep(0.2)
+        self.w3 = w3
+
+    def stop(self) -> None:
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait()
+        self.process = None
+        self.w3 = None
+        self.deployments = {}
+
+    def snapshot(self) -> str:
+        return self.w3.provider.make_request("evm_snapshot", [])["result"]
+
+    def revert(self, snapshot_id: str) -> None:
+        self.w3.provider.make_request("evm_revert", [snapshot_id])
+
+    def deployment(self, verifier: Type[SolcVerifyWrapper]) -> 'Deployment':
+        if verifier.__name__ not in self.deployments:
+            self.deployments[verifier.__name__] = Deployment.create(self, verifier)
+        return self.deployments[verifier.__name__]
+
+
+def compile_harness(verifier: Type[SolcVerifyWrapper], target: FalsifierTarget) -> dict:
+    """
+    Compiles the implementation of the merge template (without annotations)
+    with the harness, returns its abi, bytecode and storage layout
+    """
+    with open(verifier.TEMPLATE_PATH) as template_file:
+        implementation = string.Template(template_file.read()).substitute(defaultdict(str))
+    harness = string.Template(HARNESS_TEMPLATE).substitute(contract=target.contract, mint=target.mint,
+                                                           base_constructor=target.base_constructor)
+    # Next to the implementation, it imports files relatively, and private to the process (workers may compile it
+    # concurrently)
+    imp_dir = os.path.abspath(os.path.dirname(verifier.MERGE_PATH))
+    source_path = os.path.join(imp_dir, f"{target.contract}_falsifier_{os.getpid()}_{threading.get_ident()}.sol")
+    with open(source_path, "w") as source_file:
+        source_file.write(implementation + harness)
+    standard_input = {
+        "language": "Solidity",
+        "sources": {source_path: {"urls": [source_path]}},
+        "settings": {"outputSelection": {source_path: {
+            HARNESS_CONTRACT: ["abi", "evm.bytecode.object", "storageLayout"]}}},
+    }
+    try:
+        result = subprocess.run([SOLC, "--standard-json", "--allow-paths", imp_dir], input=json.dumps(standard_input),
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    finally:
+        os.remove(source_path)
+    output = json.loads(result.stdout or "{}")
+    errors = [error["formattedMessage"] for error in output.get("errors", []) if error["severity"] == "error"]
+    if result.returncode or errors or not output.get("contracts"):
+        raise RuntimeError(f"could not compile the {target.contract} harness: {errors or result.stderr}")
+    contract = output["contracts"][source_path][HARNESS_CONTRACT]
+    if not contract.get("storageLayout"):
+        raise RuntimeError(f"{SOLC} does not report storage layouts (solc >= 0.5.13 needed)")
+    return contract
+
+
+class Deployment:
+    """
+    The harness of a verifier deployed with some minted tokens, and a
+    snapshot of that state every call sequence starts from
+    """
+
+    def __init__(self, chain: LocalChain, contract, layout: dict, snapshot_id: str) -> None:
+        self.chain = chain
+        self.contract = contract
+        self.address = contract.address
+        self.types = layout["types"]
+        # [$stateVariable] -> reference to its storage
+        self.state_variables = {entry["label"]: StorageReference(int(entry["slot"]), entry["type"], entry["offset"])
+                                for entry in layout["storage"]}
+        self.snapshot_id = snapshot_id
+        self.accounts = chain.w3.eth.accounts[:ACCOUNTS]
+
+    @classmethod
+    def create(cls, chain: LocalChain, verifier: Type[SolcVerifyWrapper]) -> 'Deployment':
+        artifact = compile_harness(verifier, TARGETS[verifier.__name__])
+        w3 = chain.w3
+        deployer = w3.eth.accounts[0]
+        factory = w3.eth.contract(abi=artifact["abi"], bytecode=artifact["evm"]["bytecode"]["object"])
+        receipt = w3.eth.wait_for_transaction_receipt(factory.constructor().transact({"from": deployer, "gas": GAS}))
+        contract = w3.eth.contract(address=receipt.contractAddress, abi=artifact["abi"])
+        accounts = w3.eth.accounts[:ACCOUNTS]
+        # Every token id gets a different first owner, then fungible tokens are minted to everyone
+        mints = [(accounts[position % len(accounts)], token_id) for position, token_id in enumerate(TOKEN_IDS)]
+        mints += [(account, token_id) for token_id in TOKEN_IDS for account in accounts]
+        for account, token_id in mints:
+            mint = getattr(contract.functions, HARNESS_MINT)(account, token_id, MINTED_AMOUNT)
+            try:
+                mint.call({"from": deployer})
+            except Exception:
+                # e.g. an ERC721 token minted twice
+                continue
+            w3.eth.wait_for_transaction_receipt(mint.transact({"from": deployer, "gas": GAS}))
+        return cls(chain, contract, artifact["storageLayout"], chain.snapshot())
+
+    def reset(self) -> None:
+        # A snapshot is consumed by the revert
+        self.chain.revert(self.snapshot_id)
+        self.snapshot_id = self.chain.snapshot()
+
+    def mapping_entry(self, reference: StorageReference, key: Any) -> StorageReference:
+        mapping_type = self.types[reference.type_id]
+        if mapping_type.get("encoding") != "mapping":
+            raise Unsupported(f"unsupported index of {mapping_type['label']}")
+        key_label = self.types[mapping_type["key"]]["label"]
+        if not key_label.startswith(("uint", "int", "address", "bool", "bytes")) or key_label == "bytes":
+            raise Unsupported(f"unsupported key type {key_label}")
+        encoded_key = (int(key) % 2 ** 256).to_bytes(32, "big")
+        slot = Web3.keccak(encoded_key + reference.slot.to_bytes(32, "big"))
+        return StorageReference(int.from_bytes(slot, "big"), mapping_type["value"])
+
+    def load(self, reference: StorageReference, block: int) -> Any:
+        value_type = self.types[reference.type_id]
+        label = value_type["label"]
+        if value_type.get("encoding") != "inplace" or not label.startswith(("uint", "int", "address", "bool")):
+            raise Unsupported(f"unsupported state variable type {label}")
+        word = int.from_bytes(self.chain.w3.eth.get_storage_at(self.address, reference.slot, block), "big")
+        size = int(value_type["numberOfBytes"]) * 8
+        value = (word >> (reference.offset * 8)) & ((1 << size) - 1)
+        if label == "bool":
+            return bool(value)
+        if label.startswith("address"):
+            return Address(value)
+        if label.startswith("int") and value >= 1 << (size - 1):
+            return value - (1 << size)
+        return value
+
+
+class Falsifier:
+    """
+    Refutes postconditions by concrete execution: the implementation of the
+    verifier is deployed on a local ganache chain, random call sequences are
+    sent to it and the postconditions of every successful call are evaluated
+    on the state before and after it. Much faster than the prover, it can
+    only show that a postcondition is wrong, never that it holds.
+    """
+
+    def __init__(self, sequences: int = 20, length: int = 6, seed: Optional[int] = None,
+                 chain: LocalChain = None) -> None:
+        """
+        Parameters
+            sequences: call sequences per specification, each one starts from
+            the state after the setup mints
+            length: calls per sequence
+            seed: of the random calls, for reproducible counterexamples
+            chain: the shared local chain by default
+        """
+        self.sequences = sequences
+        self.length = length
+        self.seed = seed
+        self.chain = chain or LocalChain.shared()
+        # Verifiers the chain could not be set up for, they are not falsified again
+        self.disabled: Set[str] = set()
+
+    def falsify(self, verifier: Type[SolcVerifyWrapper], solidity_code: str) -> Falsification:
+        start_time = time.perf_counter()
+        falsification = Falsification()
+        if verifier.__name__ not in TARGETS or verifier.__name__ in self.disabled:
+            return falsification
+        postconditions = {}
+        for key, texts in spec_postconditions(solidity_code).items():
+            for text in texts:
+                try:
+                    postconditions.setdefault(key, []).append((text, ExpressionParser(text).parse()))
+                except Unsupported:
+                    falsification.unsupported.append(text)
+        if not postconditions:
+            return falsification
+        with self.chain.lock:
+            try:
+                self.chain.start()
+                deployment = self.chain.deployment(verifier)
+            except Exception as e:
+                logging.warning(f"falsifier disabled for {verifier.__name__}: {e}")
+                self.disabled.add(verifier.__name__)
+                return falsification
+            try:
+                self._run_sequences(deployment, postconditions, falsification, random.Random(self.seed))
+            finally:
+                deployment.reset()
+        falsification.seconds = time.perf_counter() - start_time
+        return falsification
+
+    def _run_sequences(self, deployment: Deployment, postconditions: Dict[Tuple[str, int], List[Tuple[str, tuple]]],
+                       falsification: Falsification, rng: random.Random) -> None:
+        functions = [entry for entry in deployment.contract.abi
+                     if entry["type"] == "function" and entry["name"] != HARNESS_MINT]
+        # Annotated functions are called twice as often, the others only change the state
+        annotated = [entry for entry in functions if (entry["name"], len(entry["inputs"])) in postconditions]
+        falsified: Set[str] = set()
+        unsupported = set(falsification.unsupported)
+        for sequence in range(self.sequences):
+            if sequence:
+                deployment.reset()
+            calls = []
+            for _ in range(self.length):
+                entry = rng.choice(functions + annotated)
+                outcome = self._call(deployment, entry, rng)
+                if outcome is None:
+                    continue
+                description, names, old_block, block = outcome
+                calls.append(description)
+                falsification.calls += 1
+                key = (entry["name"], len(entry["inputs"]))
+                if entry["name"] in falsified:
+                    continue
+                for text, node in postconditions.get(key, ()):
+                    if text in unsupported:
+                        continue
+                    evaluator = Evaluator(deployment, block, old_block, names)
+                    try:
+                        holds = evaluator.evaluate(node)
+                    except Unsupported as e:
+                        logging.info(f"postcondition '{text}' not falsifiable: {e}")
+                        unsupported.add(text)
+                        falsification.unsupported.append(text)
+                        continue
+                    falsification.checks += 1
+                    if not holds:
+                        falsification.counterexamples.append(
+                            Counterexample(entry["name"], text, list(calls), evaluator.values))
+                        falsified.add(entry["name"])
+                        break
+
+    def _call(self, deployment: Deployment, entry: dict, rng: random.Random):
+        """
+        Calls a function with random arguments from a random account, returns
+        (description, names, block before, block after), None if it reverted
+        """
+        # Arrays of a call have the same length, e.g. ids and amounts
+        length = rng.randint(1, 3)
+        try:
+            arguments = [self._argument(parameter["type"], deployment, rng, length) for parameter in entry["inputs"]]
+        except Unsupported:
+            return None
+        sender = rng.choice(deployment.accounts)
+        w3 = self.chain.w3
+        signature = f"{entry['name']}({','.join(parameter['type'] for parameter in entry['inputs'])})"
+        function = deployment.contract.get_function_by_signature(signature)(*arguments)
+        old_block = w3.eth.block_number
+        try:
+            returned = function.call({"from": sender}, old_block)
+        except Exception:
+            return None
+        block = old_block
+        if entry.get("stateMutability") not in ("view", "pure"):
+            receipt = w3.eth.wait_for_transaction_receipt(function.transact({"from": sender, "gas": GAS}))
+            if not receipt.status:
+                return None
+            block = receipt.blockNumber
+        outputs = entry.get("outputs", [])
+        returned = [returned] if len(outputs) == 1 else list(returned or [])
+        names = {"msg.sender": Address(int(sender, 16))}
+        names.update({parameter["name"]: from_abi(argument)
+                      for parameter, argument in zip(entry["inputs"], arguments) if parameter["name"]})
+        names.update({output["name"]: from_abi(value) for output, value in zip(outputs, returned) if output["name"]})
+        shown = ", ".join(f"{parameter['name'] or '_'}={format_value(from_abi(argument))}"
+                          for parameter, argument in zip(entry["inputs"], arguments))
+        return f"{entry['name']}({shown}) from {Address(int(sender, 16))}", names, old_block, block
+
+    def _argument(self, abi_type: str, deployment: Deployment, rng: random.Random, length: int) -> Any:
+        if abi_type.endswith("[]"):
+            return [self._argument(abi_type[:-2], deployment, rng, length) for _ in range(length)]
+        if abi_type == "address":
+            return "0x" + "0" * 40 if rng.random() < 0.1 else rng.choice(deployment.accounts)
+        if abi_type.startswith(("uint", "int")):
+            return rng.choice(UINT_VALUES)
+        if abi_type == "bool":
+            return rng.random() < 0.5
+        if abi_type in ("bytes", "string"):
+            return b"" if abi_type == "bytes" else ""
+        if abi_type.startswith("bytes"):
+            return bytes(int(abi_type[len("bytes"):]))
+        raise Unsupported(f"unsupported parameter type {abi_type}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Refutes the postconditions of a specification by concrete execution")
+    parser.add_argument("spec_file_path", type=str)
+    parser.add_argument("--verifier", default="ERC20Verifier", choices=sorted(TARGETS))
+    parser.add_argument("--sequences", default=20, type=int)
+    parser.add_argument("--length", default=6, type=int)
+    parser.add_argument("--seed", default=None, type=int)
+    parser.add_argument("--url", help="Node to use instead of starting ganache", default=None, type=str)
+    args = parser.parse_args()
+
+    with open(args.spec_file_path) as spec_file:
+        spec = spec_file.read()
+    falsifier = Falsifier(args.sequences, args.length, args.seed, LocalChain(args.url) if args.url else None)
+    verifier = VERIFIERS[args.verifier]
+    falsification = falsifier.falsify(verifier, spec)
+    print(falsification.verification_result(TARGETS[args.verifier].contract).output
+          if falsification.counterexamples else "No counterexample found")
+    print(f"{falsification.calls} calls, {falsification.checks} postconditions evaluated, "
+          f"{len(falsification.unsupported)} not falsifiable, {falsification.seconds:.2f}s")
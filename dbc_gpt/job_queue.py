@@ -0,0 +1,159 @@
+import json
+import sqlite3
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    lease_owner TEXT,
+    lease_expires REAL,
+    result TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, kind);
+"""
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+
+@dataclass
+class QueuedJob:
+    id: str
+    kind: str
+    payload: Dict[str, Any]
+    attempts: int
+    # A row per run, a list of them for batched jobs
+    result: Optional[Union[Dict[str, Any], List[Dict[str, Any]]]] = None
+
+
+class JobQueue:
+    """
+    Work queue stored in a SQLite database shared by the workers, e.g. on a
+    network file system mounted by every host (the default rollback journal
+    is used, as WAL does not work across hosts).
+
+    A worker leases a job for `lease_seconds` and keeps the lease alive with
+    heartbeats. Jobs whose lease expires (the worker died) are handed to
+    another worker, up to `max_attempts` times. Both enqueueing and result
+    writes are idempotent: a job id is only inserted once and only the first
+    result of a job is kept.
+    """
+
+    def __init__(self, db_path: str, timeout: float = 60) -> None:
+        self.db_path = db_path
+        # Autocommit mode, transactions are started explicitly
+        self._connection = sqlite3.connect(db_path, timeout=timeout, isolation_level=None,
+                                           check_same_thread=False)
+        self._connection.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def enqueue(self, job_id: str, kind: str, payload: Dict[str, Any], max_attempts: int = 3) -> bool:
+        """
+        Returns False if a job with the same id was already enqueued
+        """
+        now = time.time()
+        cursor = self._connection.execute(
+            "INSERT OR IGNORE INTO jobs (id, kind, payload, max_attempts, created, updated) VALUES (?, ?, ?, ?, ?, ?)",
+            (job_id, kind, json.dumps(payload), max_attempts, now, now)
+        )
+        return cursor.rowcount == 1
+
+    def lease(self, worker_id: str, kinds: Iterable[str], lease_seconds: float = 300) -> Optional[QueuedJob]:
+        kinds = list(kinds)
+        placeholders = ", ".join("?" for _ in kinds)
+        now = time.time()
+        connection = self._connection
+        # BEGIN IMMEDIATE takes the write lock, so two workers never lease the same job
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            self._fail_exhausted(now)
+            row = connection.execute(
+                f"SELECT id, kind, payload, attempts FROM jobs "
+                f"WHERE kind IN ({placeholders}) AND attempts < max_attempts "
+                f"AND (status = ? OR (status = ? AND lease_expires < ?)) "
+                f"ORDER BY created, id LIMIT 1",
+                (*kinds, PENDING, LEASED, now)
+            ).fetchone()
+            if row is None:
+                connection.execute("COMMIT")
+                return None
+            job_id, kind, payload, attempts = row
+            connection.execute(
+                "UPDATE jobs SET status = ?, lease_owner = ?, lease_expires = ?, attempts = attempts + 1, "
+                "updated = ? WHERE id = ?",
+                (LEASED, worker_id, now + lease_seconds, now, job_id)
+            )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return QueuedJob(job_id, kind, json.loads(payload), attempts + 1)
+
+    def _fail_exhausted(self, now: float) -> None:
+        # Jobs whose last attempt died without reporting back
+        self._connection.execute(
+            "UPDATE jobs SET status = ?, error = 'lease expired', updated = ? "
+            "WHERE status = ? AND lease_expires < ? AND attempts >= max_attempts",
+            (FAILED, now, LEASED, now)
+        )
+
+    def heartbeat(self, job_id: str, worker_id: str, lease_seconds: float = 300) -> bool:
+        """
+        Extends the lease of a job, returns False if the worker no longer holds it
+        """
+        now = time.time()
+        cursor = self._connection.execute(
+            "UPDATE jobs SET lease_expires = ?, updated = ? WHERE id = ? AND status = ? AND lease_owner = ?",
+            (now + lease_seconds, now, job_id, LEASED, worker_id)
+        )
+        return cursor.rowcount == 1
+
+    def complete(self, job_id: str, result: Union[Dict[str, Any], List[Dict[str, Any]]]) -> bool:
+        """
+        Stores the result of a job. Returns False if a result was already
+        stored (e.g. by a worker whose lease had expired), which is kept.
+        """
+        cursor = self._connection.execute(
+            "UPDATE jobs SET status = ?, result = ?, lease_owner = NULL, updated = ? WHERE id = ? AND status != ?",
+            (DONE, json.dumps(result), time.time(), job_id, DONE)
+        )
+        return cursor.rowcount == 1
+
+    def fail(self, job_id: str, worker_id: str, error: str) -> None:
+        """
+        Releases a job after an error, it is retried until max_attempts
+        """
+        self._connection.execute(
+            "UPDATE jobs SET status = CASE WHEN attempts >= max_attempts THEN ? ELSE ? END, "
+            "error = ?, lease_owner = NULL, updated = ? WHERE id = ? AND status = ? AND lease_owner = ?",
+            (FAILED, PENDING, error, time.time(), job_id, LEASED, worker_id)
+        )
+
+    def counts(self) -> Dict[str, int]:
+        rows = self._connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict(rows)
+
+    def results(self, kind: str) -> List[QueuedJob]:
+        """
+        Returns the finished jobs of a kind, with their results
+        """
+        rows = self._connection.execute(
+            "SELECT id, kind, payload, attempts, result FROM jobs WHERE kind = ? AND status = ? ORDER BY id",
+            (kind, DONE)
+        ).fetchall()
+        return [QueuedJob(job_id, kind, json.loads(payload), attempts, json.loads(result))
+                for job_id, kind, payload, attempts, result in rows]
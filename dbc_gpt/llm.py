@@ -0,0 +1,293 @@
+import logging
+import openai
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+from dbc_gpt.budget import Budget, DeadlineExceeded
+from dbc_gpt.tracing import traced
+from dbc_gpt.usage import TokenUsage
+
+# Messages listed per request, the API maximum
+MESSAGES_PAGE_SIZE = 100
+# Statuses of a run that has not settled yet, its usage is only reported afterwards
+PENDING_STATUSES = ("queued", "in_progress", "cancelling")
+# Polls of a cancelled run, one per second, waiting for it to report its usage
+CANCEL_POLLS = 5
+# Statuses of a run that ended without a response
+FAILED_STATUSES = ("failed", "expired", "cancelled", "incomplete")
+
+
+class RunFailed(Exception):
+    """
+    Raised when the model run of an interaction ends without a response
+    """
+
+    def __init__(self, run_id: str, status: str, error: Optional[str] = None) -> None:
+        super().__init__(f"run {run_id} {status}" + (f": {error}" if error else ""))
+        self.status = status
+
+
+class HedgePolicy:
+    """
+    Decides when a model run is taking too long. Once an interaction has
+    been waiting for longer than `percentile` of the latencies observed so
+    far, a duplicate run is launched and the first one to complete is used.
+    """
+
+    def __init__(self, percentile: float = 95, min_samples: int = 10, window: int = 200) -> None:
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.latencies = deque(maxlen=window)
+        # Shared by the runs of an experiment, which may be executed concurrently
+        self._lock = threading.Lock()
+
+    def observe(self, latency: float) -> None:
+        with self._lock:
+            self.latencies.append(latency)
+
+    @property
+    def threshold(self) -> Optional[float]:
+        with self._lock:
+            ordered = sorted(self.latencies)
+        if len(ordered) < self.min_samples:
+            return None
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+        return ordered[index]
+
+    def expected_remaining(self, elapsed: float) -> float:
+        """
+        Expected time still to wait for a run that has been pending for
+        `elapsed` seconds, estimated from the observed latencies above it.
+        """
+        with self._lock:
+            slower = [latency for latency in self.latencies if latency > elapsed]
+        if not slower:
+            return 0.0
+        return sum(slower) / len(slower) - elapsed
+
+
+class Assistant:
+    
+    def __init__(self, id) -> None:
+        self.id = id
+
+class Thread:
+    
+    def __init__(self, assistant: Assistant, hedge_policy: HedgePolicy = None) -> None:
+        self.assistant = assistant
+        self.hedge_policy = hedge_policy
+        self._thread = openai.beta.threads.create()
+    
+    @property
+    def id(self):
+        return self._thread.id
+    
+    @traced("Thread.send_message")
+    def send_message(self, content: str) -> 'Interaction':
+        interaction = Interaction(self, content)
+        return interaction
+    
+    @property
+    def last_message(self) -> str:
+        response = openai.beta.threads.messages.list(
+            thread_id= self.id
+        )
+        # Returns last response from thread
+        return response.data[0].content[0].text.value
+
+    def messages(self) -> List[Dict[str, str]]:
+        """
+        Returns the role and text of every message of the thread, oldest
+        first. Messages without text, such as the empty message of a run in
+        progress, are skipped.
+        """
+        messages, after = [], None
+        while True:
+            page = openai.beta.threads.messages.list(
+                thread_id = self.id,
+                order = "asc",
+                limit = MESSAGES_PAGE_SIZE,
+                **({"after": after} if after else {})
+            )
+            for message in page.data:
+                text = "\n".join(part.text.value for part in message.content if part.type == "text")
+                if text:
+                    messages.append({"role": message.role, "content": text})
+            if not page.data or not getattr(page, "has_more", False):
+                return messages
+            after = page.data[-1].id
+
+    def fork(self) -> 'Thread':
+        """
+        Returns a new thread with a copy of the messages of this one
+        """
+        fork = Thread.__new__(Thread)
+        fork.assistant = self.assistant
+        fork.hedge_policy = self.hedge_policy
+        fork._thread = openai.beta.threads.create(messages = self.messages())
+        return fork
+
+class Interaction:
+    
+    def __init__(self, thread: Thread, prompt: str) -> None:
+        self.thread = thread
+        self.prompt = prompt
+        # Seconds waiting for the run to start and in total
+        self.queue_time = None
+        self.latency = 0.0
+        # Hedging metrics
+        self.hedged = False
+        self.hedge_won = False
+        self.hedge_saved = 0.0
+        # Usage of the cancelled run of a hedged request, original or duplicate
+        self._cancelled_usage = TokenUsage()
+        self._create_message()
+        self._create_run()
+
+    def _create_message(self):
+        openai.beta.threads.messages.create(
+            thread_id = self.thread.id,
+            role = "user",
+            content = self.prompt
+        )
+    
+    def _create_run(self):
+        self._run = openai.beta.threads.runs.create(
+            thread_id = self.thread.id,
+            assistant_id = self.thread.assistant.id,
+        )
+
+    def _hedge(self) -> 'Interaction':
+        # A thread only accepts one active run, so the duplicate request goes to a fork
+        hedge = Interaction.__new__(Interaction)
+        hedge.thread = self.thread.fork()
+        hedge.prompt = self.prompt
+        hedge._cancelled_usage = TokenUsage()
+        hedge._create_run()
+        return hedge
+
+    def cancel(self):
+        try:
+            openai.beta.threads.runs.cancel(
+                thread_id = self.thread.id,
+                run_id = self._run.id
+            )
+        except openai.OpenAIError as e:
+            logging.info("could not cancel run " + self._run.id + ": " + str(e))
+
+    def settle(self) -> TokenUsage:
+        """
+        Cancels the run and returns the tokens it consumed, which the
+        provider reports once the cancellation is done
+        """
+        self.cancel()
+        for _ in range(CANCEL_POLLS):
+            try:
+                self.remote_sync()
+            except openai.OpenAIError as e:
+                logging.info("could not retrieve cancelled run " + self._run.id + ": " + str(e))
+                break
+            if self.status not in PENDING_STATUSES:
+                break
+            time.sleep(1)
+        return TokenUsage.from_run(self._run)
+    
+    @property
+    def id(self):
+        return self._run.id
+    
+    def remote_sync(self):
+        self._run = openai.beta.threads.runs.retrieve(
+            thread_id = self.thread.id,
+            run_id = self._run.id
+        )
+    
+    @property
+    def status(self):
+        return self._run.status
+
+    @property
+    def generation_time(self) -> float:
+        return self.latency - (self.queue_time or 0.0)
+
+    @property
+    def usage(self) -> TokenUsage:
+        # Includes the run cancelled by hedging, its tokens are paid for as well
+        usage = TokenUsage.from_run(self._run)
+        usage.add(self._cancelled_usage)
+        return usage
+
+    @property
+    def total_tokens(self) -> int:
+        return self.usage.total_tokens
+
+    
+    @traced("Interaction.await_for_response")
+    def await_for_response(self, budget: Budget = None) -> str:
+        """
+        Polls the run until it is completed. If the budget gets exhausted
+        meanwhile, the run (and its hedge) is cancelled and DeadlineExceeded
+        is raised. If the run ends without a response (see FAILED_STATUSES),
+        RunFailed is raised unless its hedge completes; a hedge that fails
+        is dropped and the run awaited alone.
+        """
+        start_time = time.time()
+        policy = self.thread.hedge_policy
+        threshold = policy.threshold if policy else None
+        hedge: Optional[Interaction] = None
+        status = self.status
+        while (status != "completed"):
+            self.remote_sync()
+            status = self.status
+            logging.info("awaiting for a response. status: " + str(status))
+            if self.queue_time is None and status != "queued":
+                self.queue_time = time.time() - start_time
+            reason = budget.exceeded() if budget and status != "completed" else None
+            if reason:
+                self.cancel()
+                if hedge is not None:
+                    hedge.cancel()
+                raise DeadlineExceeded(reason)
+            if hedge is not None and status != "completed":
+                hedge.remote_sync()
+                if hedge.status == "completed":
+                    self._adopt(hedge, time.time() - start_time)
+                    break
+                if hedge.status in FAILED_STATUSES:
+                    logging.info(f"hedged run {hedge.id} {hedge.status}, awaiting the original run")
+                    self._cancelled_usage.add(TokenUsage.from_run(hedge._run))
+                    hedge = None
+            if status in FAILED_STATUSES:
+                if hedge is not None:
+                    self._cancelled_usage.add(hedge.settle())
+                error = getattr(self._run, "last_error", None)
+                raise RunFailed(self.id, status, getattr(error, "message", None))
+            elapsed = time.time() - start_time
+            if not self.hedged and threshold is not None and elapsed > threshold and status != "completed":
+                logging.info(f"run exceeded {elapsed:.1f}s (p{policy.percentile}), sending a hedged request")
+                hedge = self._hedge()
+                self.hedged = True
+            time.sleep(2)
+        else:
+            if hedge is not None:
+                self._cancelled_usage.add(hedge.settle())
+
+        self.latency = time.time() - start_time
+        if self.queue_time is None:
+            self.queue_time = 0.0
+        if policy:
+            policy.observe(self.latency)
+        return self.thread.last_message
+
+    def _adopt(self, hedge: 'Interaction', elapsed: float):
+        """
+        Keeps the result of the hedged request, cancelling the original run.
+        The conversation continues on the forked thread.
+        """
+        self._cancelled_usage.add(self.settle())
+        self.hedge_won = True
+        self.hedge_saved = self.thread.hedge_policy.expected_remaining(elapsed)
+        self.thread._thread = hedge.thread._thread
+        self._run = hedge._run
@@ -0,0 +1,521 @@
+import functools
+import logging
+import shutil
+import subprocess
+import tempfile
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple, Type, Union
+
+from dbc_gpt import metrics, tracing
+from dbc_gpt.boogie import BoogieSolver
+from dbc_gpt.budget import Budget, DeadlineExceeded, Limits
+from dbc_gpt.cascade import CascadeRouter, ModelTier, default_tier
+from dbc_gpt.counterexamples import CounterexampleExplainer, compact_feedback, solver_options
+from dbc_gpt.falsifier import TARGETS, Falsifier
+from dbc_gpt.llm import HedgePolicy, Interaction, RunFailed, Thread
+from dbc_gpt.minimizer import PostconditionMinimizer, subset_job_id
+from dbc_gpt.normalizer import spec_digest
+from dbc_gpt.prompts import PromptBuilder
+from dbc_gpt.repair import repair_spec
+from dbc_gpt.usage import TokenUsage
+from dbc_gpt.utils import Utils
+from dbc_gpt.verifier import SolcVerifyWrapper, SolverConfiguration, VerificationLimits, VerificationResult
+
+MAX_INTERACTIONS = 10
+
+# Phases timed in every iteration, see RunState.iteration_timings
+PHASES = ("llm_queue", "llm_generation", "extraction", "falsify", "solc_ast", "merge", "solc_verify", "translate",
+          "solve", "counterexample", "minimize", "feedback")
+
+FEEDBACK_INSTRUCTIONS = """
+        Instructions:
+        - Function Bodies: The specification must not contain function implementations.
+        - Postconditions Limit: Each function must have at most 4 postcondition (/// @notice postcondition) annotations above the function signature. Do not exceed this limit under any circumstances.
+        - Position: add the solc-verify annotation above the related function, example:
+            /// @notice postcondition supply == _totalSupply
+            function totalSupply() public view returns (uint256 supply);
+        - Output format: return the annotated interface inside code fence (```) to show the code block. RETURN JUST THE CONTRACT ANNOTATED, NOTHING MORE.\n\n
+        """
+
+
+@dataclass
+class RunState:
+    thread: Thread
+    router: CascadeRouter
+    verifier: Type[SolcVerifyWrapper]
+    # Makes the verification files of the run private, see SolcVerifyWrapper.verify
+    job_id: Optional[str] = None
+    budget: Budget = field(default_factory=Budget)
+    interaction_counter: int = 0
+    verification_status: List[str] = field(default_factory=list)
+    # Why the run ended, e.g. "verified" or "run token limit (100000)"
+    stop_reason: str = ""
+    # Hedged requests
+    interactions: int = 0
+    hedges: int = 0
+    hedges_won: int = 0
+    hedge_saved_time: float = 0.0
+    # Seconds spent in each of the PHASES, one dict per iteration
+    iteration_timings: List[Dict[str, float]] = field(default_factory=list)
+    # Tokens and cost of the run, in total and per iteration
+    usage: TokenUsage = field(default_factory=TokenUsage)
+    iteration_usage: List[TokenUsage] = field(default_factory=list)
+    # Spans of the run and of its current iteration, None when tracing is disabled
+    span: Optional[tracing.Span] = None
+    iteration_span: Optional[tracing.Span] = None
+    # Builds the prompts of the run for the target standard, see prompt_message
+    prompt_builder: Optional[PromptBuilder] = None
+    target: Optional[str] = None
+    # Keys of the segments of the initial prompt, e.g. ["instructions@v1", ...], empty without a prompt builder
+    prompt_segments: List[str] = field(default_factory=list)
+    # Ids of the EIP sections already sent to the model
+    eip_sections: Set[str] = field(default_factory=set)
+    # Local repair of the extracted specifications, see repair
+    repair: bool = False
+    repairs: int = 0
+    # The specification of the current iteration was repaired
+    repaired: bool = False
+    # Repaired specifications that verified, each saved (at most) one more model call
+    llm_calls_saved: int = 0
+    # [$rule] -> number of fixes applied by the rule during the run
+    repair_fixes: Dict[str, int] = field(default_factory=dict)
+    # Refutes specifications by concrete execution before solc-verify, see falsify
+    falsifier: Optional[Falsifier] = None
+    falsified: int = 0
+    # Turns the solver counterexamples of failed verifications into short feedback messages, see verify
+    explainer: Optional[CounterexampleExplainer] = None
+    compact_feedbacks: int = 0
+    # Translates to Boogie and solves in two stages instead of running solc-verify, see dbc_gpt.boogie
+    solver: Optional[BoogieSolver] = None
+    # Solver configurations solc-verify is raced with, see SolcVerifyWrapper.call_portfolio
+    portfolio: Tuple[SolverConfiguration, ...] = ()
+    # [$configuration] -> verifications it answered first
+    solver_wins: Dict[str, int] = field(default_factory=dict)
+    # Wall-clock, memory and solver time limits of each verification, see SolcVerifyWrapper.verify
+    verification_limits: Optional[VerificationLimits] = None
+    verification_timeouts: int = 0
+    # Merges the annotations into the precomputed template instead of compiling the spec, see dbc_gpt.templates
+    precomputed_templates: bool = False
+    # Pins the failures of a function down to some of its postconditions, see verify
+    minimizer: Optional[PostconditionMinimizer] = None
+    minimized_functions: int = 0
+
+    def record_interaction(self, interaction: Interaction) -> TokenUsage:
+        self.interactions += 1
+        self.hedges += interaction.hedged
+        self.hedges_won += interaction.hedge_won
+        self.hedge_saved_time += interaction.hedge_saved
+        self.record_timing("llm_queue", interaction.queue_time)
+        self.record_timing("llm_generation", interaction.generation_time)
+        usage = interaction.usage
+        usage.cost = self.router.tier.cost(usage)
+        self.usage.add(usage)
+        self.iteration_usage[-1].add(usage)
+        return usage
+
+    def record_timing(self, phase: str, seconds: float) -> None:
+        timings = self.iteration_timings[-1]
+        timings[phase] = timings.get(phase, 0.0) + seconds
+
+    def total_time(self, phase: str) -> float:
+        return sum(timings.get(phase, 0.0) for timings in self.iteration_timings)
+
+    def finish(self) -> None:
+        """
+        Ends the spans of the run and counts it as finished
+        """
+        metrics.RUNS_IN_FLIGHT.dec()
+        metrics.RUNS.inc(stop_reason=self.stop_reason)
+        if self.iteration_span:
+            self.iteration_span.end()
+        if self.span:
+            self.span.set(stop_reason=self.stop_reason, iterations=self.interaction_counter)
+            self.span.end()
+
+
+def step(name: str):
+    """
+    Traces a step as a child of the current iteration. The parent is taken
+    from the run state, as pipeline steps run on different threads.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(state: RunState, *args):
+            with tracing.span(name, parent=state.iteration_span):
+                return function(state, *args)
+        return wrapper
+    return decorator
+
+
+# The steps of an iteration, shared by the sequential loop and the pipeline (see dbc_gpt.pipeline)
+
+def next_interaction(state: RunState) -> bool:
+    """
+    Raises DeadlineExceeded if the budget of the run is exhausted
+    """
+    state.budget.check()
+    state.interaction_counter += 1
+    # Break the loop if the counter is greater than MAX_INTERACTIONS
+    if (state.interaction_counter > MAX_INTERACTIONS):
+        print(f"Counter exceeded {MAX_INTERACTIONS}, breaking the loop")
+        state.stop_reason = "interaction limit"
+        return False
+    print('COUNTER', state.interaction_counter)
+    state.iteration_timings.append({})
+    state.iteration_usage.append(TokenUsage())
+    metrics.record_iteration()
+    if state.iteration_span:
+        state.iteration_span.end()
+    state.iteration_span = tracing.start_span("iteration", parent=state.span, iteration=state.interaction_counter)
+    return True
+
+
+@step("generate")
+def generate(state: RunState, message: str) -> str:
+    state.thread.assistant = state.router.assistant
+    interaction: Interaction = state.thread.send_message(message)
+    response: str = interaction.await_for_response(state.budget)
+    usage = state.record_interaction(interaction)
+    state.budget.charge_tokens(interaction.total_tokens)
+    metrics.MODEL_LATENCY_SECONDS.observe(interaction.latency, tier=state.router.tier.name)
+    metrics.TOKENS.inc(usage.prompt_tokens, kind="prompt")
+    metrics.TOKENS.inc(usage.completion_tokens, kind="completion")
+    metrics.TOKENS.inc(usage.cached_tokens, kind="cached")
+    return response
+
+
+@step("extract")
+def extract(state: RunState, response: str) -> Optional[str]:
+    """
+    Returns the specification of the response, locally repaired when the
+    run repairs specifications (see repair)
+    """
+    start_time = time.perf_counter()
+    solidity_code = Utils.extract_solidity_code(response)
+    state.repaired = False
+    if solidity_code and state.repair:
+        solidity_code = repair(state, solidity_code)
+    state.record_timing("extraction", time.perf_counter() - start_time)
+    return solidity_code
+
+
+@step("falsify")
+def falsify(state: RunState, solidity_code: str) -> Optional[VerificationResult]:
+    """
+    Returns a failed verification result with the counterexamples if the
+    falsifier of the run refutes a postcondition, None otherwise (then the
+    specification still has to be verified)
+    """
+    if state.falsifier is None:
+        return None
+    falsification = state.falsifier.falsify(state.verifier, solidity_code)
+    state.record_timing("falsify", falsification.seconds)
+    if not falsification.counterexamples:
+        return None
+    state.falsified += 1
+    metrics.FALSIFIED.inc(verifier=state.verifier.__name__)
+    return falsification.verification_result(TARGETS[state.verifier.__name__].contract)
+
+
+@step("verify")
+def verify(state: RunState, solidity_code: str) -> VerificationResult:
+    state.budget.check()
+    start_time = time.time()
+    # The Boogie program is kept for the explainer, which solves it again for counterexamples
+    output_dir = tempfile.mkdtemp(prefix="bpl_") if state.explainer else None
+    try:
+        verification_result = state.verifier.verify(solidity_code, state.job_id, state.budget.remaining_seconds(),
+                                                    output_dir, state.solver, state.portfolio,
+                                                    state.verification_limits, state.precomputed_templates)
+        state.verification_timeouts += verification_result.timed_out
+        if verification_result.solver:
+            state.solver_wins[verification_result.solver] = state.solver_wins.get(verification_result.solver, 0) + 1
+        if output_dir and verification_result.status:
+            explain_start = time.perf_counter()
+            counterexamples = state.explainer.explain(verification_result, output_dir,
+                                                      state.budget.remaining_seconds(), state.verification_limits,
+                                                      *explanation_solver(state, verification_result))
+            verification_result.feedback = compact_feedback(verification_result, counterexamples)
+            verification_result.timings["counterexample"] = time.perf_counter() - explain_start
+            state.compact_feedbacks += verification_result.feedback is not None
+        if state.minimizer and verification_result.status and not verification_result.timed_out:
+            minimization = state.minimizer.minimize(state.verifier, solidity_code, verification_result,
+                                                    functools.partial(verify_subset, state))
+            verification_result.timings["minimize"] = minimization.seconds
+            description = minimization.describe()
+            if description:
+                state.minimized_functions += len(minimization.failing)
+                verification_result.feedback = (verification_result.feedback or verification_result.output) + \
+                    "\n" + description
+    except subprocess.TimeoutExpired:
+        state.budget.charge_solver_time(time.time() - start_time)
+        raise DeadlineExceeded(state.budget.exceeded() or "verification timeout")
+    finally:
+        if output_dir:
+            shutil.rmtree(output_dir, ignore_errors=True)
+    state.budget.charge_solver_time(time.time() - start_time)
+    for phase, seconds in verification_result.timings.items():
+        state.record_timing(phase, seconds)
+    return verification_result
+
+
+def explanation_solver(state: RunState, verification_result: VerificationResult) -> Tuple[str, Optional[float]]:
+    # The solver and per-function time limit the verification ran, the explainer solves the program with them
+    if state.solver:
+        return state.solver.solver, state.solver.solver_timeout
+    # Without a definitive answer, the result of the portfolio is the one of its first configuration
+    configuration = next((configuration for configuration in state.portfolio
+                          if configuration.name == verification_result.solver),
+                         state.portfolio[0] if state.portfolio else None)
+    limits = state.verification_limits or VerificationLimits()
+    return solver_options(limits.arguments + (configuration.arguments if configuration else ()))
+
+
+def verify_subset(state: RunState, verifier: Type[SolcVerifyWrapper], solidity_code: str) -> VerificationResult:
+    # A spec with some postconditions left out, verified as the run verifies its specs
+    return verifier.verify(solidity_code, subset_job_id(state.job_id), state.budget.remaining_seconds(), None,
+                           state.solver, state.portfolio, state.verification_limits, state.precomputed_templates)
+
+
+@step("repair")
+def repair(state: RunState, solidity_code: str) -> str:
+    """
+    Applies the local repairs (see dbc_gpt.repair) to an extracted
+    specification, before it is falsified and verified. Returns the
+    repaired specification.
+    """
+    repaired = repair_spec(solidity_code, state.verifier.TEMPLATE_PATH)
+    if not repaired.fixes:
+        return solidity_code
+    state.repairs += 1
+    state.repaired = True
+    for rule, count in repaired.fixes.items():
+        state.repair_fixes[rule] = state.repair_fixes.get(rule, 0) + count
+        metrics.REPAIRS.inc(count, rule=rule)
+    print(f"Repaired locally: {repaired.fixes}")
+    return repaired.code
+
+
+@step("feedback")
+def feedback(state: RunState, verification_result: VerificationResult) -> Optional[str]:
+    """
+    Returns the message asking the model to fix the specification, or None
+    if it has been verified
+    """
+    start_time = time.perf_counter()
+    state.router.record(verification_result)
+    if not verification_result.status:
+        if state.repaired:
+            state.llm_calls_saved += 1
+            metrics.LLM_CALLS_SAVED.inc()
+        state.record_timing("feedback", time.perf_counter() - start_time)
+        return None
+
+    if "OK" in verification_result.output and "ERROR" in verification_result.output:
+        state.verification_status.append(f'Iteraction: {state.interaction_counter}\n{verification_result.output}\n')
+
+    context = eip_context(state, verification_result)
+    verification_result.output = FEEDBACK_INSTRUCTIONS + context + (verification_result.feedback or
+                                                                    verification_result.output)
+    state.record_timing("feedback", time.perf_counter() - start_time)
+    logging.info("trying again with solc-verify output: " + str(verification_result.output))
+    return verification_result.output
+
+
+def eip_context(state: RunState, verification_result: VerificationResult) -> str:
+    """
+    Returns the EIP sections relevant to the failing functions that were not
+    sent yet, when the prompt builder of the run retrieves EIP sections
+    """
+    if state.prompt_builder is None or not state.prompt_builder.retrieves_eip or state.target is None:
+        return ""
+    failing = [function for function, verdict in verification_result.function_results.items() if verdict != "OK"]
+    if not failing:
+        return ""
+    context, sections = state.prompt_builder.eip_context(state.target, failing, exclude=state.eip_sections)
+    state.eip_sections.update(section.id for section in sections)
+    return context + "\n\n" if context else ""
+
+
+def loop(state: RunState, message: str) -> Union[str, bool]:
+    if not next_interaction(state):
+        return False
+    response = generate(state, message)
+    solidity_code = extract(state, response)
+
+    if not solidity_code:
+        print("ERROR - No Solidity code found in the response.")
+        if state.router.escalate():
+            return loop(state, message)
+        state.stop_reason = "no solidity code"
+        return False
+    try:
+        # Add error handling
+        verification_result = falsify(state, solidity_code) or verify(state, solidity_code)
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        print(f"An error occurred during verification: {e}")
+        state.stop_reason = "verification error"
+        return False
+
+    next_message = feedback(state, verification_result)
+    if next_message:
+        return loop(state, next_message)
+    else:
+        print("Verified!")
+        state.stop_reason = "verified"
+        return solidity_code
+
+
+def run_result(run: int, state: RunState, result: Union[str, bool], duration: float) -> dict:
+    annotated_contract = ""
+    
+    if result:
+        annotated_contract = result
+
+    return {
+        "run": run,
+        "time_taken": duration,
+        "iterations": max(state.interaction_counter - 1, 0),
+        "verified": result != False,
+        "annotated_contract": annotated_contract,
+        # Equal for verified specs with the same annotations, see dbc_gpt.normalizer
+        "spec_digest": spec_digest(annotated_contract) if annotated_contract else "",
+        "status": state.verification_status,
+        "tier": state.router.tier.name if result else "",
+        "tier_iterations": state.router.tier_iterations,
+        "function_tiers": state.router.function_tiers,
+        "hedge_rate": state.hedges / state.interactions if state.interactions else 0.0,
+        "hedges_won": state.hedges_won,
+        "hedge_saved_time": state.hedge_saved_time,
+        "stop_reason": state.stop_reason,
+        "prompt_segments": state.prompt_segments,
+        "tokens": state.budget.tokens,
+        "prompt_tokens": state.usage.prompt_tokens,
+        "completion_tokens": state.usage.completion_tokens,
+        "cached_tokens": state.usage.cached_tokens,
+        "cached_ratio": state.usage.cached_ratio,
+        "cost": state.usage.cost,
+        "iteration_usage": [usage.to_dict() for usage in state.iteration_usage],
+        "solver_time": state.budget.solver_time,
+        "repairs": state.repairs,
+        "llm_calls_saved": state.llm_calls_saved,
+        "repair_fixes": state.repair_fixes,
+        "falsified": state.falsified,
+        "compact_feedbacks": state.compact_feedbacks,
+        "solver_wins": state.solver_wins,
+        "verification_timeouts": state.verification_timeouts,
+        "minimized_functions": state.minimized_functions,
+        **{f"time_{phase}": state.total_time(phase) for phase in PHASES},
+        "iteration_timings": state.iteration_timings,
+    }
+
+
+def new_run_state(verifier: Type[SolcVerifyWrapper], tiers: List[ModelTier], hedge_policy: Optional[HedgePolicy],
+                  job_id: Optional[str] = None, budget: Budget = None, prompt_builder: PromptBuilder = None,
+                  target: str = None, repair: bool = False, falsifier: Falsifier = None,
+                  explainer: CounterexampleExplainer = None, solver: BoogieSolver = None,
+                  portfolio: Tuple[SolverConfiguration, ...] = (),
+                  verification_limits: VerificationLimits = None, precomputed_templates: bool = False,
+                  minimizer: PostconditionMinimizer = None) -> RunState:
+    router = CascadeRouter(tiers)
+    state = RunState(Thread(router.assistant, hedge_policy), router, verifier, job_id, budget or Budget(),
+                     prompt_builder=prompt_builder, target=target, repair=repair, falsifier=falsifier,
+                     explainer=explainer, solver=solver, portfolio=tuple(portfolio),
+                     verification_limits=verification_limits, precomputed_templates=precomputed_templates,
+                     minimizer=minimizer)
+    state.span = tracing.start_span("run", verifier=verifier.__name__, job_id=job_id)
+    metrics.RUNS_IN_FLIGHT.inc()
+    return state
+
+
+def prompt_message(state: RunState, prompt: str, examples: List[str] = None) -> str:
+    """
+    Returns the first message of a run: the prompt built by the prompt
+    builder of the run if it has one, prompt otherwise
+    """
+    if state.prompt_builder is None or state.target is None:
+        return prompt
+    built = state.prompt_builder.build(state.target, examples or [])
+    state.prompt_segments = built.segments
+    state.eip_sections.update(built.eip_sections)
+    return built.text
+
+
+def run_loop(state: RunState, message: str) -> Union[str, bool]:
+    try:
+        return loop(state, message)
+    except DeadlineExceeded as e:
+        print(f"Deadline exceeded, stopping the run: {e.reason}")
+        state.stop_reason = e.reason
+        return False
+    except RunFailed as e:
+        print(f"Model run failed, stopping the run: {e}")
+        state.stop_reason = f"model run {e.status}"
+        return False
+    finally:
+        state.finish()
+
+
+def run_verification_process(prompt: str, verifier: Type[SolcVerifyWrapper], assistant_id: str = None,
+                             runs: int = 10, tiers: List[ModelTier] = None,
+                             hedge_percentile: Optional[float] = 95, run_limits: Limits = None,
+                             limits: Limits = None, repair: bool = False,
+                             falsifier: Falsifier = None, explainer: CounterexampleExplainer = None,
+                             solver: BoogieSolver = None,
+                             portfolio: Tuple[SolverConfiguration, ...] = (),
+                             verification_limits: VerificationLimits = None,
+                             precomputed_templates: bool = False,
+                             minimizer: PostconditionMinimizer = None) -> List[dict]:
+    """
+    Parameters
+        prompt: the initial message sent to the assistant in every run
+        verifier: the SolcVerifyWrapper of the ERC standard being annotated
+        assistant_id: the assistant used when no model cascade is given
+        runs: number of independent runs (threads)
+        tiers: model tiers, from the cheapest to the strongest, see CascadeRouter
+        hedge_percentile: latency percentile after which a model run is
+            hedged with a duplicate request, None disables hedging
+        run_limits: time, token and solver time limits of each run
+        limits: limits of the whole experiment, the remaining runs are
+            stopped as soon as they are exhausted
+        repair: repairs the extracted specifications locally before
+            verifying them, see dbc_gpt.loop.repair
+        falsifier: refutes specifications by concrete execution before
+            running solc-verify, see dbc_gpt.falsifier
+        explainer: replaces the solc-verify output in the feedback by the
+            counterexamples of the failing postconditions, see dbc_gpt.counterexamples
+        solver: verifies in two stages, translation (cached) and solving,
+            instead of running solc-verify, see dbc_gpt.boogie
+        portfolio: solver configurations solc-verify is raced with, the
+            first definitive answer is taken, see SolcVerifyWrapper.call_portfolio
+        verification_limits: wall-clock, memory and solver time limits of
+            each verification, a verification exceeding its wall-clock limit
+            is timed out and fed back like a failure
+        precomputed_templates: merges the annotations into the template
+            precomputed once instead of compiling each spec, see dbc_gpt.templates
+        minimizer: adds to the feedback the postconditions each failing
+            function fails because of, see dbc_gpt.minimizer
+    """
+    if tiers is None:
+        tiers = [default_tier(assistant_id)]
+    # Latencies are shared across runs, so the hedging threshold is learned along the experiment
+    hedge_policy = HedgePolicy(hedge_percentile) if hedge_percentile is not None else None
+
+    experiment_budget = Budget(limits, name="experiment")
+
+    results = []
+    for i in range(runs):
+        start_time = time.time()
+        state = new_run_state(verifier, tiers, hedge_policy, budget=Budget(run_limits, experiment_budget),
+                              repair=repair, falsifier=falsifier, explainer=explainer, solver=solver,
+                              portfolio=portfolio, verification_limits=verification_limits,
+                              precomputed_templates=precomputed_templates, minimizer=minimizer)
+        result = run_loop(state, prompt)
+        end_time = time.time()
+        duration = end_time - start_time
+        results.append(run_result(i + 1, state, result, duration))
+    
+    return results
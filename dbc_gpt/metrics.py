@@ -0,0 +1,257 @@
+import bisect
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Tuple
+
+# Seconds, from a few hundred milliseconds (merge, cached verdicts) to several minutes (slow model runs)
+DEFAULT_BUCKETS = (0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+
+
+class Metric:
+    TYPE = None
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+    def _format_labels(self, key: Tuple[str, ...], extra: str = "") -> str:
+        pairs = [f'{label}="{value}"' for label, value in zip(self.labels, key)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.TYPE}"]
+        return "\n".join(lines + self.samples())
+
+
+class Counter(Metric):
+    TYPE = "counter"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> None:
+        super().__init__(name, help, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def total(self) -> float:
+        with self._lock:
+            return sum(self._values.values())
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            return [f"{self.name}{self._format_labels(key)} {value}" for key, value in sorted(self._values.items())]
+
+
+class Gauge(Metric):
+    """
+    Gauge set explicitly, or computed at scrape time by the functions given
+    to set_function (e.g. the size of a queue)
+    """
+    TYPE = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> None:
+        super().__init__(name, help, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._functions: Dict[Tuple[str, ...], Callable[[], float]] = {}
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], float], **labels) -> None:
+        with self._lock:
+            self._functions[self._key(labels)] = function
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+            functions = dict(self._functions)
+        for key, function in functions.items():
+            values[key] = function()
+        return [f"{self.name}{self._format_labels(key)} {value}" for key, value in sorted(values.items())]
+
+
+class Histogram(Metric):
+    TYPE = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # [$labels] -> (count per bucket, +Inf included, sum)
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                    lines.append(f"{self.name}_bucket{self._format_labels(key, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{self._format_labels(key)} {total}")
+                lines.append(f"{self.name}_count{self._format_labels(key)} {cumulative}")
+        return lines
+
+
+class RateWindow:
+    """
+    Events per minute over the last `window` seconds, for dashboards that
+    are not backed by a Prometheus server computing rate()
+    """
+
+    def __init__(self, window: float = 60) -> None:
+        self.window = window
+        self._events = deque()
+        self._lock = threading.Lock()
+
+    def add(self) -> None:
+        with self._lock:
+            self._events.append(time.time())
+
+    def per_minute(self) -> float:
+        now = time.time()
+        with self._lock:
+            while self._events and self._events[0] < now - self.window:
+                self._events.popleft()
+            return len(self._events) * 60 / self.window
+
+
+class Registry:
+
+    def __init__(self) -> None:
+        self._metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+RUNS_IN_FLIGHT = REGISTRY.register(Gauge("dbc_gpt_runs_in_flight", "Runs started and not finished yet"))
+RUNS = REGISTRY.register(Counter("dbc_gpt_runs_total", "Finished runs by stop reason", ("stop_reason",)))
+VERIFIED_RATIO = REGISTRY.register(Gauge("dbc_gpt_verified_ratio", "Share of the finished runs that were verified"))
+ITERATIONS = REGISTRY.register(Counter("dbc_gpt_iterations_total", "Model/verifier iterations started"))
+ITERATIONS_PER_MINUTE = REGISTRY.register(Gauge("dbc_gpt_iterations_per_minute",
+                                                "Iterations started over the last minute"))
+QUEUE_DEPTH = REGISTRY.register(Gauge("dbc_gpt_queue_depth", "Jobs waiting in a pipeline stage", ("stage",)))
+SOLC_VERIFY_SECONDS = REGISTRY.register(Histogram("dbc_gpt_solc_verify_seconds", "Duration of solc-verify calls",
+                                                  ("verifier",)))
+MODEL_LATENCY_SECONDS = REGISTRY.register(Histogram("dbc_gpt_model_latency_seconds",
+                                                    "Time from sending a message to the completed model run",
+                                                    ("tier",)))
+TOKENS = REGISTRY.register(Counter("dbc_gpt_tokens_total", "Tokens consumed by model runs, by kind (prompt, "
+                                   "completion, cached prompt)", ("kind",)))
+CACHE_LOOKUPS = REGISTRY.register(Counter("dbc_gpt_cache_lookups_total", "Cache lookups by cache and result (hit/miss)",
+                                          ("cache", "result")))
+CACHE_HIT_RATIO = REGISTRY.register(Gauge("dbc_gpt_cache_hit_ratio", "Share of the lookups of a cache that hit",
+                                          ("cache",)))
+REPAIRS = REGISTRY.register(Counter("dbc_gpt_repairs_total", "Local fixes applied to extracted specifications, by rule",
+                                    ("rule",)))
+LLM_CALLS_SAVED = REGISTRY.register(Counter("dbc_gpt_llm_calls_saved_total",
+                                            "Specifications verified after a local repair instead of a new model call"))
+FALSIFIED = REGISTRY.register(Counter("dbc_gpt_falsified_total",
+                                      "Specifications refuted by concrete execution before solc-verify",
+                                      ("verifier",)))
+VERIFICATION_TIMEOUTS = REGISTRY.register(Counter("dbc_gpt_verification_timeouts_total",
+                                                  "Verifications stopped by their wall-clock limit", ("verifier",)))
+PORTFOLIO_WINS = REGISTRY.register(Counter("dbc_gpt_portfolio_wins_total",
+                                           "Verifications answered first by a solver configuration of the portfolio",
+                                           ("verifier", "solver")))
+SOLVER_RETRIES = REGISTRY.register(Counter("dbc_gpt_solver_retries_total",
+                                           "Procedures solved again with a higher limit after timing out, by verdict "
+                                           "of the retry", ("verdict",)))
+BATCHED_CANDIDATES = REGISTRY.register(Counter("dbc_gpt_batched_candidates_total",
+                                               "Candidate specifications of verification batches, by result: verified "
+                                               "in the batch or on their own (fallback)", ("verifier", "result")))
+MINIMIZER_VERIFICATIONS = REGISTRY.register(Counter("dbc_gpt_minimizer_verifications_total",
+                                                    "Verifications of postcondition subsets run by the minimizer",
+                                                    ("verifier",)))
+
+_iteration_window = RateWindow()
+ITERATIONS_PER_MINUTE.set_function(_iteration_window.per_minute)
+
+
+def _verified_ratio() -> float:
+    finished = RUNS.total()
+    return RUNS.value(stop_reason="verified") / finished if finished else 0.0
+
+
+VERIFIED_RATIO.set_function(_verified_ratio)
+
+
+def record_iteration() -> None:
+    ITERATIONS.inc()
+    _iteration_window.add()
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    CACHE_LOOKUPS.inc(cache=cache, result="hit" if hit else "miss")
+    hits = CACHE_LOOKUPS.value(cache=cache, result="hit")
+    CACHE_HIT_RATIO.set(hits / (hits + CACHE_LOOKUPS.value(cache=cache, result="miss")), cache=cache)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        # Scrapes every few seconds would flood the experiment logs
+        pass
+
+
+def serve(port: int = 9464, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """
+    Serves the metrics in the Prometheus text format on http://host:port/metrics
+    from a daemon thread
+    """
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics", daemon=True)
+    thread.start()
+    return server
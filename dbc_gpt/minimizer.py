@@ -0,0 +1,183 @@
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence, Type
+
+from dbc_gpt import metrics
+from dbc_gpt.normalizer import spec_digest
+from dbc_gpt.repair import MAX_POSTCONDITIONS, annotated_functions, annotation_tags, function_signature, tag_text
+from dbc_gpt.verifier import SolcVerifyWrapper, VerificationResult
+
+POSTCONDITION_PATTERN = re.compile(r'^@notice\s+postcondition\s+(.*?)\s*$')
+
+# Verifies a spec, e.g. with the solver, portfolio and limits of the run
+Verify = Callable[[Type[SolcVerifyWrapper], str], VerificationResult]
+
+
+@dataclass
+class Minimization:
+    # [$function] -> the smallest set of its postconditions that still fails
+    failing: Dict[str, List[str]] = field(default_factory=dict)
+    verifications: int = 0
+    seconds: float = 0.0
+
+    def describe(self) -> Optional[str]:
+        """
+        Returns the feedback lines naming the failing postconditions, None
+        if no failure could be pinned down to postconditions
+        """
+        if not self.failing:
+            return None
+        lines = ["Each of these functions still fails with only these postconditions, fix or remove them:"]
+        for function, postconditions in sorted(self.failing.items()):
+            lines.append(f"- {function}: " + ", ".join(f"`{postcondition}`" for postcondition in postconditions))
+        return "\n".join(lines)
+
+
+def postcondition_lines(code: str) -> Dict[str, List[List[int]]]:
+    """
+    Returns [$functionName] -> the postconditions of the function (of all
+    its overloads), each as the indexes of its lines: the line of its tag
+    and its continuation lines, up to the next tag
+    """
+    lines = code.split("\n")
+    postconditions = {}
+    for annotations, signature in annotated_functions(lines):
+        function = function_signature("\n".join(lines[signature:]))
+        tags = [tag for tag in annotation_tags(lines, annotations) if POSTCONDITION_PATTERN.match(tag_text(lines, tag))]
+        if function and tags:
+            postconditions.setdefault(function[0], []).extend(tags)
+    return postconditions
+
+
+def without_lines(code: str, dropped: Sequence[int]) -> str:
+    dropped = set(dropped)
+    return "\n".join(line for index, line in enumerate(code.split("\n")) if index not in dropped)
+
+
+class PostconditionMinimizer:
+    """
+    Finds, for each function that failed verification, which of its
+    postconditions make it fail, by verifying the spec with subsets of them
+    (the other functions keep all of their annotations). A function with at
+    most `fast_path` postconditions has each of them verified on its own;
+    the others are minimized by delta debugging (ddmin), whose subsets and
+    complements of a round are verified concurrently.
+
+    The verifications of all the runs share the `workers` threads of the
+    minimizer, and their verdicts are cached by the canonical form of the
+    spec, so a subset already verified (e.g. by an earlier iteration, maybe
+    formatted differently) is not verified again.
+    """
+
+    def __init__(self, workers: int = 4, fast_path: int = MAX_POSTCONDITIONS, cache_size: int = 1024) -> None:
+        self.fast_path = fast_path
+        self.cache_size = cache_size
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="minimizer")
+        # [$verifierName:$specDigest] -> verdict of each function, see dbc_gpt.normalizer.spec_digest
+        self._cache: "OrderedDict[str, Dict[str, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def minimize(self, verifier: Type[SolcVerifyWrapper], code: str, verification_result: VerificationResult,
+                 verify: Verify) -> Minimization:
+        """
+        Parameters
+            verification_result: the failed verification of the spec
+            verify: verifies the specs with the subsets, may raise
+            subprocess.TimeoutExpired when the run has no time left
+        """
+        start_time = time.perf_counter()
+        minimization = Minimization()
+        lines = code.split("\n")
+        postconditions = postcondition_lines(code)
+        failing = [function for function, verdict in verification_result.function_results.items()
+                   if verdict == "ERROR" and function in postconditions]
+        if not failing:
+            return minimization
+
+        def fails(function: str, kept: Sequence[int]) -> bool:
+            # kept: positions of the postconditions of the function kept, the lines of the others are dropped
+            dropped = [index for position, tag in enumerate(postconditions[function]) if position not in kept
+                       for index in tag]
+            return self._verdicts(verifier, without_lines(code, dropped), verify, minimization).get(function) == "ERROR"
+
+        # Fast path: the function without postconditions, and each postcondition on its own, for every function at once
+        tests = []
+        for function in failing:
+            tests.append((function, ()))
+            if len(postconditions[function]) <= self.fast_path:
+                tests += [(function, (position,)) for position in range(len(postconditions[function]))]
+        results = dict(zip(tests, self._map(lambda test: fails(*test), tests)))
+        for function in failing:
+            if results[(function, ())]:
+                # Fails without any postcondition: the implementation or another annotation is at fault
+                continue
+            positions = list(range(len(postconditions[function])))
+            singles = [position for position in positions if results.get((function, (position,)))]
+            if not singles:
+                singles = self._ddmin(positions, lambda kept: fails(function, kept))
+            minimization.failing[function] = [
+                POSTCONDITION_PATTERN.match(tag_text(lines, postconditions[function][position])).group(1)
+                for position in singles]
+        minimization.seconds = time.perf_counter() - start_time
+        return minimization
+
+    def _ddmin(self, items: List[int], fails: Callable[[Sequence[int]], bool]) -> List[int]:
+        # Zeller's ddmin, returns a 1-minimal failing subset of the (failing) items
+        granularity = 2
+        while len(items) >= 2:
+            size = -(-len(items) // granularity)
+            chunks = [items[start:start + size] for start in range(0, len(items), size)]
+            complements = [[item for item in items if item not in chunk] for chunk in chunks]
+            candidates = chunks + (complements if len(chunks) > 2 else [])
+            outcomes = self._map(fails, candidates)
+            failing = next((candidate for candidate, outcome in zip(candidates, outcomes) if outcome), None)
+            if failing is not None and failing in chunks:
+                items, granularity = failing, 2
+            elif failing is not None:
+                items, granularity = failing, max(granularity - 1, 2)
+            elif granularity >= len(items):
+                break
+            else:
+                granularity = min(granularity * 2, len(items))
+        return items
+
+    def _map(self, function: Callable, arguments: list) -> list:
+        futures = [self._pool.submit(function, argument) for argument in arguments]
+        try:
+            return [future.result() for future in futures]
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def _verdicts(self, verifier: Type[SolcVerifyWrapper], code: str, verify: Verify,
+                  minimization: Minimization) -> Dict[str, str]:
+        key = f"{verifier.__name__}:{spec_digest(code)}"
+        with self._lock:
+            verdicts = self._cache.get(key)
+            if verdicts is not None:
+                self._cache.move_to_end(key)
+        metrics.record_cache("minimizer", verdicts is not None)
+        if verdicts is not None:
+            return verdicts
+        verification_result = verify(verifier, code)
+        verdicts = verification_result.function_results
+        metrics.MINIMIZER_VERIFICATIONS.inc(verifier=verifier.__name__)
+        with self._lock:
+            minimization.verifications += 1
+            # Timed out verdicts are not definitive, and a spec without verdicts (e.g. with a compilation error)
+            # may fail for reasons its annotations do not tell, they are not cached
+            if verdicts and not verification_result.timed_out:
+                self._cache[key] = verdicts
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return verdicts
+
+
+def subset_job_id(job_id: Optional[str]) -> str:
+    # The subsets of a run are verified concurrently, each needs its own files
+    return f"{job_id or 'minimize'}_{uuid.uuid4().hex[:8]}"
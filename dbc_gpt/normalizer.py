@@ -0,0 +1,139 @@
+import argparse
+import hashlib
+import re
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from dbc_gpt.falsifier import BINARY_PRECEDENCE, ExpressionParser, Unsupported, tokenize_expression
+from dbc_gpt.repair import annotated_functions, annotation_tags, function_signature
+
+# e.g. "@notice postcondition _balances[to] == __verifier_old_uint(_balances[to]) + value", comments removed
+ANNOTATION_PATTERN = re.compile(r'^@notice\s+(precondition|postcondition|modifies|emits)\s+(.*?)\s*$', re.DOTALL)
+# The declarations of a quantifier, e.g. "forall (address a, address b) expression"
+QUANTIFIER_PATTERN = re.compile(r'^(forall|exists)\s*\(([^()]*)\)\s*(.*)$')
+# Unary operators and the postfix ones (index, member, call) bind tighter than any binary operator
+UNARY_PRECEDENCE = 8
+POSTFIX_PRECEDENCE = 9
+
+
+def render_minimal(node: tuple, precedence: int = 0) -> str:
+    """
+    Renders a node of ExpressionParser with only the parentheses its
+    precedence requires, where `precedence` is the one its context needs
+    """
+    kind = node[0]
+    if kind == "literal":
+        return str(node[1]).lower() if isinstance(node[1], bool) else str(node[1])
+    if kind == "name":
+        return node[1]
+    if kind == "index":
+        return f"{render_minimal(node[1], POSTFIX_PRECEDENCE)}[{render_minimal(node[2])}]"
+    if kind == "member":
+        return f"{render_minimal(node[1], POSTFIX_PRECEDENCE)}.{node[2]}"
+    if kind == "call":
+        arguments = ", ".join(render_minimal(argument) for argument in node[2])
+        return f"{render_minimal(node[1], POSTFIX_PRECEDENCE)}({arguments})"
+    if kind == "unary":
+        text, own = f"{node[1]}{render_minimal(node[2], UNARY_PRECEDENCE)}", UNARY_PRECEDENCE
+    elif kind == "binary":
+        own = BINARY_PRECEDENCE[node[1]]
+        # ==> is right associative, the other operators left associative
+        left, right = (own + 1, own) if node[1] == "==>" else (own, own + 1)
+        text = f"{render_minimal(node[2], left)} {node[1]} {render_minimal(node[3], right)}"
+    else:
+        own = 0
+        text = f"{render_minimal(node[1], 1)} ? {render_minimal(node[2])} : {render_minimal(node[3])}"
+    return f"({text})" if own < precedence else text
+
+
+def canonical_expression(text: str) -> str:
+    """
+    Returns the expression with single spaces around binary operators and
+    no redundant parentheses, e.g. "((a+b) == c)" -> "a + b == c". The
+    body of a quantifier is canonicalized, the other expressions the parser
+    does not support only have their whitespace normalized.
+    """
+    text = text.split("//")[0].strip()
+    quantifier = QUANTIFIER_PATTERN.match(text)
+    if quantifier:
+        declarations = ", ".join(" ".join(declaration.split()) for declaration in quantifier.group(2).split(","))
+        return f"{quantifier.group(1)} ({declarations}) {canonical_expression(quantifier.group(3))}"
+    try:
+        return render_minimal(ExpressionParser(text).parse())
+    except Unsupported:
+        pass
+    try:
+        return " ".join(tokenize_expression(text))
+    except Unsupported:
+        return " ".join(text.split())
+
+
+@dataclass(frozen=True)
+class CanonicalSpec:
+    # [$functionName + $numberOfParameters] -> its annotations, e.g. ("postcondition a + b == c", ...), sorted
+    functions: Dict[str, Tuple[str, ...]]
+    # The code with its whitespace normalized, for a spec without any /// annotation (e.g. with /** */ ones)
+    fallback: Optional[str] = None
+
+    @property
+    def text(self) -> str:
+        if self.fallback is not None:
+            return self.fallback + "\n"
+        lines = []
+        for function, annotations in sorted(self.functions.items()):
+            lines.append(f"{function}:")
+            lines += [f"  {annotation}" for annotation in annotations]
+        return "\n".join(lines) + "\n"
+
+    @property
+    def digest(self) -> str:
+        return hashlib.sha256(self.text.encode()).hexdigest()
+
+    def function_digest(self, function: str) -> str:
+        return hashlib.sha256("\n".join(self.functions.get(function, ())).encode()).hexdigest()
+
+
+def canonical_spec(code: str) -> CanonicalSpec:
+    """
+    Returns the canonical form of the solc-verify annotations of the spec:
+    for every annotated function, its preconditions, postconditions,
+    modifies and emits clauses with canonical expressions, without
+    duplicates and sorted. Comments, @param/@return lines, whitespace and
+    the order of the functions and of their annotations are left out, as
+    they do not change what is verified. An annotation spans its tag line
+    and the continuation lines up to the next tag.
+
+    A spec without any /// annotation (e.g. annotated with /** */) is only
+    canonical up to whitespace, see CanonicalSpec.fallback.
+    """
+    lines = code.split("\n")
+    functions = {}
+    for annotation_lines, signature in annotated_functions(lines):
+        function = function_signature("\n".join(lines[signature:]))
+        annotations = set()
+        for tag in annotation_tags(lines, annotation_lines):
+            # Without the /// and the // comment of each line, e.g. "@notice postcondition a == b && c == d"
+            text = " ".join(lines[index].strip()[len("///"):].split("//")[0].strip() for index in tag)
+            annotation = ANNOTATION_PATTERN.match(text)
+            if annotation:
+                annotations.add(f"{annotation.group(1)} {canonical_expression(annotation.group(2))}")
+        if function and annotations:
+            key = f"{function[0]}{function[1]}"
+            functions[key] = tuple(sorted(annotations | set(functions.get(key, ()))))
+    if not functions:
+        return CanonicalSpec(functions, " ".join(code.split()))
+    return CanonicalSpec(functions)
+
+
+def spec_digest(code: str) -> str:
+    # Equal for specs that only differ in formatting, comments or annotation order (or whitespace, without annotations)
+    return canonical_spec(code).digest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Prints the canonical form and digest of the annotations of a spec")
+    parser.add_argument("spec", help="Solidity file with the annotated function signatures", type=str)
+    args = parser.parse_args()
+    with open(args.spec) as spec_file:
+        canonical = canonical_spec(spec_file.read())
+    print(canonical.text + canonical.digest)
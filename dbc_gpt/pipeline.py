@@ -0,0 +1,268 @@
+import glob
+import importlib.util
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple, Type, Union
+
+from dbc_gpt import metrics
+from dbc_gpt.boogie import BoogieSolver
+from dbc_gpt.budget import Budget, DeadlineExceeded, Limits
+from dbc_gpt.cascade import ModelTier, default_tier
+from dbc_gpt.llm import HedgePolicy, RunFailed
+from dbc_gpt.counterexamples import CounterexampleExplainer
+from dbc_gpt.falsifier import Falsifier
+from dbc_gpt.loop import (RunState, extract, falsify, feedback, generate, new_run_state, next_interaction,
+                          prompt_message, run_result, verify)
+from dbc_gpt.minimizer import PostconditionMinimizer
+from dbc_gpt.prompts import PromptBuilder
+from dbc_gpt.verifier import SolcVerifyWrapper, SolverConfiguration, VerificationLimits, VerificationResult
+
+LOOP_FILES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "experiments", "loop_files")
+
+
+@dataclass
+class RunConfig:
+    # Name of the configuration, e.g. "erc20_[20]"
+    name: str
+    prompt: str
+    verifier: Type[SolcVerifyWrapper]
+    assistant_id: str = None
+    runs: int = 10
+    # Model tiers of the cascade, the assistant of the script alone by default
+    tiers: List[ModelTier] = None
+    # Standards of the contract to annotate and of the examples, see PromptBuilder
+    target: str = None
+    examples: List[str] = None
+
+
+def load_config(loop_file_path: str) -> RunConfig:
+    """
+    Reads the prompt, verifier, number of runs and, if the script declares
+    them, the TIERS of a loop script without running it
+    """
+    module_name = os.path.splitext(os.path.basename(loop_file_path))[0]
+    spec = importlib.util.spec_from_file_location(module_name, loop_file_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    name = os.path.splitext(module.OUTPUT_FILE)[0]
+    return RunConfig(name, module.PROMPT, module.VERIFIER, module.assistant_id, module.RUNS,
+                     tiers=getattr(module, "TIERS", None), target=module.TARGET, examples=module.EXAMPLES)
+
+
+def load_configs(pattern: str = "loop*.py") -> List[RunConfig]:
+    return [load_config(path) for path in sorted(glob.glob(os.path.join(LOOP_FILES_DIR, pattern)))]
+
+
+@dataclass
+class Job:
+    config: RunConfig
+    run: int
+    state: RunState
+    message: str
+    start_time: float
+    response: str = None
+    solidity_code: str = None
+    verification_result: VerificationResult = None
+    result: Union[str, bool] = False
+    duration: float = 0.0
+
+
+class Pipeline:
+    """
+    Executes the runs of one or more configurations as a producer/consumer
+    pipeline: generate -> extract -> verify -> feedback -> generate ...
+
+    Each stage has its own bounded queue and pool of worker threads, so while
+    some runs wait for the model others are being verified, keeping both the
+    API quota and the local cores busy. A run has a single job in the pipeline
+    at any time and at most `max_in_flight` runs are admitted at once.
+    """
+
+    STAGES = ("generate", "extract", "verify", "feedback")
+
+    def __init__(self, generate_workers: int = 8, extract_workers: int = 1, verify_workers: int = None,
+                 feedback_workers: int = 1, max_in_flight: int = None,
+                 hedge_percentile: Optional[float] = 95, run_limits: Limits = None,
+                 limits: Limits = None, prompt_builder: PromptBuilder = None, repair: bool = False,
+                 falsifier: Falsifier = None, explainer: CounterexampleExplainer = None,
+                 solver: BoogieSolver = None, portfolio: Tuple[SolverConfiguration, ...] = (),
+                 verification_limits: VerificationLimits = None, precomputed_templates: bool = False,
+                 minimizer: PostconditionMinimizer = None, tiers: List[ModelTier] = None) -> None:
+        verify_workers = verify_workers or os.cpu_count() or 1
+        self.workers = {
+            "generate": generate_workers,
+            "extract": extract_workers,
+            "verify": verify_workers,
+            "feedback": feedback_workers,
+        }
+        self.max_in_flight = max_in_flight or generate_workers + verify_workers
+        self.hedge_percentile = hedge_percentile
+        # Model tiers of every configuration, e.g. DEFAULT_TIERS, instead of their own
+        self.tiers = tiers
+        # See run_verification_process, limits apply to the whole run() call
+        self.run_limits = run_limits
+        self.limits = limits
+        self.budget: Budget = None
+        # Builds the prompts from the TARGET and EXAMPLES of the configurations instead of using their PROMPT
+        self.prompt_builder = prompt_builder
+        # Repairs the specifications locally in the extract stage, see dbc_gpt.loop.repair
+        self.repair = repair
+        # Refutes specifications by concrete execution in the verify stage, before solc-verify
+        self.falsifier = falsifier
+        # Builds short feedback from the solver counterexamples, see dbc_gpt.counterexamples
+        self.explainer = explainer
+        # Verifies in two stages with cached translations instead of running solc-verify, see dbc_gpt.boogie
+        self.solver = solver
+        # Solver configurations solc-verify is raced with, see SolcVerifyWrapper.call_portfolio
+        self.portfolio = portfolio
+        # Wall-clock, memory and solver time limits of each verification, see SolcVerifyWrapper.verify
+        self.verification_limits = verification_limits
+        # Merges the annotations into the precomputed template instead of compiling the spec, see dbc_gpt.templates
+        self.precomputed_templates = precomputed_templates
+        # Pins the failures of the specs down to postconditions in the verify stage, see dbc_gpt.minimizer
+        self.minimizer = minimizer
+        # As runs hold a single job, a queue never holds more than max_in_flight jobs
+        self.queues = {stage: queue.Queue(maxsize=self.max_in_flight) for stage in self.STAGES}
+        self.handlers = {
+            "generate": self._generate,
+            "extract": self._extract,
+            "verify": self._verify,
+            "feedback": self._feedback,
+        }
+        self._slots = threading.Semaphore(self.max_in_flight)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._all_done = threading.Event()
+        self._finished: List[Job] = []
+
+    def run(self, configs: List[RunConfig]) -> Dict[str, List[dict]]:
+        """
+        Runs every configuration and returns their results, keyed by name
+        """
+        for stage in self.STAGES:
+            metrics.QUEUE_DEPTH.set_function(self.queues[stage].qsize, stage=stage)
+        threads = []
+        for stage in self.STAGES:
+            for i in range(self.workers[stage]):
+                thread = threading.Thread(target=self._work, args=(stage,), name=f"{stage}-{i}", daemon=True)
+                thread.start()
+                threads.append(thread)
+
+        self.budget = Budget(self.limits, name="experiment")
+        self._pending = sum(config.runs for config in configs)
+        self._all_done.clear()
+        if self._pending:
+            for config in configs:
+                self._submit_runs(config)
+            self._all_done.wait()
+
+        for stage in self.STAGES:
+            for _ in range(self.workers[stage]):
+                self.queues[stage].put(None)
+        for thread in threads:
+            thread.join()
+
+        results = {config.name: [] for config in configs}
+        for job in sorted(self._finished, key=lambda job: job.run):
+            results[job.config.name].append(run_result(job.run, job.state, job.result, job.duration))
+        self._finished = []
+        return results
+
+    def _submit_runs(self, config: RunConfig) -> None:
+        tiers = self.tiers or config.tiers or [default_tier(config.assistant_id)]
+        # Latencies depend on the prompt, so each configuration learns its own hedging threshold
+        hedge_policy = HedgePolicy(self.hedge_percentile) if self.hedge_percentile is not None else None
+        for i in range(config.runs):
+            self._slots.acquire()
+            start_time = time.time()
+            state = new_run_state(config.verifier, tiers, hedge_policy, job_id=uuid.uuid4().hex[:12],
+                                  budget=Budget(self.run_limits, self.budget), prompt_builder=self.prompt_builder,
+                                  target=config.target, repair=self.repair,
+                                  falsifier=self.falsifier, explainer=self.explainer, solver=self.solver,
+                                  portfolio=self.portfolio, verification_limits=self.verification_limits,
+                                  precomputed_templates=self.precomputed_templates, minimizer=self.minimizer)
+            message = prompt_message(state, config.prompt, config.examples)
+            self._advance(Job(config, i + 1, state, message, start_time), "generate")
+
+    def _advance(self, job: Job, stage: Optional[str]) -> None:
+        if stage is None:
+            self._finish(job)
+        else:
+            self.queues[stage].put(job)
+
+    def _finish(self, job: Job) -> None:
+        job.duration = time.time() - job.start_time
+        job.state.finish()
+        with self._lock:
+            self._finished.append(job)
+            self._pending -= 1
+            if self._pending == 0:
+                self._all_done.set()
+        self._slots.release()
+
+    def _work(self, stage: str) -> None:
+        handler = self.handlers[stage]
+        while True:
+            job = self.queues[stage].get()
+            if job is None:
+                break
+            try:
+                next_stage = handler(job)
+            except DeadlineExceeded as e:
+                print(f"Deadline exceeded, stopping the run: {e.reason}")
+                job.state.stop_reason = e.reason
+                job.result = False
+                next_stage = None
+            except RunFailed as e:
+                print(f"Model run failed, stopping the run: {e}")
+                job.state.stop_reason = f"model run {e.status}"
+                job.result = False
+                next_stage = None
+            except Exception as e:
+                logging.error(f"{job.config.name} run {job.run}: {stage} failed: {e}")
+                job.state.stop_reason = f"{stage} error"
+                job.result = False
+                next_stage = None
+            self._advance(job, next_stage)
+
+    def _generate(self, job: Job) -> Optional[str]:
+        if not next_interaction(job.state):
+            return None
+        job.response = generate(job.state, job.message)
+        return "extract"
+
+    def _extract(self, job: Job) -> Optional[str]:
+        job.solidity_code = extract(job.state, job.response)
+        if job.solidity_code:
+            return "verify"
+        print("ERROR - No Solidity code found in the response.")
+        if job.state.router.escalate():
+            return "generate"
+        job.state.stop_reason = "no solidity code"
+        return None
+
+    def _verify(self, job: Job) -> Optional[str]:
+        job.verification_result = falsify(job.state, job.solidity_code) or verify(job.state, job.solidity_code)
+        return "feedback"
+
+    def _feedback(self, job: Job) -> Optional[str]:
+        next_message = feedback(job.state, job.verification_result)
+        if next_message:
+            job.message = next_message
+            return "generate"
+        print("Verified!")
+        job.state.stop_reason = "verified"
+        job.result = job.solidity_code
+        return None
+
+
+def run_verification_pipeline(configs: List[RunConfig], **pipeline_options) -> Dict[str, List[dict]]:
+    """
+    Convenience wrapper around Pipeline(**pipeline_options).run(configs)
+    """
+    return Pipeline(**pipeline_options).run(configs)
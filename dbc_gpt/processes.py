@@ -0,0 +1,67 @@
+import os
+import shutil
+import signal
+import subprocess
+import sys
+from typing import List, Optional
+
+
+PRLIMIT_CMD = "prlimit"
+# Without prlimit: sets the limit (argv[1], bytes) in the child, then replaces it by the command
+SETRLIMIT_EXEC = ("import os, resource, sys; "
+                  "resource.setrlimit(resource.RLIMIT_DATA, (int(sys.argv[1]), int(sys.argv[1]))); "
+                  "os.execvp(sys.argv[2], sys.argv[2:])")
+
+
+def popen(command: List[str], memory_mb: Optional[int] = None, **kwargs) -> subprocess.Popen:
+    """
+    Starts the command in its own process group, so that it can be killed
+    together with the processes it runs (e.g. solc-verify, Boogie and the
+    solver), see kill_process_group.
+
+    With memory_mb, the data segment of the command is limited, and so is
+    the one of the processes it runs, which inherit the limit. The address
+    space is not limited: .NET, which Boogie runs on, reserves far more of
+    it than it uses. The limit is not set by a preexec_fn, which is unsafe
+    in the threads the verifications run in: the command is run by prlimit
+    (util-linux), or, when prlimit is missing, by a Python process that
+    sets the limit on itself before executing the command. Either way the
+    limit is in place before the command starts.
+    """
+    if memory_mb is not None:
+        memory = memory_mb * 1024 * 1024
+        prlimit = shutil.which(PRLIMIT_CMD)
+        if prlimit:
+            command = [prlimit, f"--data={memory}", "--", *command]
+        else:
+            command = [sys.executable, "-c", SETRLIMIT_EXEC, str(memory), *command]
+    return subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True,
+                            start_new_session=True, **kwargs)
+
+
+def kill_process_group(process: subprocess.Popen) -> None:
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    process.wait()
+
+
+def run(command: List[str], timeout: Optional[float] = None,
+        memory_mb: Optional[int] = None) -> subprocess.CompletedProcess:
+    """
+    Like subprocess.run, but raises subprocess.TimeoutExpired (with the
+    output so far) only after killing the whole process group, and the data
+    segment of every process of the group is limited to memory_mb megabytes
+    """
+    process = popen(command, memory_mb)
+    try:
+        stdout, stderr = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        kill_process_group(process)
+        stdout, stderr = process.communicate()
+        raise subprocess.TimeoutExpired(command, timeout, stdout, stderr)
+    except BaseException:
+        kill_process_group(process)
+        raise
+    return subprocess.CompletedProcess(command, process.returncode, stdout, stderr)
@@ -0,0 +1,202 @@
+import os
+import re
+import string
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from dbc_gpt.examples import ExampleSelector
+from dbc_gpt.retrieval import ASSETS_DIR, FILE_SEARCH_DIR, Section, estimate_tokens, load_index
+
+PROMPTS_DIR = os.path.join(ASSETS_DIR, "prompts")
+
+# ERC standards prompts can target or use as examples, examples are always included in this order
+STANDARDS = ("erc20", "erc721", "erc1155")
+
+# e.g. example_erc20.v1.md
+SEGMENT_FILE_PATTERN = re.compile(r'^(\w+)\.v(\d+)\.md$')
+FUNCTION_PATTERN = re.compile(r'\bfunction\s+(\w+)\s*\(')
+SIGNATURE_PATTERN = re.compile(r'\bfunction\s+\w+\s*\([^;]*;')
+
+# EIP sections never worth their tokens, they are also left out of the full EIP
+EXCLUDED_SECTIONS = ("References", "Copyright")
+
+
+@dataclass(frozen=True)
+class Segment:
+    name: str
+    version: int
+    text: str
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}@v{self.version}"
+
+
+@dataclass
+class Prompt:
+    text: str
+    # Keys of the segments the prompt is made of, in order, e.g. ["instructions@v1", ...]
+    segments: List[str] = field(default_factory=list)
+    # Ids of the EIP sections included, when they are retrieved instead of the full EIP
+    eip_sections: List[str] = field(default_factory=list)
+
+
+@lru_cache(maxsize=None)
+def load_segments(prompts_dir: str = PROMPTS_DIR) -> Dict[str, Dict[int, Segment]]:
+    """
+    Reads every segment file once, returns [$name][$version] -> segment
+    """
+    segments: Dict[str, Dict[int, Segment]] = {}
+    for file_name in sorted(os.listdir(prompts_dir)):
+        match = SEGMENT_FILE_PATTERN.match(file_name)
+        if not match:
+            continue
+        name, version = match.group(1), int(match.group(2))
+        with open(os.path.join(prompts_dir, file_name)) as file:
+            segments.setdefault(name, {})[version] = Segment(name, version, file.read().strip("\n"))
+    return segments
+
+
+def eip_file(standard: str) -> str:
+    # e.g. erc721 -> erc-721.md
+    return f"erc-{standard[len('erc'):]}.md"
+
+
+@lru_cache(maxsize=None)
+def eip_markdown(standard: str) -> str:
+    # The prompts embed the EIP up to its references, e.g. assets/file_search/erc-721.md
+    with open(os.path.join(FILE_SEARCH_DIR, eip_file(standard))) as file:
+        markdown = file.read()
+    return markdown.split("\n## References")[0].strip("\n")
+
+
+class PromptBuilder:
+    """
+    Composes the initial prompt of a run from the segments in assets/prompts.
+
+    Segments are ordered from the most to the least shared one: instructions,
+    examples (in the order of STANDARDS), the contract to annotate and its
+    EIP. Prompts of different runs and configurations thus share the longest
+    possible prefix, which the provider serves from its prompt cache.
+
+    With eip_top_k or eip_token_budget, only the EIP sections most relevant
+    to the functions being annotated are included (see retrieval.BM25Index).
+    With example_token_budget, the whole example interfaces are replaced by
+    the function-level examples most similar to the functions being
+    annotated (see examples.ExampleSelector).
+    """
+
+    def __init__(self, versions: Optional[Dict[str, int]] = None, prompts_dir: str = PROMPTS_DIR,
+                 eip_top_k: Optional[int] = None, eip_token_budget: Optional[int] = None,
+                 example_token_budget: Optional[int] = None) -> None:
+        """
+        Parameters
+            versions: pinned version of some segments, e.g. {"example_erc721": 1},
+            the latest version of the other segments is used
+            eip_top_k: number of EIP sections included, None for no limit
+            eip_token_budget: estimated tokens of the EIP sections included
+            example_token_budget: estimated tokens of the function-level examples
+        """
+        self.versions = versions or {}
+        self.segments = load_segments(prompts_dir)
+        self.eip_top_k = eip_top_k
+        self.eip_token_budget = eip_token_budget
+        self.example_token_budget = example_token_budget
+
+    @property
+    def retrieves_eip(self) -> bool:
+        return self.eip_top_k is not None or self.eip_token_budget is not None
+
+    def segment(self, name: str) -> Segment:
+        versions = self.segments[name]
+        return versions[self.versions.get(name, max(versions))]
+
+    def functions(self, target: str) -> List[str]:
+        """
+        Returns the functions of the contract to annotate
+        """
+        return FUNCTION_PATTERN.findall(self.segment(f"target_{target}").text)
+
+    def signatures(self, target: str) -> List[str]:
+        # Signatures of the contract to annotate, on a single line
+        text = self.segment(f"target_{target}").text
+        return [" ".join(signature.split()) for signature in SIGNATURE_PATTERN.findall(text)]
+
+    def select_eip_sections(self, target: str, functions: Iterable[str],
+                            exclude: Iterable[str] = ()) -> List[Section]:
+        """
+        Returns the EIP sections that best match the functions, within
+        eip_top_k and eip_token_budget, in the order of the EIP
+        """
+        exclude = set(exclude)
+        selected, tokens = [], 0
+        for _score, section in load_index().search(" ".join(functions), source=eip_file(target)):
+            if self.eip_top_k is not None and len(selected) >= self.eip_top_k:
+                break
+            if section.id in exclude or section.title.startswith(EXCLUDED_SECTIONS):
+                continue
+            section_tokens = estimate_tokens(section.text)
+            if self.eip_token_budget is not None and tokens + section_tokens > self.eip_token_budget:
+                continue
+            selected.append(section)
+            tokens += section_tokens
+        return sorted(selected, key=lambda section: section.index)
+
+    def eip_context(self, target: str, functions: Iterable[str],
+                    exclude: Iterable[str] = ()) -> Tuple[str, List[Section]]:
+        """
+        Returns the EIP segment with the sections relevant to the functions
+        (e.g. those still failing verification) and the sections, or an empty
+        text if there are none besides the excluded ones
+        """
+        sections = self.select_eip_sections(target, functions, exclude)
+        if not sections:
+            return "", []
+        markdown = "\n\n".join(section.text for section in sections)
+        text = string.Template(self.segment("eip").text).substitute(standard=target.upper(), markdown=markdown)
+        return text, sections
+
+    def build(self, target: str, examples: Sequence[str] = (), functions: Optional[Sequence[str]] = None) -> Prompt:
+        """
+        Parameters
+            target: standard of the contract to annotate, e.g. "erc20"
+            examples: standards whose annotated interfaces (or function-level
+            examples, see example_token_budget) are given as examples
+            functions: functions the EIP sections are retrieved for, all the
+            functions of the contract by default
+        """
+        examples = sorted(set(examples), key=STANDARDS.index)
+        used = [self.segment("instructions" if examples else "instructions_zero_shot")]
+        parts = [used[0].text]
+        if examples and self.example_token_budget is not None:
+            selector = ExampleSelector(self.example_token_budget)
+            selected = selector.select(self.signatures(target), examples)
+            segment = self.segment("function_examples")
+            used.append(segment)
+            parts.append(string.Template(segment.text).substitute(examples=selector.render(selected)))
+        else:
+            for example in examples:
+                segment = self.segment(f"example_{example}")
+                used.append(segment)
+                parts.append("ERC interface example:\n" + segment.text)
+
+        if examples:
+            request = self.segment("request")
+            label = "EXAMPLES" if len(examples) > 1 or self.example_token_budget is not None \
+                else f"{examples[0].upper()} EXAMPLE"
+            parts.append(string.Template(request.text).substitute(examples=label))
+        else:
+            request = self.segment("request_zero_shot")
+            parts.append(request.text)
+        target_segment = self.segment(f"target_{target}")
+        parts.append(target_segment.text)
+        eip = self.segment("eip")
+        used += [request, target_segment, eip]
+        if self.retrieves_eip:
+            text, sections = self.eip_context(target, functions or self.functions(target))
+            parts.append(text)
+            return Prompt("\n\n".join(parts), [segment.key for segment in used],
+                          [section.id for section in sections])
+        parts.append(string.Template(eip.text).substitute(standard=target.upper(), markdown=eip_markdown(target)))
+        return Prompt("\n\n".join(parts), [segment.key for segment in used])
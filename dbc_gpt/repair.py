@@ -0,0 +1,260 @@
+import argparse
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, List, Optional, Set, Tuple
+
+MAX_POSTCONDITIONS = 4
+
+FUNCTION_PATTERN = re.compile(r'\bfunction\s+\w+\s*\(')
+# Where a signature missing its semicolon ends: the next annotation or declaration, or the end of the contract
+NEXT_DECLARATION_PATTERN = re.compile(r'\n[ \t]*(//|/\*|function\b|event\b|modifier\b|constructor\b|mapping\b|\})')
+# e.g. "mapping (address => mapping(address => bool)) private _operatorApprovals;" or "bool public paused;"
+STATE_VARIABLE_PATTERN = re.compile(
+    r'^\s*(mapping\s*\(.*\)|\w+)\s+(?:(?:public|private|internal|constant|immutable)\s+)*(\w+)\s*(?:=[^;]*)?;',
+    re.MULTILINE)
+BOOL_MAPPING_PATTERN = re.compile(r'=>\s*bool\s*\)+$')
+BOOL_PARAMETER_PATTERN = re.compile(r'\bbool\s+(?:memory\s+|calldata\s+)?(\w+)')
+OLD_UINT_PATTERN = re.compile(r'__verifier_old_uint\s*\(')
+
+
+@dataclass
+class Repair:
+    code: str
+    # [$rule] -> number of fixes, e.g. {"function_body": 2}
+    fixes: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def rules(self) -> List[str]:
+        return sorted(self.fixes)
+
+
+def closing_bracket(code: str, open_index: int) -> Optional[int]:
+    """
+    Returns the index of the bracket closing the one at open_index, None if it is not closed
+    """
+    opening = code[open_index]
+    closing = {"(": ")", "{": "}", "[": "]"}[opening]
+    depth = 0
+    for index in range(open_index, len(code)):
+        if code[index] == opening:
+            depth += 1
+        elif code[index] == closing:
+            depth -= 1
+            if depth == 0:
+                return index
+    return None
+
+
+def _in_comment(code: str, index: int) -> bool:
+    line_start = code.rfind("\n", 0, index) + 1
+    return "//" in code[line_start:index]
+
+
+def fix_signatures(code: str) -> Tuple[str, int, int]:
+    """
+    Replaces function bodies by a semicolon and adds the semicolon missing
+    after a signature. Returns the code, the number of bodies removed and of
+    semicolons added.
+    """
+    bodies = semicolons = 0
+    position = 0
+    while True:
+        match = FUNCTION_PATTERN.search(code, position)
+        if not match:
+            break
+        position = match.end()
+        if _in_comment(code, match.start()):
+            continue
+        parameters_end = closing_bracket(code, match.end() - 1)
+        if parameters_end is None:
+            break
+        ends = [index for index in (code.find(";", parameters_end), code.find("{", parameters_end)) if index >= 0]
+        declaration = NEXT_DECLARATION_PATTERN.search(code, parameters_end)
+        if declaration:
+            ends.append(declaration.start())
+        if not ends:
+            break
+        end = min(ends)
+        if code[end] == ";":
+            position = end + 1
+        elif code[end] == "{":
+            body_end = closing_bracket(code, end)
+            if body_end is None:
+                break
+            code = code[:end].rstrip() + ";" + code[body_end + 1:]
+            bodies += 1
+        else:
+            header_end = len(code[:end].rstrip())
+            code = code[:header_end] + ";" + code[header_end:]
+            semicolons += 1
+    return code, bodies, semicolons
+
+
+def annotated_functions(lines: List[str]) -> List[Tuple[List[int], int]]:
+    """
+    Returns the (indexes of the annotation lines, index of the signature line)
+    of every function preceded by /// annotations
+    """
+    functions, annotations = [], []
+    for index, line in enumerate(lines):
+        stripped = line.strip()
+        if stripped.startswith("///"):
+            annotations.append(index)
+        elif FUNCTION_PATTERN.match(stripped):
+            if annotations:
+                functions.append((annotations, index))
+            annotations = []
+        elif stripped:
+            annotations = []
+    return functions
+
+
+def annotation_tags(lines: List[str], annotation_lines: List[int]) -> List[List[int]]:
+    """
+    Groups the annotation lines of a function (see annotated_functions) by
+    NatSpec tag: a line starting with a tag (e.g. "/// @notice postcondition
+    a == b &&") and its continuation lines (e.g. "///   c == d")
+    """
+    tags: List[List[int]] = []
+    for index in annotation_lines:
+        if lines[index].strip()[len("///"):].lstrip().startswith("@") or not tags:
+            tags.append([index])
+        else:
+            tags[-1].append(index)
+    return tags
+
+
+def tag_text(lines: List[str], tag: List[int]) -> str:
+    # The text of a tag on one line, without the /// of its lines, e.g. "@notice postcondition a == b && c == d"
+    return " ".join(lines[index].strip()[len("///"):].strip() for index in tag)
+
+
+def function_signature(signature_text: str) -> Optional[Tuple[str, int]]:
+    """
+    Returns the (name, number of parameters) of the function whose signature
+    starts the text, like the keys of the annotations merged by
+    solc_verify_generator.main, None if its parameters are not closed
+    """
+    match = FUNCTION_PATTERN.search(signature_text)
+    if match is None:
+        return None
+    parameters_end = closing_bracket(signature_text, match.end() - 1)
+    if parameters_end is None:
+        return None
+    parameters = signature_text[match.end():parameters_end]
+    depth, count = 0, 1 if parameters.strip() else 0
+    for character in parameters:
+        if character in "([":
+            depth += 1
+        elif character in ")]":
+            depth -= 1
+        elif character == "," and depth == 0:
+            count += 1
+    return match.group(0).split()[1].split("(")[0], count
+
+
+def limit_postconditions(code: str, limit: int = MAX_POSTCONDITIONS) -> Tuple[str, int]:
+    """
+    Drops duplicated postconditions, then the postconditions after the first
+    `limit` ones of each function, with their continuation lines. Returns
+    the code and the number of functions changed.
+    """
+    lines = code.split("\n")
+    dropped: Set[int] = set()
+    functions = 0
+    for annotations, _signature in annotated_functions(lines):
+        kept = []
+        for tag in annotation_tags(lines, annotations):
+            text = tag_text(lines, tag)
+            if "postcondition" not in text:
+                continue
+            normalized = " ".join(text.split())
+            if normalized in kept or len(kept) >= limit:
+                dropped.update(tag)
+            else:
+                kept.append(normalized)
+        functions += any(index in dropped for index in annotations)
+    return "\n".join(line for index, line in enumerate(lines) if index not in dropped), functions
+
+
+def bool_state_variables(code: str) -> Set[str]:
+    names = set()
+    for match in STATE_VARIABLE_PATTERN.finditer(code):
+        type_name, name = match.group(1), match.group(2)
+        if type_name in ("return", "emit", "delete"):
+            continue
+        if type_name == "bool" or BOOL_MAPPING_PATTERN.search(type_name):
+            names.add(name)
+    return names
+
+
+@lru_cache(maxsize=None)
+def template_bool_state_variables(template_path: str) -> Set[str]:
+    # The implementation state variables the merged annotations refer to
+    with open(template_path) as file:
+        return bool_state_variables(file.read())
+
+
+def fix_old_bool(code: str, bool_variables: Set[str] = frozenset()) -> Tuple[str, int]:
+    """
+    Replaces __verifier_old_uint by __verifier_old_bool when its argument is
+    a bool: a bool state variable (of the code or bool_variables), an entry
+    of a mapping to bool or a bool parameter of the annotated function.
+    Returns the code and the number of replacements.
+    """
+    bool_variables = set(bool_variables) | bool_state_variables(code)
+    lines = code.split("\n")
+    replacements = 0
+    for annotations, signature in annotated_functions(lines):
+        signature_text = "\n".join(lines[signature:]).split(";")[0]
+        names = bool_variables | set(BOOL_PARAMETER_PATTERN.findall(signature_text))
+        for tag in annotation_tags(lines, annotations):
+            # The lines of a tag are searched together, an argument may continue on the next line
+            text = "\n".join(lines[index] for index in tag)
+            for match in reversed(list(OLD_UINT_PATTERN.finditer(text))):
+                argument_end = closing_bracket(text, match.end() - 1)
+                if argument_end is None:
+                    continue
+                base = re.match(r'\s*(?:///\s*)?(\w+)', text[match.end():argument_end])
+                if base and base.group(1) in names:
+                    name_end = match.start() + len("__verifier_old_uint")
+                    text = text[:match.start()] + "__verifier_old_bool" + text[name_end:]
+                    replacements += 1
+            for index, line in zip(tag, text.split("\n")):
+                lines[index] = line
+    return "\n".join(lines), replacements
+
+
+def repair_spec(code: str, template_path: Optional[str] = None) -> Repair:
+    """
+    Applies the local repairs to a specification returned by the model
+
+    Parameters
+        code: the Solidity code extracted from the response
+        template_path: merge template of the verifier, its state variables
+        are taken into account to find the bool ones
+    """
+    fixes = {}
+    code, bodies, semicolons = fix_signatures(code)
+    code, functions = limit_postconditions(code)
+    bool_variables = template_bool_state_variables(template_path) if template_path else set()
+    code, old_bools = fix_old_bool(code, bool_variables)
+    for rule, count in (("function_body", bodies), ("missing_semicolon", semicolons),
+                        ("postcondition_limit", functions), ("old_bool", old_bools)):
+        if count:
+            fixes[rule] = count
+    return Repair(code, fixes)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Applies the local repairs to a specification")
+    parser.add_argument("spec_file_path", type=str)
+    parser.add_argument("--template", help="Merge template whose state variables the spec refers to",
+                        default=None, type=str)
+    args = parser.parse_args()
+
+    with open(args.spec_file_path) as spec_file:
+        repair = repair_spec(spec_file.read(), args.template)
+    print(repair.code)
+    print(f"// fixes: {repair.fixes}")
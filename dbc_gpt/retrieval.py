@@ -0,0 +1,149 @@
+import glob
+import math
+import os
+import re
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "assets")
+FILE_SEARCH_DIR = os.path.join(ASSETS_DIR, "file_search")
+
+HEADING_PATTERN = re.compile(r'^(#{1,6})\s+(.*)$')
+# Identifiers are split on camel case too, so "transferFrom" also matches "transfer" and "from"
+WORD_PATTERN = re.compile(r'[A-Za-z][a-z]+|[A-Z]+(?![a-z])|\d+')
+
+# Sections longer than this are split on blank lines, e.g. the interface in the specification of ERC-721
+MAX_SECTION_CHARS = 2000
+
+
+@dataclass
+class Section:
+    source: str
+    # Headings leading to the section, e.g. "Specification > Token > Methods"
+    title: str
+    text: str
+    # Position of the section in its source file
+    index: int
+
+    @property
+    def id(self) -> str:
+        return f"{self.source}#{self.index}"
+
+
+def estimate_tokens(text: str) -> int:
+    # About 4 characters per token for English and Solidity
+    return len(text) // 4 + 1
+
+
+def tokenize(text: str) -> List[str]:
+    return [word.lower() for word in WORD_PATTERN.findall(text)]
+
+
+def _split_long(lines: List[str], max_chars: int) -> List[List[str]]:
+    """
+    Splits the lines of a section on blank lines into parts of at most
+    max_chars (when possible). Code fences cut by a split are closed and
+    reopened, so every part stays valid markdown.
+    """
+    parts, current, size = [], [], 0
+    fence = None
+    for line in lines:
+        if not line.strip() and size > max_chars:
+            if fence:
+                current.append("```")
+            parts.append(current)
+            current, size = ([fence] if fence else []), 0
+            continue
+        if line.strip().startswith("```"):
+            fence = None if fence else line.strip()
+        current.append(line)
+        size += len(line) + 1
+    if any(line.strip() for line in current):
+        parts.append(current)
+    return parts
+
+
+def split_sections(markdown: str, source: str, max_chars: int = MAX_SECTION_CHARS) -> List[Section]:
+    """
+    Chunks a markdown document by heading, long sections are split further
+    """
+    sections: List[Section] = []
+    # (level, heading) of the enclosing headings
+    headings: List[Tuple[int, str]] = []
+    lines: List[str] = []
+    in_fence = False
+
+    def flush():
+        if not any(line.strip() for line in lines):
+            return
+        title = " > ".join(heading for _level, heading in headings) or source
+        for part in _split_long(lines, max_chars):
+            sections.append(Section(source, title, "\n".join(part).strip("\n"), len(sections)))
+
+    for line in markdown.split("\n"):
+        if line.strip().startswith("```"):
+            in_fence = not in_fence
+        match = None if in_fence else HEADING_PATTERN.match(line)
+        if match:
+            flush()
+            lines = []
+            level = len(match.group(1))
+            headings = [(other, heading) for other, heading in headings if other < level]
+            headings.append((level, match.group(2).strip()))
+        lines.append(line)
+    flush()
+    return sections
+
+
+class BM25Index:
+    """
+    Okapi BM25 over an inverted index of sections, kept in memory
+    """
+
+    def __init__(self, sections: Iterable[Section], k1: float = 1.5, b: float = 0.75) -> None:
+        self.k1 = k1
+        self.b = b
+        self.sections: List[Section] = list(sections)
+        # [$term] -> [(position of the section, term frequency)]
+        self.postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        self.lengths: List[int] = []
+        for position, section in enumerate(self.sections):
+            terms = tokenize(section.title + "\n" + section.text)
+            self.lengths.append(len(terms))
+            for term, frequency in Counter(terms).items():
+                self.postings[term].append((position, frequency))
+        self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+
+    def idf(self, term: str) -> float:
+        documents = len(self.postings.get(term, ()))
+        return math.log(1 + (len(self.sections) - documents + 0.5) / (documents + 0.5))
+
+    def search(self, query: str, k: Optional[int] = None, source: Optional[str] = None) -> List[Tuple[float, Section]]:
+        """
+        Returns the k best (score, section) pairs for the query, optionally
+        restricted to the sections of one source file
+        """
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf(term)
+            for position, frequency in self.postings.get(term, ()):
+                if source and self.sections[position].source != source:
+                    continue
+                length_norm = 1 - self.b + self.b * self.lengths[position] / self.average_length
+                scores[position] += idf * frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [(score, self.sections[position]) for position, score in ranked[:k]]
+
+
+@lru_cache(maxsize=None)
+def load_index(file_search_dir: str = FILE_SEARCH_DIR) -> BM25Index:
+    """
+    Builds the index of assets/file_search/*.md once per process
+    """
+    sections = []
+    for path in sorted(glob.glob(os.path.join(file_search_dir, "*.md"))):
+        with open(path) as file:
+            sections += split_sections(file.read(), os.path.basename(path))
+    return BM25Index(sections)
@@ -0,0 +1,246 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import string
+import tempfile
+from dataclasses import asdict, dataclass
+from functools import lru_cache
+from typing import List, Optional
+
+from dbc_gpt import metrics
+from dbc_gpt.repair import FUNCTION_PATTERN, STATE_VARIABLE_PATTERN, annotated_functions, function_signature
+from solc_verify_generator.main import add_prefix, add_triple_bars, call_solc, remove_old_ref
+
+TEMPLATE_CACHE_DIR = "./temp/template_cache"
+IMPORT_PATTERN = re.compile(r'^\s*import\s+"([^"]+)"\s*;', re.MULTILINE)
+PLACEHOLDER_PATTERN = re.compile(r'\$(\w+)')
+# Comments and string literals, blanked out before the syntax check
+COMMENT_OR_STRING_PATTERN = re.compile(r'//[^\n]*|/\*.*?\*/|"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'', re.DOTALL)
+# Units of a source file, e.g. "contract ERC20 is IERC20" (before its body) or "pragma solidity >=0.5.0"
+SOURCE_UNIT_PATTERN = re.compile(r'^(?:(?:abstract\s+)?(?:contract|interface|library)\s+\w+(?:\s+is\s+[^{};]+)?|'
+                                 r'pragma\s+[^;]+|import\s+[^;]+)$')
+# Members of a contract, those with a body then those ending with a semicolon
+BLOCK_MEMBER_PATTERN = re.compile(r'^(?:function\s*\w*\s*\(|constructor\s*\(|modifier\s+\w+|fallback\s*\(|'
+                                  r'receive\s*\(|struct\s+\w+$|enum\s+\w+$)')
+MEMBER_PATTERN = re.compile(r'^(?:function\s*\w*\s*\(|constructor\s*\(|modifier\s+\w+|fallback\s*\(|receive\s*\(|'
+                            r'event\s+\w+\s*\(|using\s+[\w.]+\s+for\s+|'
+                            r'(?:mapping\s*\(.*\)|address\s+payable|[\w.]+)(?:\s*\[\s*\w*\s*\])*'
+                            r'(?:\s+(?:public|private|internal|constant|immutable))*\s+\w+\s*(?:=.*)?$)', re.DOTALL)
+# solc-verify annotations, e.g. "/// @notice postcondition x == 1" (contract invariants are not merged)
+ANNOTATION_TAG_PATTERN = re.compile(r'^\s*///\s*@notice\s+(?:precondition|postcondition|modifies|emits)\b')
+
+
+def template_digest(template_path: str, imp_dir: str) -> str:
+    """
+    Hash of the template and of the implementation files it imports,
+    transitively (relative to imp_dir, where the merges are written)
+    """
+    digest = hashlib.sha256()
+    with open(template_path, "rb") as template_file:
+        template = template_file.read()
+    digest.update(template)
+    pending = [os.path.normpath(os.path.join(imp_dir, path)) for path in IMPORT_PATTERN.findall(template.decode())]
+    seen = set()
+    while pending:
+        path = pending.pop()
+        if path in seen or not os.path.isfile(path):
+            continue
+        seen.add(path)
+        with open(path, "rb") as source_file:
+            source = source_file.read()
+        digest.update(path.encode() + b"\0" + source)
+        pending += [os.path.normpath(os.path.join(os.path.dirname(path), imported))
+                    for imported in IMPORT_PATTERN.findall(source.decode())]
+    return digest.hexdigest()
+
+
+@dataclass
+class TemplateArtifacts:
+    """
+    What the verifications of a merge template share: the template, whose
+    implementation (the template without annotations) is checked to
+    compile once and kept in TEMPLATE_CACHE_DIR, so that a job only merges
+    the annotations of its spec, without compiling the spec to read them
+    from its AST.
+    """
+    digest: str
+    template: str
+
+    @classmethod
+    def compute(cls, template_path: str, merge_path: str) -> "TemplateArtifacts":
+        """
+        Compiles the implementation of the template next to merge_path (it
+        imports files relatively). Raises RuntimeError (returncode, output)
+        if it does not compile, as generate_merge does.
+        """
+        with open(template_path) as template_file:
+            template = template_file.read()
+        imp_dir = os.path.dirname(merge_path)
+        digest = template_digest(template_path, imp_dir)
+        placeholders = sorted(set(PLACEHOLDER_PATTERN.findall(template)))
+        implementation_path = os.path.join(imp_dir, f"template_{digest[:16]}_{os.getpid()}.sol")
+        with open(implementation_path, "w") as implementation_file:
+            implementation_file.write(string.Template(template).substitute({name: "" for name in placeholders}))
+        ast_dir = tempfile.mkdtemp(prefix="template_")
+        try:
+            result = call_solc(implementation_path, ast_dir)
+        finally:
+            os.remove(implementation_path)
+            shutil.rmtree(ast_dir, ignore_errors=True)
+        if result.returncode:
+            raise RuntimeError(result.returncode, result.stdout + result.stderr)
+        return cls(digest, template)
+
+    @classmethod
+    def load(cls, template_path: str, merge_path: str, output_dir: str = TEMPLATE_CACHE_DIR) -> "TemplateArtifacts":
+        """
+        Returns the artifacts kept in output_dir if the template and the
+        implementation files are unchanged, computes and keeps them otherwise
+        """
+        path = os.path.join(output_dir, f"{template_digest(template_path, os.path.dirname(merge_path))}.json")
+        hit = os.path.isfile(path)
+        metrics.record_cache("template", hit)
+        if hit:
+            with open(path) as artifacts_file:
+                artifacts = json.load(artifacts_file)
+            return cls(artifacts["digest"], artifacts["template"])
+        artifacts = cls.compute(template_path, merge_path)
+        os.makedirs(output_dir, exist_ok=True)
+        temporary_path = f"{path}.{os.getpid()}"
+        with open(temporary_path, "w") as artifacts_file:
+            json.dump(asdict(artifacts), artifacts_file)
+        os.replace(temporary_path, path)
+        return artifacts
+
+    def merge(self, spec_code: str, prefix: Optional[str] = None) -> str:
+        """
+        Returns the merged contract of the spec, as generate_merge does:
+        the /// annotations of each spec function replace the placeholder
+        named after the function, or after its name and number of
+        parameters (e.g. $safeTransferFrom4). With a prefix, the state
+        variables of the spec are prefixed in them.
+
+        The spec is not compiled, but raises RuntimeError (returncode,
+        output) as generate_merge does if it fails the syntax check (see
+        syntax_error), if a solc-verify annotation is not attached to a
+        function signature, if the spec does not declare a function of the
+        template or if none of its annotations is merged.
+        """
+        error = syntax_error(spec_code)
+        if error:
+            raise RuntimeError(1, error)
+        lines = spec_code.split("\n")
+        # Functions of the spec without annotations fill their placeholder with nothing, as in generate_merge
+        annotations = {}
+        for index, line in enumerate(lines):
+            function = function_signature("\n".join(lines[index:])) if FUNCTION_PATTERN.match(line.strip()) else None
+            if function:
+                annotations[function[0]] = annotations[f"{function[0]}{function[1]}"] = ""
+        merged_lines = set()
+        for annotation_lines, signature in annotated_functions(lines):
+            function = function_signature("\n".join(lines[signature:]))
+            if function:
+                annotation = "\n".join(lines[index].strip()[len("///"):] for index in annotation_lines)
+                annotations[function[0]] = annotations[f"{function[0]}{function[1]}"] = annotation
+                merged_lines.update(annotation_lines)
+        unmatched = [index for index, line in enumerate(lines)
+                     if ANNOTATION_TAG_PATTERN.match(line) and index not in merged_lines]
+        if unmatched:
+            raise RuntimeError(1, f"Error: the annotation at line {unmatched[0] + 1} is not attached to a "
+                                  f"function signature: {lines[unmatched[0]].strip()}\n")
+        placeholders = list(dict.fromkeys(PLACEHOLDER_PATTERN.findall(self.template)))
+        missing = [placeholder for placeholder in placeholders if placeholder not in annotations]
+        if missing:
+            # generate_merge fails with a KeyError on them
+            raise RuntimeError(1, f"Error: the spec does not declare the functions of the template: "
+                                  f"{', '.join(missing)}\n")
+        state_variables = spec_state_variables(spec_code) if prefix else []
+        substitutions = {}
+        for placeholder in placeholders:
+            annotation = annotations[placeholder]
+            if prefix and annotation:
+                annotation = remove_old_ref(add_prefix(annotation, dict.fromkeys(state_variables), prefix), prefix)
+            substitutions[placeholder] = add_triple_bars(annotation)
+        if merged_lines and not any(substitutions.values()):
+            raise RuntimeError(1, "Error: no annotated function of the spec is a function of the template\n")
+        return string.Template(self.template).substitute(substitutions)
+
+
+def syntax_error(code: str) -> Optional[str]:
+    """
+    A cheap syntax check of a spec, instead of compiling it: the brackets
+    are balanced, and the units of the file and the members of its
+    contracts are well formed (bodies of the functions excluded). Returns
+    the error, in the solc format, None if there is none.
+    """
+    # Blanked out in place, so that positions keep their lines
+    text = COMMENT_OR_STRING_PATTERN.sub(lambda match: re.sub(r'[^\n]', " ", match.group(0)), code)
+
+    def error(position: int, message: str) -> str:
+        line = text.count("\n", 0, position) + 1
+        return f"spec.sol:{line}: ParserError: {message}\n{code.split(chr(10))[line - 1].strip()}\n"
+
+    closing = {"(": ")", "[": "]", "{": "}"}
+    stack = []
+    # [$index of an opening bracket] -> index of its closing bracket
+    matching = {}
+    for position, character in enumerate(text):
+        if character in closing:
+            stack.append(position)
+        elif character in closing.values():
+            if not stack or closing[text[stack[-1]]] != character:
+                return error(position, f"Unexpected '{character}'")
+            matching[stack.pop()] = position
+    if stack:
+        return error(stack[-1], f"Unclosed '{text[stack[-1]]}'")
+
+    def members(start: int, end: int, in_contract: bool) -> Optional[str]:
+        # Checks the declarations between start and end, the units of the file or the members of a contract
+        position = start
+        while text[position:end].strip():
+            position += len(text[position:end]) - len(text[position:end].lstrip())
+            depth, separator = 0, None
+            for index in range(position, end):
+                if text[index] in "([":
+                    depth += 1
+                elif text[index] in ")]":
+                    depth -= 1
+                elif depth == 0 and text[index] in ";{":
+                    separator = index
+                    break
+            header = " ".join(text[position:separator].split())
+            if separator is None:
+                return error(position, f"Expected ';' or '{{' after: {header[:80]}")
+            if in_contract:
+                valid = (MEMBER_PATTERN if text[separator] == ";" else BLOCK_MEMBER_PATTERN).match(header)
+            else:
+                # pragma and import end with a semicolon, contracts have a body
+                valid = SOURCE_UNIT_PATTERN.match(header) and \
+                    (header.split()[0] in ("pragma", "import")) == (text[separator] == ";")
+            if not valid:
+                return error(position, f"Invalid declaration: {header[:80]}")
+            if text[separator] == "{":
+                # The members of a contract are checked, not the bodies of its functions
+                nested = None if in_contract else members(separator + 1, matching[separator], True)
+                if nested:
+                    return nested
+                position = matching[separator] + 1
+            else:
+                position = separator + 1
+        return None
+
+    return members(0, len(text), False)
+
+
+def spec_state_variables(spec_code: str) -> List[str]:
+    # The names of the state variables declared by the spec, in order
+    return [match.group(2) for match in STATE_VARIABLE_PATTERN.finditer(spec_code)
+            if match.group(1) not in ("return", "emit", "delete")]
+
+
+@lru_cache(maxsize=None)
+def template_artifacts(template_path: str, merge_path: str) -> TemplateArtifacts:
+    # Once per process and template, the implementation files do not change during an experiment
+    return TemplateArtifacts.load(template_path, merge_path)
@@ -0,0 +1,104 @@
+import fcntl
+import json
+import os
+import re
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+TIMINGS_PATH = "./temp/solver_timings.json"
+# The copies of a contract in a batch, e.g. "ERC20_candidate3::transfer", see dbc_gpt.batching
+CANDIDATE_PATTERN = re.compile(r'_candidate\d+::')
+
+
+def function_key(function: str) -> str:
+    # e.g. "ERC20_candidate3::transfer" -> "ERC20::transfer"
+    return CANDIDATE_PATTERN.sub("::", function)
+
+
+class AdaptiveTimeouts:
+    """
+    Per-function solver time limits learned from the seconds of the
+    successful proofs of each function, e.g. "ERC1155::safeBatchTransferFrom"
+    (the contract tells the ERC standard apart): `percentile` of the proofs
+    observed so far times `margin`, within [minimum, maximum]. A function
+    with fewer than min_samples proofs gets the default limit.
+
+    The history is kept in a JSON file, so it carries over to the next
+    experiments. Concurrent worker processes share it: each one merges the
+    proofs it observed into the file, under a lock, see save.
+    """
+
+    def __init__(self, path: Optional[str] = TIMINGS_PATH, percentile: float = 99, margin: float = 1.5,
+                 minimum: float = 2, maximum: float = 120, default: float = 10, min_samples: int = 5,
+                 retry_factor: float = 4, window: int = 200) -> None:
+        """
+        Parameters
+            path: JSON file of the history, None to keep it in memory
+            retry_factor: the limit of the single retry of a procedure that
+            timed out is its first limit times retry_factor (at most maximum)
+        """
+        self.path = path
+        self.percentile = percentile
+        self.margin = margin
+        self.minimum = minimum
+        self.maximum = maximum
+        self.default = default
+        self.min_samples = min_samples
+        self.retry_factor = retry_factor
+        self.window = window
+        # [$function] -> seconds of its last successful proofs
+        self.seconds: Dict[str, Deque[float]] = {}
+        # [$function] -> seconds of the proofs observed since the last save
+        self._observed: Dict[str, List[float]] = {}
+        # Shared by the verifications of an experiment, which may run concurrently
+        self._lock = threading.Lock()
+        if path and os.path.isfile(path):
+            self.seconds = self._read()
+
+    def _read(self) -> Dict[str, Deque[float]]:
+        with open(self.path) as history_file:
+            return {function: deque(seconds, maxlen=self.window)
+                    for function, seconds in json.load(history_file).items()}
+
+    def observe(self, function: str, seconds: float) -> None:
+        function = function_key(function)
+        with self._lock:
+            self.seconds.setdefault(function, deque(maxlen=self.window)).append(seconds)
+            self._observed.setdefault(function, []).append(seconds)
+
+    def timeout(self, function: str) -> float:
+        with self._lock:
+            ordered = sorted(self.seconds.get(function_key(function), ()))
+        if len(ordered) < self.min_samples:
+            return self.default
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+        return min(max(ordered[index] * self.margin, self.minimum), self.maximum)
+
+    def retry_timeout(self, timeout: float) -> Optional[float]:
+        """
+        Returns the limit of the retry of a procedure that timed out after
+        timeout seconds, None if it cannot be raised any further
+        """
+        retry = min(timeout * self.retry_factor, self.maximum)
+        return retry if retry > timeout else None
+
+    def save(self) -> None:
+        """
+        Adds the proofs observed since the last save to the history on disk,
+        which other processes may have saved to meanwhile, and takes theirs
+        """
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._lock, open(f"{self.path}.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            history = self._read() if os.path.isfile(self.path) else {}
+            for function, seconds in self._observed.items():
+                history.setdefault(function, deque(maxlen=self.window)).extend(seconds)
+            temporary_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}"
+            with open(temporary_path, "w") as history_file:
+                json.dump({function: list(seconds) for function, seconds in history.items()}, history_file)
+            os.replace(temporary_path, self.path)
+            self.seconds = history
+            self._observed = {}
@@ -0,0 +1,168 @@
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+# Tracing is configured with configure() or the DBC_GPT_TRACE environment variable
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+
+    def __init__(self, name: str, parent: Optional['Span'] = None, **attributes) -> None:
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        # Spans of a run share the trace id of the run span
+        self.trace_id = parent.trace_id if parent else self.span_id
+        self.attributes: Dict[str, Any] = attributes
+        self.thread = threading.current_thread().name
+        self.start_time = time.time()
+        self.end_time: Optional[float] = None
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def end(self) -> None:
+        if self.end_time is None:
+            self.end_time = time.time()
+            if _exporter is not None:
+                _exporter.export(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "thread": self.thread,
+            "start": self.start_time,
+            "end": self.end_time,
+            "duration": self.end_time - self.start_time,
+            "attributes": self.attributes,
+        }
+
+
+class JsonlExporter:
+
+    def __init__(self, path: str) -> None:
+        self._file = open(path, "a")
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class ChromeTraceExporter:
+    """
+    Writes "complete" events of the Chrome trace format. The array is left
+    open while spans are being written, which the trace viewers accept.
+    """
+
+    def __init__(self, path: str) -> None:
+        self._file = open(path, "w")
+        self._file.write("[\n")
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        # [$traceId] -> row of the timeline
+        self._rows: Dict[str, int] = {}
+
+    def export(self, span: Span) -> None:
+        with self._lock:
+            row = self._rows.setdefault(span.trace_id, len(self._rows) + 1)
+            event = {
+                "name": span.name,
+                "ph": "X",
+                "ts": span.start_time * 1e6,
+                "dur": (span.end_time - span.start_time) * 1e6,
+                "pid": self._pid,
+                "tid": row,
+                "args": {**span.attributes, "span_id": span.span_id, "parent_id": span.parent_id,
+                         "thread": span.thread},
+            }
+            self._file.write(json.dumps(event, default=str) + ",\n")
+            self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+_exporter = None
+
+
+def configure(path: Optional[str]) -> None:
+    """
+    Exports spans to path, as one JSON object per line for "*.jsonl" files
+    and as Chrome trace events otherwise. None disables tracing.
+    """
+    global _exporter
+    if _exporter is not None:
+        _exporter.close()
+    if path is None:
+        _exporter = None
+    elif path.endswith(".jsonl"):
+        _exporter = JsonlExporter(path)
+    else:
+        _exporter = ChromeTraceExporter(path)
+
+
+def enabled() -> bool:
+    return _exporter is not None
+
+
+def start_span(name: str, parent: Optional[Span] = None, **attributes) -> Optional[Span]:
+    """
+    Starts a span that has to be ended explicitly, e.g. one covering a
+    whole run. Its parent is the current span unless given.
+    """
+    if _exporter is None:
+        return None
+    return Span(name, parent or _current_span.get(), **attributes)
+
+
+@contextmanager
+def span(name: str, parent: Optional[Span] = None, **attributes):
+    """
+    Traces the enclosed block. Spans started inside it, also in the
+    functions it calls, are its children.
+    """
+    if _exporter is None:
+        yield None
+        return
+    current = Span(name, parent or _current_span.get(), **attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.set(error=repr(e))
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end()
+
+
+def traced(name: str):
+    """
+    Decorator version of span()
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+configure(os.environ.get("DBC_GPT_TRACE"))
@@ -0,0 +1,80 @@
+from dataclasses import asdict, dataclass
+from typing import Dict, List
+
+
+@dataclass
+class TokenUsage:
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    # Prompt tokens served from the provider prompt cache, included in prompt_tokens
+    cached_tokens: int = 0
+    cost: float = 0.0
+
+    @classmethod
+    def from_run(cls, run) -> 'TokenUsage':
+        # Usage is only reported once the run is completed
+        usage = getattr(run, "usage", None)
+        if not usage:
+            return cls()
+        details = getattr(usage, "prompt_tokens_details", None)
+        return cls(usage.prompt_tokens or 0, usage.completion_tokens or 0,
+                   getattr(details, "cached_tokens", 0) or 0)
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    @property
+    def cached_ratio(self) -> float:
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+    def add(self, other: 'TokenUsage') -> None:
+        self.prompt_tokens += other.prompt_tokens
+        self.completion_tokens += other.completion_tokens
+        self.cached_tokens += other.cached_tokens
+        self.cost += other.cost
+
+    def to_dict(self) -> Dict[str, float]:
+        return asdict(self)
+
+
+def summarize_usage(name: str, results: List[dict]) -> dict:
+    """
+    Rolls the token usage of the runs of a configuration up into one row,
+    see run_result for the fields of a run
+    """
+    usage = TokenUsage()
+    for result in results:
+        usage.add(TokenUsage(result["prompt_tokens"], result["completion_tokens"], result["cached_tokens"],
+                             result["cost"]))
+    runs = len(results)
+    verified = sum(1 for result in results if result["verified"])
+    iterations = sum(result["iterations"] for result in results)
+    return {
+        "configuration": name,
+        "runs": runs,
+        "verified": verified,
+        "iterations": iterations,
+        **usage.to_dict(),
+        "total_tokens": usage.total_tokens,
+        "cached_ratio": usage.cached_ratio,
+        "tokens_per_run": usage.total_tokens / runs if runs else 0.0,
+        "tokens_per_verified": usage.total_tokens / verified if verified else None,
+        "cost_per_verified": usage.cost / verified if verified else None,
+        "time_llm_generation": sum(result["time_llm_generation"] for result in results),
+        # Model calls avoided by local repairs, see dbc_gpt.loop.repair
+        "llm_calls_saved": sum(result.get("llm_calls_saved", 0) for result in results),
+        # [$configuration] -> verifications it answered first, when racing a solver portfolio
+        "solver_wins": solver_wins(results),
+        # Verified specs that differ in their annotations, not only in formatting, see dbc_gpt.normalizer
+        "distinct_verified_specs": len({result["spec_digest"] for result in results
+                                        if result["verified"] and result.get("spec_digest")}),
+    }
+
+
+def solver_wins(results: List[dict]) -> Dict[str, int]:
+    wins: Dict[str, int] = {}
+    for result in results:
+        for solver, count in result.get("solver_wins", {}).items():
+            wins[solver] = wins.get(solver, 0) + count
+    return wins
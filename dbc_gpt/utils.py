@@ -0,0 +1,42 @@
+import re
+import pandas as pd
+from typing import List
+
+
+class Utils:
+
+    @staticmethod
+    def extract_solidity_code(markdown_text):
+        # Regex pattern to match code blocks with "solidity" as the language identifier
+        pattern = r'```solidity\n(.*?)```'
+        
+        # Use re.DOTALL to match newline characters in the code block
+        matches = re.findall(pattern, markdown_text, re.DOTALL)
+        
+        # Try to return first match
+        try:
+            return matches[0]
+        except IndexError:
+            return None
+        
+
+    @staticmethod
+    def save_string_to_file(file_name, content):
+        try:
+            with open(file_name, 'w') as file:
+                file.write(content)
+            print(f"Content successfully saved to {file_name}")
+        except IOError as e:
+            print(f"An error occurred while writing to the file: {e}")
+
+    @staticmethod
+    def save_results_to_csv(file_name: str, results: List[dict]):
+        # Convert list of dictionaries to pandas DataFrame
+        df = pd.DataFrame(results)
+        
+        try:
+            # Save DataFrame to CSV
+            df.to_csv(file_name, index=False)
+            print(f"Results successfully saved to {file_name}")
+        except IOError as e:
+            print(f"An error occurred while writing to the file: {e}")
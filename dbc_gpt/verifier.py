@@ -0,0 +1,407 @@
+import os
+import queue
+import re
+import subprocess
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field, replace
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from dbc_gpt import metrics
+from dbc_gpt.batching import Batch
+from dbc_gpt.boogie import BoogieSolver
+from dbc_gpt.processes import kill_process_group, popen, run
+from dbc_gpt.templates import template_artifacts
+from dbc_gpt.tracing import traced
+from dbc_gpt.utils import Utils
+
+# Matches the per-function verdict lines printed by solc-verify, e.g. "ERC20::transfer: OK"
+FUNCTION_RESULT_PATTERN = re.compile(r'^(\w+)::([\w\[\]]+): ([A-Z]+)\s*$', re.MULTILINE)
+
+
+@dataclass
+class VerificationResult:
+    status: int
+    output: str
+    # Seconds spent in each verification phase: solc_ast, merge and solc_verify (or translate and solve)
+    timings: Dict[str, float] = field(default_factory=dict)
+    # Short feedback built from solver counterexamples, see dbc_gpt.counterexamples
+    feedback: Optional[str] = None
+    # Solver configuration whose answer was taken, when racing a portfolio, see SolcVerifyWrapper.call_portfolio
+    solver: Optional[str] = None
+    # The verification was stopped after the wall-clock limit of VerificationLimits
+    timed_out: bool = False
+
+    @property
+    def verdict(self) -> str:
+        # "verified", "failed" or "timeout"
+        if self.timed_out:
+            return "timeout"
+        return "failed" if self.status else "verified"
+
+    @property
+    def definitive(self) -> bool:
+        # Every function verified or refuted, none timed out or left undecided by the solver
+        verdicts = self.function_results.values()
+        return bool(verdicts) and all(verdict in ("OK", "ERROR") for verdict in verdicts)
+
+    @property
+    def function_results(self) -> Dict[str, str]:
+        """
+        Returns the solc-verify verdict of each function, keyed by
+        function name (e.g. {"transfer": "OK", "transferFrom": "ERROR"}).
+        Implicit functions such as "[implicit_constructor]" are ignored.
+        """
+        results = {}
+        for _contract, function, verdict in FUNCTION_RESULT_PATTERN.findall(self.output):
+            if function.startswith('['):
+                continue
+            # A function inherited by several contracts is only OK if all of them are
+            if results.get(function, "OK") == "OK":
+                results[function] = verdict
+        return results
+
+
+@dataclass(frozen=True)
+class SolverConfiguration:
+    name: str
+    # Extra arguments of solc-verify, e.g. ("--solver", "cvc4")
+    arguments: Tuple[str, ...] = ()
+
+    @classmethod
+    def parse(cls, text: str) -> "SolverConfiguration":
+        """
+        Parses a configuration of the command line: the name of one of
+        SOLVER_CONFIGURATIONS or "name=arguments", e.g. "z3-30s=--solver z3 --timeout 30"
+        """
+        if "=" not in text:
+            return SOLVER_CONFIGURATIONS[text]
+        name, arguments = text.split("=", 1)
+        return cls(name, tuple(arguments.split()))
+
+
+# The solvers installed with solc-verify, see the Dockerfile
+SOLVER_CONFIGURATIONS = {configuration.name: configuration for configuration in (
+    SolverConfiguration("z3", ("--solver", "z3")),
+    SolverConfiguration("cvc4", ("--solver", "cvc4")),
+)}
+
+
+@dataclass(frozen=True)
+class VerificationLimits:
+    # Wall-clock seconds of a verification, its verdict is "timeout" once they are exceeded
+    seconds: Optional[float] = None
+    # Data segment of solc-verify and of each process it runs (Boogie, the solver), in megabytes
+    memory_mb: Optional[int] = None
+    # Seconds the solver may spend on each function, passed to solc-verify (--timeout)
+    solver_timeout: Optional[int] = None
+
+    @property
+    def arguments(self) -> Tuple[str, ...]:
+        return ("--timeout", str(self.solver_timeout)) if self.solver_timeout else ()
+
+
+class SolcVerifyWrapper:
+
+    SOLC_VERIFY_CMD = "solc-verify.py"
+    SPEC_FILE_PATH = './temp/spec.sol'
+    TEMPLATE_PATH = None
+    MERGE_PATH = None
+    PREFIX = None
+
+    @classmethod
+    @traced("SolcVerifyWrapper.call_solc")
+    def call_solc(cls, file_path, timeout: Optional[float] = None, output_dir: Optional[str] = None,
+                  limits: Optional[VerificationLimits] = None) -> VerificationResult:
+        """
+        Raises subprocess.TimeoutExpired (after killing solc-verify and the
+        processes it runs) if it runs for longer than timeout seconds. The
+        Boogie program is kept in output_dir when given.
+        """
+        limits = limits or VerificationLimits()
+        command = [cls.SOLC_VERIFY_CMD, file_path, *limits.arguments]
+        if output_dir:
+            command += ["--output", output_dir]
+        result = run(command, timeout, limits.memory_mb)
+        return VerificationResult(result.returncode, result.stdout + result.stderr)
+
+    @classmethod
+    @traced("SolcVerifyWrapper.call_portfolio")
+    def call_portfolio(cls, file_path, portfolio: Sequence[SolverConfiguration], timeout: Optional[float] = None,
+                       output_dir: Optional[str] = None,
+                       limits: Optional[VerificationLimits] = None) -> VerificationResult:
+        """
+        Runs solc-verify with every configuration of the portfolio at once
+        and returns the first definitive result, whose solver is the name of
+        the configuration, after killing the other runs. If no result is
+        definitive, returns the one of the first configuration. Raises
+        subprocess.TimeoutExpired (after killing them all) if they run for
+        longer than timeout seconds.
+        """
+        limits = limits or VerificationLimits()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        results = queue.Queue()
+        processes = []
+        for configuration in portfolio:
+            # The arguments of the configuration come last, so they override the solver timeout
+            command = [cls.SOLC_VERIFY_CMD, file_path, *limits.arguments, *configuration.arguments]
+            if output_dir:
+                os.makedirs(os.path.join(output_dir, configuration.name), exist_ok=True)
+                command += ["--output", os.path.join(output_dir, configuration.name)]
+            process = popen(command, limits.memory_mb)
+            processes.append(process)
+            threading.Thread(target=cls._wait, args=(configuration, process, results), daemon=True).start()
+        finished: Dict[str, VerificationResult] = {}
+        try:
+            while len(finished) < len(portfolio):
+                remaining = None if deadline is None else max(deadline - time.monotonic(), 0.0)
+                try:
+                    configuration, result = results.get(timeout=remaining)
+                except queue.Empty:
+                    raise subprocess.TimeoutExpired(cls.SOLC_VERIFY_CMD, timeout)
+                finished[configuration.name] = result
+                if result.definitive:
+                    result.solver = configuration.name
+                    break
+        finally:
+            for process in processes:
+                if process.poll() is None:
+                    kill_process_group(process)
+        winner = next((result for result in finished.values() if result.solver), None) or finished[portfolio[0].name]
+        if output_dir:
+            # The Boogie program of the answer taken is kept as with call_solc
+            winner_dir = os.path.join(output_dir, winner.solver or portfolio[0].name)
+            for file_name in os.listdir(winner_dir) if os.path.isdir(winner_dir) else ():
+                os.replace(os.path.join(winner_dir, file_name), os.path.join(output_dir, file_name))
+        return winner
+
+    @staticmethod
+    def _wait(configuration: SolverConfiguration, process: subprocess.Popen, results: queue.Queue) -> None:
+        stdout, stderr = process.communicate()
+        results.put((configuration, VerificationResult(process.returncode, stdout + stderr)))
+
+    @staticmethod
+    def timeout_output(timeout_expired: subprocess.TimeoutExpired, seconds: float) -> str:
+        # The verdicts printed before the verification was stopped, then the reason
+        output = "".join(stream if isinstance(stream, str) else stream.decode(errors="replace")
+                         for stream in (timeout_expired.stdout, timeout_expired.stderr) if stream)
+        return output + f"Verification timed out after {seconds:g} seconds, the other functions were not verified.\n"
+
+    @staticmethod
+    def job_path(path: str, job_id: Optional[str]) -> str:
+        # e.g. ./temp/spec.sol -> ./temp/spec_<job_id>.sol
+        if not job_id:
+            return path
+        root, extension = os.path.splitext(path)
+        return f"{root}_{job_id}{extension}"
+
+    @classmethod
+    def merge(cls, solidity_spec_str: str, spec_path: str, merge_path: str, timings: Dict[str, float],
+              precomputed: bool = False) -> None:
+        """
+        Writes the merged contract of the spec (saved in spec_path) to
+        merge_path. With precomputed, the annotations are read from the spec
+        text and merged into the precomputed template instead of compiling
+        the spec, see dbc_gpt.templates. Raises RuntimeError (returncode,
+        output) if the spec does not compile.
+        """
+        from solc_verify_generator.main import generate_merge
+        # solc reads /** */ annotations too, the text is only read for /// ones
+        if precomputed and "/**" not in solidity_spec_str:
+            start_time = time.perf_counter()
+            merge = template_artifacts(cls.TEMPLATE_PATH, cls.MERGE_PATH).merge(solidity_spec_str, cls.PREFIX)
+            with open(merge_path, "w") as merge_file:
+                merge_file.write(merge)
+            timings["merge"] = time.perf_counter() - start_time
+            return
+        generate_merge(spec_path, cls.TEMPLATE_PATH, merge_path, prefix=cls.PREFIX, timings=timings)
+
+    @classmethod
+    @traced("SolcVerifyWrapper.verify")
+    def verify(cls, solidity_spec_str: str, job_id: Optional[str] = None,
+               timeout: Optional[float] = None, output_dir: Optional[str] = None,
+               solver: Optional[BoogieSolver] = None,
+               portfolio: Sequence[SolverConfiguration] = (),
+               limits: Optional[VerificationLimits] = None, precomputed: bool = False) -> VerificationResult:
+        """
+        Parameters
+            solidity_spec_str: Solidity code with only the function signatures
+            annotated with solc-verify conditions
+            job_id: when given, the spec, AST and merge files are private to
+            this job (and removed afterwards), so jobs can run concurrently
+            timeout: seconds left to the run, subprocess.TimeoutExpired is
+            raised when they are exceeded, see call_solc
+            output_dir: directory solc-verify writes the Boogie program to
+            solver: translates and solves in two stages instead of running
+            solc-verify, see dbc_gpt.boogie.BoogieSolver
+            portfolio: solver configurations solc-verify is raced with, see call_portfolio
+            limits: wall-clock, memory and solver time limits of the
+            verification, a verification stopped by them is timed out
+            instead of raising
+            precomputed: merges the annotations into the precomputed
+            template instead of compiling the spec, see merge
+        """
+        limits = limits or VerificationLimits()
+        limited = limits.seconds is not None and (timeout is None or limits.seconds < timeout)
+        spec_path = cls.job_path(cls.SPEC_FILE_PATH, job_id)
+        # The merge contract stays next to the implementation, it imports files relatively
+        merge_path = cls.job_path(cls.MERGE_PATH, job_id)
+        Utils.save_string_to_file(spec_path, solidity_spec_str)
+        from solc_verify_generator.main import ast_path
+        timings = {}
+        try:
+            cls.merge(solidity_spec_str, spec_path, merge_path, timings, precomputed)
+            start_time = time.perf_counter()
+            wall_clock = limits.seconds if limited else timeout
+            if solver:
+                verification_result = VerificationResult(*solver.verify(merge_path, timings, wall_clock, output_dir,
+                                                                        limits.memory_mb))
+            elif portfolio:
+                verification_result = cls.call_portfolio(merge_path, portfolio, wall_clock, output_dir, limits)
+                timings["solc_verify"] = time.perf_counter() - start_time
+                if verification_result.solver:
+                    metrics.PORTFOLIO_WINS.inc(verifier=cls.__name__, solver=verification_result.solver)
+            else:
+                verification_result = cls.call_solc(merge_path, wall_clock, output_dir, limits)
+                timings["solc_verify"] = time.perf_counter() - start_time
+            metrics.SOLC_VERIFY_SECONDS.observe(time.perf_counter() - start_time, verifier=cls.__name__)
+        except RuntimeError as e:
+            verification_result = VerificationResult(*e.args)
+        except subprocess.TimeoutExpired as e:
+            if not limited:
+                raise
+            timings["solve" if solver else "solc_verify"] = time.perf_counter() - start_time
+            metrics.VERIFICATION_TIMEOUTS.inc(verifier=cls.__name__)
+            verification_result = VerificationResult(1, cls.timeout_output(e, limits.seconds), timed_out=True)
+        finally:
+            if job_id:
+                for path in (spec_path, ast_path(spec_path), merge_path):
+                    if os.path.isfile(path):
+                        os.remove(path)
+        verification_result.timings = timings
+        return verification_result
+
+    @classmethod
+    @traced("SolcVerifyWrapper.verify_batch")
+    def verify_batch(cls, solidity_spec_strs: Sequence[str], job_id: Optional[str] = None,
+                     timeout: Optional[float] = None, solver: Optional[BoogieSolver] = None,
+                     portfolio: Sequence[SolverConfiguration] = (),
+                     limits: Optional[VerificationLimits] = None,
+                     precomputed: bool = False) -> List[VerificationResult]:
+        """
+        Verifies several candidate specifications (e.g. the rows of a results
+        CSV) with a single solc-verify run, or a single translation and
+        Boogie program, instead of paying its startup for each of them, see
+        dbc_gpt.batching.Batch. Returns their results in order, as verify
+        would. A candidate the batch has no verdict for, e.g. because its
+        annotations do not compile, is verified on its own.
+
+        limits.seconds is the wall-clock limit of each candidate, the batch
+        gets their sum. The other parameters are the ones of verify.
+        """
+        job_id = job_id or uuid.uuid4().hex[:12]
+        limits = limits or VerificationLimits()
+        from solc_verify_generator.main import ast_path
+        results: List[Optional[VerificationResult]] = [None] * len(solidity_spec_strs)
+        timings = [{} for _ in solidity_spec_strs]
+        merges, batched = [], []
+        for index, solidity_spec_str in enumerate(solidity_spec_strs):
+            spec_path = cls.job_path(cls.SPEC_FILE_PATH, f"{job_id}_{index}")
+            merge_path = cls.job_path(cls.MERGE_PATH, f"{job_id}_{index}")
+            Utils.save_string_to_file(spec_path, solidity_spec_str)
+            try:
+                cls.merge(solidity_spec_str, spec_path, merge_path, timings[index], precomputed)
+                with open(merge_path) as merge_file:
+                    merges.append(merge_file.read())
+                batched.append(index)
+            except RuntimeError as e:
+                results[index] = VerificationResult(*e.args)
+            finally:
+                for path in (spec_path, ast_path(spec_path), merge_path):
+                    if os.path.isfile(path):
+                        os.remove(path)
+        if merges:
+            start_time = time.perf_counter()
+            cls._verify_batch(Batch(merges), batched, results, timings, job_id, timeout, solver, portfolio, limits)
+            metrics.SOLC_VERIFY_SECONDS.observe(time.perf_counter() - start_time, verifier=cls.__name__)
+        for index, solidity_spec_str in enumerate(solidity_spec_strs):
+            if results[index] is None:
+                metrics.BATCHED_CANDIDATES.inc(verifier=cls.__name__, result="fallback")
+                results[index] = cls.verify(solidity_spec_str, f"{job_id}_{index}", timeout, None, solver, portfolio,
+                                            limits, precomputed)
+                results[index].timings = {**timings[index], **results[index].timings}
+            else:
+                results[index].timings = timings[index]
+        return results
+
+    @classmethod
+    def _verify_batch(cls, batch: Batch, batched: List[int], results: List[Optional[VerificationResult]],
+                      timings: List[Dict[str, float]], job_id: str, timeout: Optional[float],
+                      solver: Optional[BoogieSolver], portfolio: Sequence[SolverConfiguration],
+                      limits: VerificationLimits) -> None:
+        # Fills the results (and timings) of the batched candidates, leaves None those it has no verdict for
+        if limits.seconds is not None:
+            limits = replace(limits, seconds=limits.seconds * len(batched))
+        limited = limits.seconds is not None and (timeout is None or limits.seconds < timeout)
+        wall_clock = limits.seconds if limited else timeout
+        batch_path = cls.job_path(cls.MERGE_PATH, f"{job_id}_batch")
+        Utils.save_string_to_file(batch_path, batch.text)
+        batch_timings = {}
+        timed_out = False
+        start_time = time.perf_counter()
+        try:
+            if solver:
+                _status, output = solver.verify(batch_path, batch_timings, wall_clock, None, limits.memory_mb)
+            elif portfolio:
+                output = cls.call_portfolio(batch_path, portfolio, wall_clock, None, limits).output
+            else:
+                output = cls.call_solc(batch_path, wall_clock, None, limits).output
+        except subprocess.TimeoutExpired as e:
+            if not limited:
+                raise
+            metrics.VERIFICATION_TIMEOUTS.inc(verifier=cls.__name__)
+            output = cls.timeout_output(e, limits.seconds)
+            timed_out = True
+        finally:
+            os.remove(batch_path)
+        if not batch_timings:
+            batch_timings["solc_verify"] = time.perf_counter() - start_time
+        # Each candidate is charged its share of the batch
+        for index in batched:
+            timings[index].update({phase: seconds / len(batched) for phase, seconds in batch_timings.items()})
+        merge_path = cls.job_path(cls.MERGE_PATH, job_id)
+        for index, (status, candidate_output) in zip(batched, batch.split(output, batch_path, merge_path)):
+            if candidate_output is None and timed_out:
+                # The batch was stopped before any verdict of this candidate
+                candidate_output = cls.timeout_output(subprocess.TimeoutExpired(batch_path, limits.seconds),
+                                                      limits.seconds)
+            if candidate_output is not None:
+                metrics.BATCHED_CANDIDATES.inc(verifier=cls.__name__, result="batched")
+                results[index] = VerificationResult(status, candidate_output, timed_out=timed_out)
+
+
+class ERC20Verifier(SolcVerifyWrapper):
+    TEMPLATE_PATH = './solc_verify_generator/ERC20/templates/imp_spec_merge.template'
+    MERGE_PATH = './solc_verify_generator/ERC20/imp/ERC20_merge.sol'
+
+
+class ERC20RefinementVerifier(ERC20Verifier):
+    TEMPLATE_PATH = './solc_verify_generator/ERC20/templates/spec_refinement.template'
+    PREFIX = 'nw'
+
+
+class ERC721Verifier(SolcVerifyWrapper):
+    TEMPLATE_PATH = './solc_verify_generator/ERC721/templates/imp_spec_merge.template'
+    MERGE_PATH = './solc_verify_generator/ERC721/imp/ERC721_merge.sol'
+
+
+class ERC1155Verifier(SolcVerifyWrapper):
+    TEMPLATE_PATH = './solc_verify_generator/ERC1155/templates/imp_spec_merge.template'
+    MERGE_PATH = './solc_verify_generator/ERC1155/imp/ERC1155_merge.sol'
+
+
+# [$verifierName] -> verifier, used to refer to verifiers in serialized jobs
+VERIFIERS = {verifier.__name__: verifier for verifier in (
+    ERC20Verifier, ERC20RefinementVerifier, ERC721Verifier, ERC1155Verifier
+)}
@@ -0,0 +1,367 @@
+import argparse
+import glob
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+import traceback
+import uuid
+from collections import defaultdict
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from dbc_gpt import metrics
+from dbc_gpt.boogie import BoogieSolver, VerdictCache
+from dbc_gpt.budget import Budget, Limits
+from dbc_gpt.cascade import DEFAULT_TIERS, default_tier
+from dbc_gpt.counterexamples import CounterexampleExplainer
+from dbc_gpt.falsifier import Falsifier
+from dbc_gpt.job_queue import LEASED, PENDING, JobQueue, QueuedJob
+from dbc_gpt.llm import HedgePolicy
+from dbc_gpt.loop import new_run_state, prompt_message, run_loop, run_result
+from dbc_gpt.minimizer import PostconditionMinimizer
+from dbc_gpt.normalizer import spec_digest
+from dbc_gpt.pipeline import LOOP_FILES_DIR, RunConfig, load_config
+from dbc_gpt.prompts import PromptBuilder
+from dbc_gpt.timeouts import AdaptiveTimeouts
+from dbc_gpt.usage import summarize_usage
+from dbc_gpt.utils import Utils
+from dbc_gpt.verifier import VERIFIERS, SolverConfiguration, VerificationLimits
+
+GENERATE = "generate"
+VERIFY = "verify"
+
+
+@lru_cache(maxsize=None)
+def cached_config(loop_file: str) -> RunConfig:
+    return load_config(os.path.join(LOOP_FILES_DIR, loop_file))
+
+
+@lru_cache(maxsize=None)
+def hedge_policy(loop_file: str) -> HedgePolicy:
+    # Each configuration learns its own hedging threshold, see Pipeline
+    return HedgePolicy()
+
+
+def prompt_builder(options: Optional[Dict[str, Any]]) -> Optional[PromptBuilder]:
+    # options are the keyword arguments of PromptBuilder, None to use the PROMPT of the loop script
+    return PromptBuilder(**options) if options is not None else None
+
+
+@lru_cache(maxsize=None)
+def falsifier(sequences: int) -> Falsifier:
+    # One per worker process, its chain and deployments are reused by the jobs
+    return Falsifier(sequences)
+
+
+@lru_cache(maxsize=None)
+def minimizer(workers: int) -> PostconditionMinimizer:
+    # One per worker process, the jobs share its threads and cached verdicts
+    return PostconditionMinimizer(workers)
+
+
+def solver(options: Optional[Dict[str, Any]]) -> Optional[BoogieSolver]:
+    # options are the keyword arguments of BoogieSolver (verdict_cache and timeouts bools), None to run solc-verify
+    return cached_solver(tuple(sorted(options.items()))) if options is not None else None
+
+
+@lru_cache(maxsize=None)
+def cached_solver(options: tuple) -> BoogieSolver:
+    # One per worker process and options, the jobs share its Boogie processes and translation cache
+    options = dict(options)
+    if options.pop("verdict_cache", False):
+        options["verdict_cache"] = VerdictCache()
+    if options.pop("timeouts", False):
+        options["timeouts"] = AdaptiveTimeouts()
+    return BoogieSolver(**options)
+
+
+def portfolio(configurations: Optional[List[str]]) -> Tuple[SolverConfiguration, ...]:
+    # configurations as given on the command line, see SolverConfiguration.parse
+    return tuple(SolverConfiguration.parse(configuration) for configuration in configurations or ())
+
+
+def verification_limits(options: Optional[Dict[str, Any]]) -> Optional[VerificationLimits]:
+    # options are the fields of VerificationLimits
+    return VerificationLimits(**options) if options else None
+
+
+def add_solver_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--staged", help="Translate to Boogie (cached by merged source) and solve in two "
+                        "stages instead of running solc-verify", action="store_true")
+    parser.add_argument("--procedure-workers", help="With --staged, Boogie procedures solved concurrently",
+                        default=1, type=int)
+    parser.add_argument("--procedure-timeout", help="With --staged, wall-clock seconds of each procedure",
+                        default=None, type=float)
+    parser.add_argument("--verdict-cache", help="With --staged, reuse the verdicts of unchanged procedures",
+                        action="store_true")
+    parser.add_argument("--adaptive-timeouts", help="With --staged, learn the solver time limit of each function "
+                        "from its past proofs and retry timed out procedures once", action="store_true")
+    parser.add_argument("--portfolio", help="Race solc-verify with these solver configurations and take the first "
+                        "definitive answer, e.g. z3 cvc4 (not with --staged)", nargs="+", default=None)
+    parser.add_argument("--verification-seconds", help="Wall-clock limit of each verification, its verdict is "
+                        "timeout after it", default=None, type=float)
+    parser.add_argument("--verification-memory", help="Memory limit (MB) of solc-verify and of each process it runs",
+                        default=None, type=int)
+    parser.add_argument("--solver-timeout", help="Seconds the solver may spend on each function (solc-verify "
+                        "--timeout, or the Boogie time limit with --staged)", default=None, type=int)
+    parser.add_argument("--precomputed-templates", help="Merge the annotations into the implementation precomputed "
+                        "once per template instead of compiling each spec", action="store_true")
+
+
+def limits_options(args) -> Dict[str, Any]:
+    return {"seconds": args.verification_seconds, "memory_mb": args.verification_memory,
+            "solver_timeout": args.solver_timeout}
+
+
+def solver_options(args) -> Optional[Dict[str, Any]]:
+    if not args.staged:
+        return None
+    options = {"workers": args.procedure_workers, "procedure_timeout": args.procedure_timeout,
+               "verdict_cache": args.verdict_cache, "timeouts": args.adaptive_timeouts}
+    if args.solver_timeout is not None:
+        options["solver_timeout"] = args.solver_timeout
+    return options
+
+
+def run_generate_job(payload: Dict[str, Any], run_limits: Limits) -> Dict[str, Any]:
+    config = cached_config(payload["loop_file"])
+    tiers = (DEFAULT_TIERS if payload.get("cascade") else config.tiers) or [default_tier(config.assistant_id)]
+    start_time = time.time()
+    state = new_run_state(config.verifier, tiers, hedge_policy(payload["loop_file"]), job_id=uuid.uuid4().hex[:12],
+                          budget=Budget(run_limits), prompt_builder=prompt_builder(payload.get("prompt_builder")),
+                          target=config.target, repair=payload.get("repair", False),
+                          falsifier=falsifier(payload["falsify"]) if payload.get("falsify") else None,
+                          explainer=CounterexampleExplainer() if payload.get("counterexamples") else None,
+                          solver=solver(payload.get("solver")), portfolio=portfolio(payload.get("portfolio")),
+                          verification_limits=verification_limits(payload.get("limits")),
+                          precomputed_templates=payload.get("precomputed", False),
+                          minimizer=minimizer(payload["minimize"]) if payload.get("minimize") else None)
+    result = run_loop(state, prompt_message(state, config.prompt, config.examples))
+    return run_result(payload["run"], state, result, time.time() - start_time)
+
+
+def run_verify_job(payload: Dict[str, Any]) -> Union[Dict[str, Any], List[Dict[str, Any]]]:
+    if "specs" in payload:
+        return run_verify_batch_job(payload)
+    verifier = VERIFIERS[payload["verifier"]]
+    verification_result = verifier.verify(payload["spec"], job_id=uuid.uuid4().hex[:12],
+                                          solver=solver(payload.get("solver")),
+                                          portfolio=portfolio(payload.get("portfolio")),
+                                          limits=verification_limits(payload.get("limits")),
+                                          precomputed=payload.get("precomputed", False))
+    return {
+        "run": payload["run"],
+        "spec_digest": spec_digest(payload["spec"]),
+        "status": verification_result.status,
+        "verdict": verification_result.verdict,
+        "output": verification_result.output,
+    }
+
+
+def run_verify_batch_job(payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+    # One result row per run of the batch, see SolcVerifyWrapper.verify_batch
+    verifier = VERIFIERS[payload["verifier"]]
+    verification_results = verifier.verify_batch(payload["specs"], job_id=uuid.uuid4().hex[:12],
+                                                 solver=solver(payload.get("solver")),
+                                                 portfolio=portfolio(payload.get("portfolio")),
+                                                 limits=verification_limits(payload.get("limits")),
+                                                 precomputed=payload.get("precomputed", False))
+    return [{
+        "run": run,
+        "spec_digest": spec_digest(spec),
+        "status": verification_result.status,
+        "verdict": verification_result.verdict,
+        "output": verification_result.output,
+    } for run, spec, verification_result in zip(payload["runs"], payload["specs"], verification_results)]
+
+
+def heartbeat(db_path: str, job: QueuedJob, worker_id: str, lease_seconds: float, stop: threading.Event) -> None:
+    # sqlite connections should not be shared between threads in a transaction
+    job_queue = JobQueue(db_path)
+    try:
+        while not stop.wait(lease_seconds / 3):
+            if not job_queue.heartbeat(job.id, worker_id, lease_seconds):
+                logging.warning(f"lost the lease of job {job.id}")
+                break
+    finally:
+        job_queue.close()
+
+
+def work(args) -> None:
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    job_queue = JobQueue(args.db)
+    run_limits = Limits(args.run_seconds, args.run_tokens, args.run_solver_seconds)
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+    while True:
+        job = job_queue.lease(worker_id, args.kinds, args.lease)
+        if job is None:
+            counts = job_queue.counts()
+            if args.exit_when_idle and not counts.get(PENDING) and not counts.get(LEASED):
+                break
+            time.sleep(args.poll_interval)
+            continue
+
+        logging.info(f"{worker_id} running job {job.id} (attempt {job.attempts})")
+        stop = threading.Event()
+        beat = threading.Thread(target=heartbeat, args=(args.db, job, worker_id, args.lease, stop), daemon=True)
+        beat.start()
+        try:
+            if job.kind == GENERATE:
+                result = run_generate_job(job.payload, run_limits)
+            else:
+                result = run_verify_job(job.payload)
+        except Exception:
+            job_queue.fail(job.id, worker_id, traceback.format_exc())
+        else:
+            if not job_queue.complete(job.id, result):
+                logging.info(f"job {job.id} already had a result, discarding this one")
+        finally:
+            stop.set()
+            beat.join()
+    job_queue.close()
+
+
+def enqueue_matrix(args) -> None:
+    job_queue = JobQueue(args.db)
+    options = None
+    if args.prompt_builder:
+        options = {"eip_top_k": args.eip_sections, "eip_token_budget": args.eip_tokens,
+                   "example_token_budget": args.example_tokens}
+    added = 0
+    for path in sorted(glob.glob(os.path.join(LOOP_FILES_DIR, args.pattern))):
+        loop_file = os.path.basename(path)
+        config = cached_config(loop_file)
+        for run in range(1, config.runs + 1):
+            payload = {"loop_file": loop_file, "run": run, "output_file": f"{config.name}.csv",
+                       "prompt_builder": options, "cascade": args.cascade, "repair": args.repair,
+                       "falsify": args.falsify, "counterexamples": args.counterexamples, "minimize": args.minimize,
+                       "solver": solver_options(args), "portfolio": args.portfolio,
+                       "limits": limits_options(args), "precomputed": args.precomputed_templates}
+            added += job_queue.enqueue(f"{GENERATE}:{config.name}:{run}", GENERATE, payload, args.max_attempts)
+    print(f"{added} generation jobs enqueued")
+
+
+def enqueue_verification(args) -> None:
+    import pandas as pd
+    job_queue = JobQueue(args.db)
+    df = pd.read_csv(args.csv)
+    df = df[df['annotated_contract'].notna()]
+    name = os.path.splitext(os.path.basename(args.csv))[0]
+    added = 0
+    if args.batch > 1:
+        for start in range(0, len(df), args.batch):
+            rows = df.iloc[start:start + args.batch]
+            runs = [int(run) for run in rows['run']]
+            payload = {
+                "verifier": args.verifier,
+                "specs": list(rows['annotated_contract']),
+                "runs": runs,
+                "output_file": f"{name}_{args.verifier}.csv",
+                "solver": solver_options(args),
+                "portfolio": args.portfolio,
+                "limits": limits_options(args),
+                "precomputed": args.precomputed_templates,
+            }
+            added += job_queue.enqueue(f"{VERIFY}:{args.verifier}:{name}:{runs[0]}-{runs[-1]}", VERIFY, payload,
+                                       args.max_attempts)
+        print(f"{added} verification batch jobs enqueued")
+        return
+    for _, row in df.iterrows():
+        payload = {
+            "verifier": args.verifier,
+            "spec": row['annotated_contract'],
+            "run": int(row['run']),
+            "output_file": f"{name}_{args.verifier}.csv",
+            "solver": solver_options(args),
+            "portfolio": args.portfolio,
+            "limits": limits_options(args),
+            "precomputed": args.precomputed_templates,
+        }
+        added += job_queue.enqueue(f"{VERIFY}:{args.verifier}:{name}:{row['run']}", VERIFY, payload,
+                                   args.max_attempts)
+    print(f"{added} verification jobs enqueued")
+
+
+def collect(args) -> None:
+    job_queue = JobQueue(args.db)
+    print(job_queue.counts())
+    for kind in (GENERATE, VERIFY):
+        results = defaultdict(list)
+        for job in job_queue.results(kind):
+            # Batched verification jobs have a row per run
+            results[job.payload["output_file"]].extend(job.result if isinstance(job.result, list) else [job.result])
+        for output_file, rows in results.items():
+            rows.sort(key=lambda row: row["run"])
+            Utils.save_results_to_csv(os.path.join(args.output_dir, output_file), rows)
+        if kind == GENERATE and results:
+            summaries = [summarize_usage(os.path.splitext(output_file)[0], rows)
+                         for output_file, rows in results.items()]
+            Utils.save_results_to_csv(os.path.join(args.output_dir, "usage_summary.csv"), summaries)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+    parser = argparse.ArgumentParser("Distributed experiment runner backed by a shared SQLite job queue")
+    parser.add_argument("--db", help="Path of the SQLite job queue", default="jobs.db", type=str)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    matrix_parser = subparsers.add_parser("enqueue-matrix", help="Enqueue one generation job per run of the loop scripts")
+    matrix_parser.add_argument("--pattern", default="loop*.py", type=str)
+    matrix_parser.add_argument("--max-attempts", default=3, type=int)
+    matrix_parser.add_argument("--prompt-builder", help="Build the prompts from assets/prompts, see PromptBuilder",
+                               action="store_true")
+    matrix_parser.add_argument("--eip-sections", help="With --prompt-builder, number of EIP sections included",
+                               default=None, type=int)
+    matrix_parser.add_argument("--eip-tokens", help="With --prompt-builder, token budget of the EIP sections",
+                               default=None, type=int)
+    matrix_parser.add_argument("--example-tokens", help="With --prompt-builder, token budget of function-level examples",
+                               default=None, type=int)
+    matrix_parser.add_argument("--cascade", help="Route every run through the model tiers of "
+                               "dbc_gpt.cascade.DEFAULT_TIERS, from the cheapest to the strongest",
+                               action="store_true")
+    matrix_parser.add_argument("--repair", help="Repair the extracted specifications locally before verifying them",
+                               action="store_true")
+    matrix_parser.add_argument("--falsify", help="Refute specifications with this many random call sequences on a "
+                               "local ganache chain before running solc-verify", default=None, type=int)
+    matrix_parser.add_argument("--counterexamples", help="Feed back the solver counterexamples of the failing "
+                               "postconditions instead of the solc-verify output", action="store_true")
+    matrix_parser.add_argument("--minimize", help="Find the postconditions each failing function fails because of, "
+                               "verifying subsets of them in this many threads", default=None, type=int)
+    add_solver_arguments(matrix_parser)
+    matrix_parser.set_defaults(handler=enqueue_matrix)
+
+    verify_parser = subparsers.add_parser("enqueue-verification",
+                                          help="Enqueue one verification job per annotated contract of a results CSV")
+    verify_parser.add_argument("csv", type=str)
+    verify_parser.add_argument("--verifier", default="ERC20RefinementVerifier", choices=sorted(VERIFIERS))
+    verify_parser.add_argument("--max-attempts", default=3, type=int)
+    verify_parser.add_argument("--batch", help="Verify this many annotated contracts per job with a single solc-verify "
+                               "run", default=1, type=int)
+    add_solver_arguments(verify_parser)
+    verify_parser.set_defaults(handler=enqueue_verification)
+
+    work_parser = subparsers.add_parser("work", help="Pull and run jobs")
+    work_parser.add_argument("--kinds", nargs="+", default=[GENERATE, VERIFY], choices=[GENERATE, VERIFY])
+    work_parser.add_argument("--lease", help="Lease duration in seconds", default=300, type=float)
+    work_parser.add_argument("--poll-interval", default=5, type=float)
+    work_parser.add_argument("--exit-when-idle", action="store_true")
+    work_parser.add_argument("--run-seconds", default=None, type=float)
+    work_parser.add_argument("--run-tokens", default=None, type=int)
+    work_parser.add_argument("--run-solver-seconds", default=None, type=float)
+    work_parser.add_argument("--metrics-port", help="Serves Prometheus metrics on http://127.0.0.1:<port>/metrics",
+                             default=None, type=int)
+    work_parser.set_defaults(handler=work)
+
+    collect_parser = subparsers.add_parser("collect", help="Write the finished results to CSV files")
+    collect_parser.add_argument("--output-dir", default=".", type=str)
+    collect_parser.set_defaults(handler=collect)
+
+    args = parser.parse_args()
+    if getattr(args, "staged", False) and args.portfolio:
+        # The staged solver runs a single Boogie configuration, the portfolio would be ignored
+        parser.error("--portfolio cannot be combined with --staged")
+    args.handler(args)
@@ -0,0 +1,124 @@
+import argparse
+
+from dbc_gpt import metrics, tracing
+from dbc_gpt.boogie import SOLVER_TIMEOUT, BoogieSolver, VerdictCache
+from dbc_gpt.budget import Limits
+from dbc_gpt.cascade import DEFAULT_TIERS
+from dbc_gpt.counterexamples import CounterexampleExplainer
+from dbc_gpt.falsifier import Falsifier
+from dbc_gpt.minimizer import PostconditionMinimizer
+from dbc_gpt.pipeline import Pipeline, load_configs
+from dbc_gpt.prompts import PromptBuilder
+from dbc_gpt.timeouts import AdaptiveTimeouts
+from dbc_gpt.usage import summarize_usage
+from dbc_gpt.utils import Utils
+from dbc_gpt.verifier import SolverConfiguration, VerificationLimits
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Runs the experiment matrix through the generation/verification pipeline")
+    parser.add_argument("--pattern", help="Glob of the loop scripts to run, e.g. 'loop20_*.py'",
+                        default="loop*.py", type=str)
+    parser.add_argument("--generate-workers", help="Concurrent model requests", default=8, type=int)
+    parser.add_argument("--verify-workers", help="Concurrent solc-verify processes (default: number of cores)",
+                        default=None, type=int)
+    parser.add_argument("--max-in-flight", help="Runs admitted in the pipeline at once", default=None, type=int)
+    parser.add_argument("--run-seconds", help="Wall-clock limit of each run", default=None, type=float)
+    parser.add_argument("--run-tokens", help="Token limit of each run", default=None, type=int)
+    parser.add_argument("--run-solver-seconds", help="Verification time limit of each run", default=None, type=float)
+    parser.add_argument("--seconds", help="Wall-clock limit of the whole matrix", default=None, type=float)
+    parser.add_argument("--tokens", help="Token limit of the whole matrix", default=None, type=int)
+    parser.add_argument("--solver-seconds", help="Verification time limit of the whole matrix", default=None, type=float)
+    parser.add_argument("--trace", help="Writes spans to this file, JSONL for '*.jsonl' and Chrome trace otherwise",
+                        default=None, type=str)
+    parser.add_argument("--metrics-port", help="Serves Prometheus metrics on http://127.0.0.1:<port>/metrics",
+                        default=None, type=int)
+    parser.add_argument("--prompt-builder", help="Builds the prompts from the segments in assets/prompts instead of "
+                        "using the PROMPT of the loop scripts", action="store_true")
+    parser.add_argument("--eip-sections", help="With --prompt-builder, include only this many EIP sections, "
+                        "the most relevant to the functions to annotate", default=None, type=int)
+    parser.add_argument("--eip-tokens", help="With --prompt-builder, token budget of the EIP sections included",
+                        default=None, type=int)
+    parser.add_argument("--example-tokens", help="With --prompt-builder, replaces the example interfaces by the most "
+                        "similar function-level examples within this token budget", default=None, type=int)
+    parser.add_argument("--cascade", help="Routes every run through the model tiers of dbc_gpt.cascade.DEFAULT_TIERS, "
+                        "escalating from the cheapest to the strongest one", action="store_true")
+    parser.add_argument("--repair", help="Repairs the extracted specifications locally (function bodies, missing "
+                        "semicolons, extra postconditions, old values of bools) before verifying them",
+                        action="store_true")
+    parser.add_argument("--falsify", help="Refutes specifications with this many random call sequences on a local "
+                        "ganache chain before running solc-verify", default=None, type=int)
+    parser.add_argument("--counterexamples", help="Feeds back the solver counterexamples of the failing postconditions "
+                        "instead of the solc-verify output", action="store_true")
+    parser.add_argument("--minimize", help="Adds to the feedback the postconditions each failing function fails "
+                        "because of, found by verifying subsets of them in this many concurrent verifications",
+                        default=None, type=int)
+    parser.add_argument("--staged", help="Translates to Boogie and solves in two stages instead of running "
+                        "solc-verify, translations are cached by merged source in ./temp/bpl_cache",
+                        action="store_true")
+    parser.add_argument("--procedure-workers", help="With --staged, solves the Boogie procedures (one per function) "
+                        "in this many concurrent processes", default=1, type=int)
+    parser.add_argument("--procedure-timeout", help="With --staged, wall-clock seconds of the Boogie process of "
+                        "each procedure, TIMEOUT is its verdict after them", default=None, type=float)
+    parser.add_argument("--verdict-cache", help="With --staged, reuses the verdicts of the procedures already solved "
+                        "with the same dependencies, cached in ./temp/verdict_cache", action="store_true")
+    parser.add_argument("--adaptive-timeouts", help="With --staged, gives each function the solver time limit "
+                        "learned from its past proofs (./temp/solver_timings.json) and retries the procedures "
+                        "that time out once with a higher limit", action="store_true")
+    parser.add_argument("--portfolio", help="Races solc-verify with these solver configurations, 'z3', 'cvc4' or "
+                        "'name=solc-verify arguments', and takes the first definitive answer (not with --staged)",
+                        nargs="+", default=None)
+    parser.add_argument("--verification-seconds", help="Wall-clock limit of each verification, the verifier processes "
+                        "are killed after it and the verdict is timeout", default=None, type=float)
+    parser.add_argument("--verification-memory", help="Memory limit in MB of solc-verify and of each process it runs "
+                        "(Boogie, the solver)", default=None, type=int)
+    parser.add_argument("--solver-timeout", help="Seconds the solver may spend on each function, passed to "
+                        "solc-verify --timeout, or the Boogie time limit with --staged", default=None, type=int)
+    parser.add_argument("--precomputed-templates", help="Compiles the implementation of each merge template once "
+                        "(./temp/template_cache) and merges the /// annotations of each spec into it, instead of "
+                        "compiling every spec to read its annotations", action="store_true")
+    args = parser.parse_args()
+    if args.staged and args.portfolio:
+        # The staged solver runs a single Boogie configuration, the portfolio would be ignored
+        parser.error("--portfolio cannot be combined with --staged")
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+    if args.trace:
+        tracing.configure(args.trace)
+
+    pipeline = Pipeline(generate_workers=args.generate_workers, verify_workers=args.verify_workers,
+                        max_in_flight=args.max_in_flight,
+                        run_limits=Limits(args.run_seconds, args.run_tokens, args.run_solver_seconds),
+                        limits=Limits(args.seconds, args.tokens, args.solver_seconds),
+                        prompt_builder=PromptBuilder(eip_top_k=args.eip_sections, eip_token_budget=args.eip_tokens,
+                                                     example_token_budget=args.example_tokens)
+                        if args.prompt_builder else None,
+                        tiers=DEFAULT_TIERS if args.cascade else None,
+                        repair=args.repair,
+                        falsifier=Falsifier(args.falsify) if args.falsify else None,
+                        explainer=CounterexampleExplainer() if args.counterexamples else None,
+                        solver=BoogieSolver(solver_timeout=SOLVER_TIMEOUT if args.solver_timeout is None
+                                            else args.solver_timeout,
+                                            workers=args.procedure_workers,
+                                            procedure_timeout=args.procedure_timeout,
+                                            verdict_cache=VerdictCache() if args.verdict_cache else None,
+                                            timeouts=AdaptiveTimeouts() if args.adaptive_timeouts else None)
+                        if args.staged else None,
+                        portfolio=tuple(SolverConfiguration.parse(configuration)
+                                        for configuration in args.portfolio or ()),
+                        verification_limits=VerificationLimits(args.verification_seconds, args.verification_memory,
+                                                               args.solver_timeout),
+                        precomputed_templates=args.precomputed_templates,
+                        minimizer=PostconditionMinimizer(args.minimize) if args.minimize else None)
+    results = pipeline.run(load_configs(args.pattern))
+    for name, verification_results in results.items():
+        Utils.save_results_to_csv(f"{name}.csv", verification_results)
+    summaries = [summarize_usage(name, verification_results) for name, verification_results in results.items()]
+    Utils.save_results_to_csv("usage_summary.csv", summaries)
+    for summary in summaries:
+        print(f"{summary['configuration']}: {summary['cached_ratio']:.1%} of {summary['prompt_tokens']} "
+              f"prompt tokens cached")
+        if args.repair:
+            print(f"{summary['configuration']}: {summary['llm_calls_saved']} model calls saved by local repairs")
+        if args.portfolio:
+            print(f"{summary['configuration']}: verifications answered first by {summary['solver_wins']}")
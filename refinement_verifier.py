@@ -1,10 +1,13 @@
 import logging
 import sys
 import re
+import subprocess
 import pandas as pd
 from dataclasses import dataclass
 from typing import List
 
+from dbc_gpt.processes import run
+
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
 
 # Initialize the global verification status
@@ -14,6 +17,14 @@ verification_status = []
 class VerificationResult:
     status: int
     output: str
+    # solc-verify was killed after SolcVerifyWrapper.TIMEOUT seconds
+    timed_out: bool = False
+
+    @property
+    def verdict(self) -> str:
+        if self.timed_out:
+            return "timeout"
+        return "failed" if self.status else "verified"
 
 class SolcVerifyWrapper:
 
@@ -21,12 +32,24 @@ class SolcVerifyWrapper:
     SPEC_FILE_PATH = './temp/spec.sol'
     ERC20_TEMPLATE_PATH = './solc_verify_generator/ERC20/templates/spec_refinement.template'
     ERC20_MERGE_PATH = './solc_verify_generator/ERC20/imp/ERC20_merge.sol'
+    # Wall-clock seconds of a solc-verify run, None for no limit
+    TIMEOUT = 600
+    # Data segment of solc-verify and of each process it runs (Boogie, the solver), in megabytes
+    MEMORY_MB = 4096
+    # Seconds the solver may spend on each function (solc-verify --timeout), None for its default
+    SOLVER_TIMEOUT = None
 
     @classmethod
     def call_solc(cls, file_path) -> VerificationResult:
-        from subprocess import PIPE, run
         command = [cls.SOLC_VERIFY_CMD, file_path]
-        result = run(command, stdout=PIPE, stderr=PIPE, universal_newlines=True)
+        if cls.SOLVER_TIMEOUT:
+            command += ["--timeout", str(cls.SOLVER_TIMEOUT)]
+        try:
+            # solc-verify, Boogie and the solver are killed together once the timeout expires
+            result = run(command, cls.TIMEOUT, cls.MEMORY_MB)
+        except subprocess.TimeoutExpired as e:
+            return VerificationResult(1, (e.stdout or "") + f"Verification timed out after {cls.TIMEOUT} seconds\n",
+                                      timed_out=True)
         return VerificationResult(result.returncode, result.stdout + result.stderr)
     
     @classmethod
@@ -97,6 +120,7 @@ def run_refinement_verification_process():
             verification_results.append({
                 'run': run_number,
                 'status': -1,
+                'verdict': 'error',
                 'output': str(e)
             })
             continue
@@ -104,6 +128,7 @@ def run_refinement_verification_process():
         verification_results.append({
             'run': run_number,
             'status': verification_result.status,
+            'verdict': verification_result.verdict,
             'output': verification_result.output
         })
 
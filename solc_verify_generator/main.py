@@ -4,17 +4,32 @@ import os
 import re
 import string
 import argparse
+import time
 from typing import Tuple, Dict
 
+try:
+    from dbc_gpt.tracing import traced
+except ImportError:
+    # Running standalone, without the experiments tracing
+    def traced(name):
+        return lambda function: function
+
 SOLC = "solc"
 SPEC_PATH = os.path.join("temp", "spec.sol_json.ast")
 
 
-def call_solc(file_path):
-    if os.path.isfile(SPEC_PATH):
-        os.remove(SPEC_PATH)
+def ast_path(file_path: str, output_dir: str = "temp") -> str:
+    # solc names the AST after the source file, e.g. temp/spec.sol_json.ast
+    return os.path.join(output_dir, os.path.basename(file_path) + "_json.ast")
+
+
+@traced("call_solc")
+def call_solc(file_path, output_dir="temp"):
+    file_ast_path = ast_path(file_path, output_dir)
+    if os.path.isfile(file_ast_path):
+        os.remove(file_ast_path)
     from subprocess import PIPE, run
-    command = [SOLC, file_path, "--ast-compact-json", "-o", "temp"]
+    command = [SOLC, file_path, "--ast-compact-json", "-o", output_dir]
     result = run(command, stdout=PIPE, stderr=PIPE, universal_newlines=True)
     return result
 
@@ -50,12 +65,20 @@ def add_triple_bars(value: str) -> str:
     return new_annotation
 
 
-def generate_merge(spec: str, imp_template: str, merge_file_path: str, prefix: str = None):
+@traced("generate_merge")
+def generate_merge(spec: str, imp_template: str, merge_file_path: str, prefix: str = None, timings: dict = None):
+    """
+    When a timings dict is given, the seconds spent generating the AST
+    ("solc_ast") and merging the annotations ("merge") are stored in it
+    """
+    timings = timings if timings is not None else {}
+    start_time = time.perf_counter()
     result = call_solc(spec)
+    timings["solc_ast"] = time.perf_counter() - start_time
     if result.returncode:
         # Something has gone wrong compiling the solidity code
         raise RuntimeError(result.returncode, result.stdout + result.stderr)
-    annotations, state_variables = parse_ast()
+    annotations, state_variables = parse_ast(ast_path(spec))
     process_annotations(annotations, state_variables, prefix)
 
     with open(imp_template, 'r') as impl_template_file:
@@ -64,12 +87,12 @@ def generate_merge(spec: str, imp_template: str, merge_file_path: str, prefix: s
     merge_contract = template.substitute(annotations)
     with open(merge_file_path, 'w') as merge_file:
         merge_file.write(merge_contract)
+    timings["merge"] = time.perf_counter() - start_time - timings["solc_ast"]
 
 
-def parse_ast() -> Tuple[Dict[str, dict], Dict[str, dict]]:
-    # Fixing this for simplicity for the time being
+def parse_ast(spec_ast_path: str = SPEC_PATH) -> Tuple[Dict[str, dict], Dict[str, dict]]:
     annotations, state_variables = dict({}), dict({})
-    with open(SPEC_PATH, 'r') as spec_file:
+    with open(spec_ast_path, 'r') as spec_file:
         spec_dict = json.load(spec_file)
         for node in spec_dict["nodes"]:
             if node["nodeType"] == "ContractDefinition":
@@ -0,0 +1,76 @@
+import unittest
+
+from dbc_gpt.minimizer import PostconditionMinimizer, postcondition_lines, without_lines
+from dbc_gpt.verifier import ERC20Verifier, VerificationResult
+
+SPEC = """contract ERC20 {
+    /// @notice postcondition a == 1
+    /// @notice postcondition b == 2 &&
+    ///     c == 3
+    /// @notice postcondition d == 4
+    function transfer(address to, uint value) public returns (bool success);
+
+    /// @notice postcondition p1
+    /// @notice postcondition p2
+    /// @notice postcondition p3
+    /// @notice postcondition p4
+    /// @notice postcondition p5
+    /// @notice postcondition x
+    /// @notice postcondition y
+    function approve(address spender, uint value) public returns (bool success);
+}"""
+
+
+class FakeVerifier:
+    """
+    transfer fails with its multi-line postcondition, approve with x and y
+    together. Records the specs verified, and fails on a continuation line
+    left without its tag.
+    """
+
+    def __init__(self) -> None:
+        self.specs = []
+
+    def __call__(self, verifier, code: str) -> VerificationResult:
+        self.specs.append(code)
+        lines = code.split("\n")
+        for index, line in enumerate(lines):
+            if line.strip() == "///     c == 3":
+                assert lines[index - 1].strip() == "/// @notice postcondition b == 2 &&", code
+        transfer, approve = code.split("function transfer")
+        transfer_verdict = "ERROR" if "b == 2" in transfer else "OK"
+        approve_verdict = "ERROR" if "postcondition x" in approve and "postcondition y" in approve else "OK"
+        return VerificationResult(1, f"ERC20::transfer: {transfer_verdict}\nERC20::approve: {approve_verdict}\n")
+
+
+class PostconditionMinimizerTest(unittest.TestCase):
+
+    def test_postcondition_lines_keep_continuation_lines(self):
+        postconditions = postcondition_lines(SPEC)
+        self.assertEqual(postconditions["transfer"], [[1], [2, 3], [4]])
+        self.assertEqual(len(postconditions["approve"]), 7)
+        dropped = without_lines(SPEC, postconditions["transfer"][1])
+        self.assertNotIn("b == 2", dropped)
+        self.assertNotIn("c == 3", dropped)
+
+    def test_minimize(self):
+        verify = FakeVerifier()
+        minimizer = PostconditionMinimizer(workers=2)
+        minimization = minimizer.minimize(ERC20Verifier, SPEC, verify(ERC20Verifier, SPEC), verify)
+        self.assertEqual(minimization.failing, {"transfer": ["b == 2 && c == 3"],
+                                                "approve": ["x", "y"]})
+        self.assertIn("- transfer: `b == 2 && c == 3`", minimization.describe())
+        # The verdicts of the subsets are cached
+        verified = len(verify.specs)
+        self.assertEqual(minimizer.minimize(ERC20Verifier, SPEC, verify(ERC20Verifier, SPEC), verify).failing,
+                         minimization.failing)
+        self.assertEqual(len(verify.specs), verified + 1)
+
+    def test_ddmin(self):
+        minimizer = PostconditionMinimizer(workers=2)
+        for failing in ({3}, {1, 6}, {0, 4, 7}):
+            self.assertEqual(minimizer._ddmin(list(range(8)), lambda kept: failing <= set(kept)), sorted(failing))
+
+
+if __name__ == "__main__":
+    unittest.main()